@@ -0,0 +1,111 @@
+"""
+Adaptive concurrency limits for requests to a Nominatim server.
+
+AdaptiveLimiter is a latency-gradient controller, in the style of Envoy's adaptive
+concurrency filter. It first runs a calibration window at a low limit to measure the
+baseline: the median latency of requests that do not queue on the server. After that,
+each window of requests compares its median latency with the baseline. The limit is
+scaled by latency_tolerance * baseline / median, so it shrinks as requests start
+queueing, plus sqrt(limit) of headroom so it keeps probing for spare capacity. A window
+with more than error_tolerance failed requests halves the limit instead. The baseline
+is re-measured every calibration_every windows, in case the server got faster or slower.
+
+Medians over whole windows, rather than single latencies, keep the controller stable
+even though some addresses take far longer to geocode than others.
+"""
+
+import math
+import random
+import statistics
+
+
+class AdaptiveLimiter:
+    """Latency-gradient limit on requests in flight, adjusted from observed latency and errors."""
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, window_size=50, latency_tolerance=1.25,
+                 error_tolerance=0.1, backoff=0.5, calibration_every=100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window_size = window_size
+        self.latency_tolerance = latency_tolerance
+        self.error_tolerance = error_tolerance
+        self.backoff = backoff
+        self.calibration_every = calibration_every
+        self.calibration_limit = max(min_limit, min(initial, max_limit))
+        self.limit = float(self.calibration_limit)
+        self.baseline = None
+        self.calibrating = True
+        self.windows = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self.latencies = []
+        self.errors = 0
+        self.peak_in_flight = 0
+
+    def capacity(self):
+        """Whole number of requests allowed in flight."""
+        if self.calibrating:
+            return self.calibration_limit
+        return max(self.min_limit, int(self.limit))
+
+    def update(self, latency, ok, in_flight):
+        """Record a finished request; in_flight excludes that request."""
+        if self.calibrating:
+            # Requests sent before calibration started are still draining and have queued
+            if in_flight >= self.calibration_limit:
+                return
+            if ok:
+                self.latencies.append(latency)
+            if len(self.latencies) >= self.window_size:
+                self.baseline = statistics.median(self.latencies)
+                self.calibrating = False
+                self.windows = 0
+                self._reset_window()
+            return
+
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+        self.peak_in_flight = max(self.peak_in_flight, in_flight + 1)
+        if len(self.latencies) + self.errors < self.window_size:
+            return
+
+        if self.errors > self.error_tolerance * self.window_size or not self.latencies:
+            new_limit = self.limit * self.backoff
+        else:
+            gradient = min(2.0, max(0.5, self.latency_tolerance * self.baseline / statistics.median(self.latencies)))
+            if self.peak_in_flight >= self.limit / 2:
+                new_limit = self.limit * gradient + math.sqrt(self.limit)
+            else:
+                # Only grow while the limit is actually in use, otherwise it would drift up unchecked
+                new_limit = self.limit * min(gradient, 1.0)
+        self.limit = min(self.max_limit, max(self.min_limit, new_limit))
+
+        self.windows += 1
+        self._reset_window()
+        if self.windows >= self.calibration_every:
+            self.calibrating = True
+
+
+class StaticLimiter:
+    """Fixed limit with the same interface as AdaptiveLimiter, for --no-adaptive runs."""
+
+    def __init__(self, limit=math.inf):
+        self.limit = limit
+
+    def capacity(self):
+        return self.limit
+
+    def update(self, latency, ok, in_flight):
+        pass
+
+
+# Longest delay between retries, in seconds
+BACKOFF_CAP = 10.0
+
+
+def backoff_delay(attempt, base=0.5, cap=BACKOFF_CAP, rng=random):
+    """Seconds to wait before retry number attempt (from 0), with full jitter."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
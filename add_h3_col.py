@@ -1,39 +1,49 @@
 import polars as pl
-import h3
 import os
+import click
 
-# File paths
-input_file = os.path.join("sydney-data", "geocoded-addresses.csv")
-output_file = os.path.join("sydney-data", "geocoded-addresses-h3.csv")
-
-# Read the geocoded addresses CSV
-print(f"Reading data from {input_file}...")
-df = pl.read_csv(
-    input_file, 
-    separator="\t",
-    truncate_ragged_lines=True,
-    infer_schema_length=10000
-)
-
-# Print some stats
-total_rows = len(df)
-with_coords = df.filter((pl.col("lat").is_not_null()) & (pl.col("lon").is_not_null())).height
-print(f"Total rows: {total_rows}")
-print(f"Rows with coordinates: {with_coords} ({with_coords/total_rows:.2%})")
-
-# Add H3 column using expression (more efficient than apply)
-print("Adding H3 indexes...")
-df = df.with_columns([
-    pl.struct(["lat", "lon"])
-    .map_elements(
-        lambda x: h3.latlng_to_cell(float(x["lat"]), float(x["lon"]), 10) if x["lat"] is not None and x["lon"] is not None else None,
-        return_dtype=pl.Utf8
+from h3_index import add_h3_columns, parse_resolutions, polars_h3
+from pipeline_io import FORMATS, GEOCODED_SCHEMA, h3_schema, scan, sink
+
+@click.command()
+@click.option('--input', 'input_file', default=os.path.join("sydney-data", "geocoded-addresses.csv"), type=click.Path(exists=True), help='Geocoded addresses (CSV, Parquet or Arrow IPC)')
+@click.option('--output', 'output_file', default=os.path.join("sydney-data", "geocoded-addresses-h3.csv"), help='Where to save the addresses with H3 indexes')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+@click.option('--separator', default='\t', help='Separator for CSV input and output')
+@click.option('--resolutions', default='7,8,9,10', help='Comma-separated H3 resolutions, one h3_r<N> column each')
+@click.option('--hex', 'hex_strings', is_flag=True, help='Also add h3_r<N>_hex columns with the usual string form of each cell')
+def main(input_file, output_file, fmt, separator, resolutions, hex_strings):
+    """Add H3 cell IDs at several resolutions to geocoded addresses."""
+    try:
+        resolutions = parse_resolutions(resolutions)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--resolutions')
+
+    # Read the geocoded addresses with fixed types instead of inferring them
+    print(f"Reading data from {input_file}...")
+    lf = scan(input_file, GEOCODED_SCHEMA, separator=separator)
+
+    # Cells are UInt64 IDs computed on whole columns; coarser resolutions are bit operations on the finest
+    print(f"Adding H3 indexes at resolutions {resolutions} ({'polars-h3' if polars_h3 else 'h3'} backend)...")
+    stats = lf.select(
+        pl.len().alias("total_rows"),
+        (pl.col("lat").is_not_null() & pl.col("lon").is_not_null()).sum().alias("with_coords"),
     )
-    .alias("h3_r10")
-])
+    output = sink(
+        add_h3_columns(lf, resolutions, hex_strings=hex_strings), output_file,
+        h3_schema(resolutions, hex_strings), fmt, separator, lazy=True,
+    )
+
+    # The stats and the output share one streaming pass over the input
+    print(f"Saving results to {output_file}...")
+    stats = pl.collect_all([stats, output], engine="streaming")[0]
+
+    # Print some stats
+    total_rows, with_coords = stats.row(0)
+    print(f"Total rows: {total_rows}")
+    print(f"Rows with coordinates: {with_coords} ({with_coords/max(total_rows, 1):.2%})")
 
-# Save to new CSV file
-print(f"Saving results to {output_file}...")
-df.write_csv(output_file, separator="\t")
+    print("Done!")
 
-print("Done!")
+if __name__ == "__main__":
+    main()
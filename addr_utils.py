@@ -1,5 +1,7 @@
 import re
 
+import polars as pl
+
 def strip_unit(full_addr: str) -> str:
     """
     Extract the base address without the unit number from an Australian address.
@@ -31,4 +33,107 @@ def strip_unit(full_addr: str) -> str:
         return remainder if remainder else ""
     
     # If no unit number is found, return the original address
-    return full_addr 
\ No newline at end of file
+    return full_addr
+
+def strip_unit_expr(column: str = "address") -> pl.Expr:
+    """
+    Polars expression version of strip_unit, giving identical results for a whole column.
+    
+    The Rust regex engine has no lookahead, so the character after the slash is
+    captured and put back instead. Python's "$" also matches before a trailing
+    newline, hence the optional newline in the group. Nulls become "" like None does.
+    
+    Args:
+        column: Name of the address column.
+        
+    Returns:
+        An expression evaluating to the addresses without unit numbers.
+    """
+    return pl.col(column).str.replace(r'^\d+/(\w|\n?$)', "${1}").fill_null("")
+
+def address_key_expr(address_column: str = "address", postcode_column: str = "post_code") -> pl.Expr:
+    """
+    Polars expression building geocoding keys, equal to f"{strip_unit(address)} {postcode}".
+    
+    Args:
+        address_column: Name of the address column.
+        postcode_column: Name of the postcode column.
+        
+    Returns:
+        An expression evaluating to the geocoding key of every row.
+    """
+    postcode = pl.col(postcode_column).cast(pl.Utf8).fill_null("None")
+    return pl.concat_str([strip_unit_expr(address_column), postcode], separator=" ")
+
+# Leading keywords that are kept verbatim in address patterns
+PATTERN_KEYWORDS = {"LOT", "SHOP", "UNIT", "SUITE", "LEVEL"}
+
+def address_pattern(address: str) -> str:
+    """
+    Reduce the street part of an address to its shape, so that similar failures group together.
+    
+    Numbers become "N", single letters "A", mixed tokens keep their letters with digits
+    replaced by "#", and runs of street-name words collapse to "W". The final word
+    (usually the street type) is kept as is.
+    
+    Args:
+        address: An address, optionally followed by ", SUBURB" and a postcode.
+        
+    Returns:
+        The pattern of the street part of the address.
+        
+    Examples:
+        >>> address_pattern("154 BELLEVUE RD, BELLEVUE HILL 2023")
+        "N W RD"
+        >>> address_pattern("SP73961 2519")
+        "SP#"
+    """
+    street = address.split(",", 1)[0] if "," in address else re.sub(r'\s+\d{4}$', '', address)
+    tokens = street.split()
+    if not tokens:
+        return "<empty>"
+    
+    shapes = []
+    for i, token in enumerate(tokens):
+        if re.fullmatch(r'\d+', token):
+            shape = "N"
+        elif re.fullmatch(r'\d+-\d+', token):
+            shape = "N-N"
+        elif re.fullmatch(r'\d+[A-Z]+', token):
+            shape = "NA"
+        elif re.fullmatch(r'[A-Z]', token):
+            shape = "A"
+        elif re.search(r'\d', token):
+            shape = re.sub(r'\d+', '#', token)
+        elif token in PATTERN_KEYWORDS or (i == len(tokens) - 1 and len(tokens) > 1):
+            shape = token
+        else:
+            shape = "W"
+        # Collapse multi-word street names into a single W
+        if not (shape == "W" and shapes and shapes[-1] == "W"):
+            shapes.append(shape)
+    return " ".join(shapes)
+
+def split_address_key(key: str) -> tuple:
+    """
+    Split a geocoding key into its street, suburb and postcode, for structured queries.
+    
+    Args:
+        key: A key built by address_key_expr, "<street>, <suburb> <postcode>".
+        
+    Returns:
+        A (street, suburb, postcode) tuple; parts that are missing are None.
+        
+    Examples:
+        >>> split_address_key("154 BELLEVUE RD, BELLEVUE HILL 2023")
+        ("154 BELLEVUE RD", "BELLEVUE HILL", "2023")
+        >>> split_address_key("SP73961 None")
+        ("SP73961", None, None)
+    """
+    # Keys of rows without a postcode end in "None"
+    match = re.fullmatch(r'\s*(.*?)\s+(\d{3,4}|None)\s*', key)
+    address, postcode = (match.group(1), match.group(2)) if match else (key.strip(), None)
+    if postcode == "None":
+        postcode = None
+    street, _, suburb = address.partition(",")
+    return street.strip() or None, suburb.strip() or None, postcode
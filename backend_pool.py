@@ -0,0 +1,224 @@
+"""
+Client-side load balancing across several Nominatim replicas.
+
+Each request goes to the healthy backend with the fewest requests in flight, which
+adapts to replicas of different speed without any configuration. Health checks are
+passive: a backend that returns errors, or answers slower than slow_threshold,
+max_failures times in a row is ejected for eject_seconds. After that it is re-admitted
+on probation, and a single success clears its record.
+
+Every backend also has a concurrency limiter (see adaptive_limiter). A backend at its
+limit receives no more requests, and when all are at their limit callers wait, which
+pushes back on the workers instead of overloading the servers.
+"""
+
+import asyncio
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+
+from adaptive_limiter import StaticLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def latency_percentiles(latencies):
+    """Return the mean, p50, p95 and p99 of a collection of latencies, as a dict."""
+    latencies = sorted(latencies)
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "mean_latency": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_latency": p50,
+        "p95_latency": p95,
+        "p99_latency": p99,
+    }
+
+
+class Backend:
+    """One Nominatim server and its request statistics."""
+
+    def __init__(self, url, limiter=None, latency_window=10000):
+        self.url = url.rstrip("/")
+        self.limiter = limiter or StaticLimiter()
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.slow = 0
+        self.ejections = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.latency_total = 0.0
+        # Recent latencies, for percentiles with bounded memory
+        self.latencies = deque(maxlen=latency_window)
+
+    def stats(self):
+        """Return this backend's statistics as a dict."""
+        percentiles = latency_percentiles(self.latencies)
+        return {
+            "url": self.url,
+            "requests": self.requests,
+            "errors": self.errors,
+            "slow": self.slow,
+            "ejections": self.ejections,
+            "limit": self.limiter.limit,
+            "mean_latency": self.latency_total / self.requests if self.requests else 0.0,
+            "p50_latency": percentiles["p50_latency"],
+            "p95_latency": percentiles["p95_latency"],
+            "p99_latency": percentiles["p99_latency"],
+        }
+
+
+class BackendPool:
+    """Thread-safe least-outstanding-requests balancer with passive health checks.
+
+    Callers pair every acquire() (or acquire_async() on an event loop) with a release()
+    reporting how the request went. limiter_factory creates each backend's concurrency
+    limiter; by default backends are unlimited.
+    """
+
+    def __init__(self, urls, max_failures=3, eject_seconds=30.0, slow_threshold=None, limiter_factory=StaticLimiter, clock=time.monotonic):
+        if not urls:
+            raise ValueError("At least one backend URL is required")
+        self.backends = [Backend(url, limiter_factory()) for url in urls]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.slow_threshold = slow_threshold
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.async_waiters = deque()
+        self.next_index = 0
+
+    def __len__(self):
+        return len(self.backends)
+
+    def try_acquire(self):
+        """Pick the backend for the next request and count it as outstanding, or return None if all are at their limit.
+
+        Among healthy backends with room, the one with the fewest requests in flight
+        relative to its limit wins. Ejected backends are skipped; if every backend is
+        ejected, the one due back soonest is used rather than stalling the run.
+        """
+        with self.lock:
+            return self._pick()
+
+    def acquire(self):
+        """Blocking version of try_acquire for worker threads."""
+        with self.available:
+            while True:
+                backend = self._pick()
+                if backend:
+                    return backend
+                # The timeout also notices ejections expiring and limits growing
+                self.available.wait(timeout=0.1)
+
+    async def acquire_async(self):
+        """Version of acquire that waits on the event loop instead of blocking it."""
+        while True:
+            backend = self.try_acquire()
+            if backend:
+                return backend
+            waiter = asyncio.get_running_loop().create_future()
+            self.async_waiters.append(waiter)
+            try:
+                await asyncio.wait([waiter], timeout=0.1)
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+
+    def _pick(self):
+        # Caller holds the lock
+        now = self.clock()
+        # Rotate the starting point so ties are spread evenly
+        start = self.next_index
+        self.next_index = (self.next_index + 1) % len(self.backends)
+        ordered = self.backends[start:] + self.backends[:start]
+        healthy = [b for b in ordered if b.ejected_until <= now]
+        if not healthy:
+            healthy = [min(self.backends, key=lambda b: b.ejected_until)]
+        with_room = [b for b in healthy if b.outstanding < b.limiter.capacity()]
+        if not with_room:
+            return None
+        backend = min(with_room, key=lambda b: (b.outstanding / b.limiter.capacity(), b.outstanding))
+        backend.outstanding += 1
+        return backend
+
+    def release(self, backend, latency, ok=True):
+        """Record the outcome of a request sent to backend.
+
+        ok should be False for HTTP or network errors; "no match" answers are healthy.
+        """
+        with self.lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.latency_total += latency
+            backend.latencies.append(latency)
+            slow = self.slow_threshold is not None and latency > self.slow_threshold
+            backend.limiter.update(latency, ok and not slow, backend.outstanding)
+
+            # Wake one waiting caller for the freed slot
+            self.available.notify()
+            # Async callers release on the event loop thread, so their waiters can be woken directly
+            while self.async_waiters:
+                waiter = self.async_waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+            if not ok:
+                backend.errors += 1
+            if slow:
+                backend.slow += 1
+
+            if ok and not slow:
+                if backend.consecutive_failures >= self.max_failures:
+                    logger.info(f"Backend {backend.url} recovered, re-admitted to the pool")
+                backend.consecutive_failures = 0
+                return
+
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures and backend.ejected_until <= self.clock():
+                backend.ejected_until = self.clock() + self.eject_seconds
+                backend.ejections += 1
+                reason = "errors" if not ok else "slow responses"
+                logger.warning(f"Ejecting backend {backend.url} for {self.eject_seconds:.0f}s after {backend.consecutive_failures} consecutive {reason}")
+
+    def healthy_count(self):
+        """Number of backends currently accepting requests."""
+        with self.lock:
+            now = self.clock()
+            return sum(1 for backend in self.backends if backend.ejected_until <= now)
+
+    def concurrency(self):
+        """Return (total limit, requests in flight) across all backends."""
+        with self.lock:
+            return sum(b.limiter.capacity() for b in self.backends), sum(b.outstanding for b in self.backends)
+
+    def stats(self):
+        """Return per-backend statistics."""
+        with self.lock:
+            return [backend.stats() for backend in self.backends]
+
+    def latency_summary(self):
+        """Return request count and latency percentiles over recent requests to all backends."""
+        with self.lock:
+            latencies = [latency for backend in self.backends for latency in backend.latencies]
+            requests = sum(backend.requests for backend in self.backends)
+            errors = sum(backend.errors for backend in self.backends)
+        return {"requests": requests, "errors": errors, **latency_percentiles(latencies)}
+
+    def log_stats(self):
+        """Log a per-backend summary of requests, errors and latency."""
+        logger.info("Backend statistics:")
+        for s in self.stats():
+            logger.info(
+                f"  {s['url']:<32} {s['requests']:>8} requests  {s['errors']:>6} errors  {s['slow']:>6} slow  "
+                f"{s['ejections']:>3} ejections  limit {s['limit']:.1f}  latency mean {s['mean_latency']*1000:.1f}ms "
+                f"p50 {s['p50_latency']*1000:.1f}ms p95 {s['p95_latency']*1000:.1f}ms"
+            )
@@ -1,5 +1,5 @@
 import polars as pl
-import requests
+import asyncio
 import logging
 import os
 import queue
@@ -7,136 +7,585 @@ import threading
 import time
 import sys
 import json
-import redis
 import click
-from datetime import datetime
+from collections import Counter, deque
+from typing import TYPE_CHECKING
 
-from addr_utils import strip_unit
+from addr_utils import address_key_expr, address_pattern, split_address_key
+
+import metrics
+from adaptive_limiter import BACKOFF_CAP, AdaptiveLimiter, StaticLimiter, backoff_delay
+from backend_pool import BackendPool
+from checkpoint import CheckpointWriter
+from delta_store import delta_path, load_manifest, merge_into_store, new_keys, update_manifest
+from gazetteer import Gazetteer, parse_keys
+from pipeline_io import ENRICHED_SCHEMA, FORMATS, GEOCODED_SCHEMA, PROPERTY_SCHEMA, scan, sink
+from property_data import join_coordinates
+from result_store import FOUND, PENDING, SKIPPED, ResultStore
+from single_flight import BUSY, CLAIMED, DONE, POLL_INTERVAL, SingleFlight
+from geocode_cache import CACHE_CENSUS_KEY, CACHE_HITS_KEY, CACHE_MISSES_KEY, ERROR, NOT_FOUND, CachedFailure, build_cache
+
+# The HTTP client is imported by the thread engine only, so join-rows, cache-stats and
+# async runs never load it. polars stays a module import: every command, and the
+# helper modules above, work on polars frames.
+if TYPE_CHECKING:
+    import requests
 
-# Configure logging to console only
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-# Add console handler to display logs
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+# HTTP responses worth retrying: rate limiting and overloaded or restarting servers
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Seconds a result waits at most for its batched cache write while its Redis lease is held
+PUBLISH_SECONDS = 5.0
 
 def init_redis(host, port, db):
-    """Initialize Redis connection with the given parameters."""
+    """Initialize Redis connection with the given parameters.
+    
+    Returns None if Redis is unreachable, in which case only the local cache tiers are used.
+    """
+    # Imported here, as it is only needed when a run uses the Redis tier
+    import redis
+
     try:
         redis_client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
         redis_client.ping()  # Test connection
         logger.info(f"Connected to Redis at {host}:{port}")
         
-        # Count and report the number of items in the Redis cache
-        cache_keys = redis_client.keys("geocode:*")
-        cache_count = len(cache_keys)
-        logger.info(f"Redis cache contains {cache_count} geocoded addresses")
+        # Report the approximate cache size from the census HyperLogLog (O(1), never blocks Redis)
+        cache_count = redis_client.pfcount(CACHE_CENSUS_KEY)
+        logger.info(f"Redis cache contains ~{cache_count} geocoded addresses (run cache-stats for an exact count)")
         
         return redis_client
     except Exception as e:
-        logger.error(f"Failed to connect to Redis at {host}:{port}: {e}")
-        logger.error("This script requires Redis to be running. Please start Redis and try again.")
-        sys.exit(1)
+        logger.warning(f"Failed to connect to Redis at {host}:{port}: {e}")
+        logger.warning("Continuing without the shared Redis cache tier")
+        return None
 
-def get_cached_coordinates(redis_client, address):
-    """Get cached coordinates from Redis if available."""
+def get_cached_coordinates(cache, address):
+    """Get cached coordinates from the cache if available; cached failures count as misses."""
     try:
-        cached_data = redis_client.get(f"geocode:{address}")
-        if cached_data:
-            lat, lon = json.loads(cached_data)
+        coords = cache.get_many([address]).get(address)
+        if coords and not isinstance(coords, CachedFailure):
             logger.debug(f"Cache hit for {address}")
-            return lat, lon
+            # Entries written by geocode runs also carry the query tier
+            return tuple(coords[:2])
     except Exception as e:
         logger.error(f"Error retrieving from cache: {e}")
         raise  # Re-raise the exception to fail fast
     
     return None
 
-def cache_coordinates(redis_client, address, lat, lon, cache_expiry):
-    """Cache coordinates in Redis."""
+def cache_coordinates(cache, address, lat, lon, cache_expiry):
+    """Cache coordinates in every cache tier."""
     if lat is None or lon is None:
         return
     
     try:
-        redis_client.setex(
-            f"geocode:{address}",
-            cache_expiry,
-            json.dumps([lat, lon])
-        )
+        cache.set_many([(address, (lat, lon))], cache_expiry)
         logger.debug(f"Cached coordinates for {address}")
     except Exception as e:
         logger.error(f"Error caching coordinates: {e}")
         raise  # Re-raise the exception to fail fast
 
-def geocode_address(combined_address:str, session:requests.Session, redis_client, cache_expiry, base_url="http://localhost:8080", country_code="au", state="NSW"):
-    """Geocode a single address using local Nominatim."""
-    # Check cache first
-    cached_coords = get_cached_coordinates(redis_client, combined_address)
-    if cached_coords:
-        return combined_address, cached_coords
+def get_cached_coordinates_bulk(cache, addresses):
+    """Resolve many addresses against the cache in one batched pass per tier.
     
-    params = {
+    Returns a dict mapping each cached address to its (lat, lon) or CachedFailure;
+    misses are omitted.
+    """
+    try:
+        with metrics.timer("cache_lookup"):
+            return cache.get_many(addresses)
+    except Exception as e:
+        logger.error(f"Error retrieving from cache: {e}")
+        raise  # Re-raise the exception to fail fast
+
+def cache_coordinates_bulk(cache, items, cache_expiry):
+    """Cache many (address, value) entries with one batched write per tier."""
+    try:
+        with metrics.timer("cache_write"):
+            cache.set_many(items, cache_expiry)
+        logger.debug(f"Cached coordinates for {len(items)} addresses")
+    except Exception as e:
+        logger.error(f"Error caching coordinates: {e}")
+        raise  # Re-raise the exception to fail fast
+
+def cache_value(coords, status):
+    """The cache entry for a geocoding outcome: its coordinates, or a CachedFailure."""
+    return coords if status == "ok" else CachedFailure(status, time.time())
+
+def cached_outcome(value):
+    """Inverse of cache_value: (coords, status) of a cache entry."""
+    if isinstance(value, CachedFailure):
+        return (None, None), value.status
+    return value, "ok"
+
+class CacheWriteBuffer:
+    """Thread-safe buffer that writes new results back to the cache in batches.
+    
+    Failed geocodes are cached as CachedFailure entries; see resolve_cached for
+    when they are retried. A batch that cannot be written is logged and dropped
+    rather than failing the worker: its results are already in the output.
+    
+    With single_flight, the Redis leases of a batch's addresses are dropped once it
+    is written, and max_age bounds how long a result waits for its batch: a
+    background thread also writes results that reach that age while no new ones
+    arrive. close() stops it and writes the rest.
+    """
+
+    def __init__(self, cache, cache_expiry, batch_size=1000, single_flight=None, max_age=None):
+        self.cache = cache
+        self.cache_expiry = cache_expiry
+        self.batch_size = batch_size
+        self.single_flight = single_flight
+        self.max_age = max_age
+        self.items = []
+        self.first_added_at = None
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        if max_age is not None:
+            threading.Thread(target=self.flush_stale_until_closed, daemon=True).start()
+
+    def add(self, address, coords, status):
+        """Queue a result for caching, flushing once a full batch has accumulated or the oldest result is max_age old."""
+        now = time.monotonic()
+        with self.lock:
+            if not self.items:
+                self.first_added_at = now
+            self.items.append((address, cache_value(coords, status)))
+            stale = self.max_age is not None and now - self.first_added_at >= self.max_age
+            if len(self.items) < self.batch_size and not stale:
+                return
+            items, self.items = self.items, []
+        self.write(items)
+
+    def flush(self):
+        """Write any remaining buffered results."""
+        with self.lock:
+            items, self.items = self.items, []
+        if items:
+            self.write(items)
+
+    def flush_stale_until_closed(self):
+        while not self.closed.wait(self.max_age / 2):
+            with self.lock:
+                if not self.items or time.monotonic() - self.first_added_at < self.max_age:
+                    continue
+                items, self.items = self.items, []
+            self.write(items)
+
+    def close(self):
+        """Stop the background writes and write any remaining buffered results."""
+        self.closed.set()
+        self.flush()
+
+    def write(self, items):
+        try:
+            cache_coordinates_bulk(self.cache, items, self.cache_expiry)
+        except Exception:
+            metrics.inc("cache_write_errors", len(items))
+            logger.warning(f"Dropped {len(items)} results that could not be cached; they will be geocoded again next run")
+        finally:
+            if self.single_flight:
+                self.single_flight.published([address for address, _ in items])
+
+def resolve_cached(store, cache, result_writer, batch_size=10000, negative_expiry=60*60*24*7, error_expiry=60*60*24, retry_failed=False, now=None):
+    """Look up every address of a ResultStore in the cache, batch by batch.
+    
+    Cached coordinates are written to result_writer and marked found. Unexpired
+    CachedFailure entries are marked with their status; a failure expires
+    negative_expiry (no match) or error_expiry (HTTP or network error) seconds after
+    it was recorded, and the address stays pending. In retry_failed mode only
+    addresses whose failure has expired stay pending, and uncached addresses are
+    marked skipped.
+    
+    Returns the number of cache hits.
+    """
+    now = time.time() if now is None else now
+    failure_expiry = {NOT_FOUND: negative_expiry, ERROR: error_expiry}
+    hits = 0
+    for first_id, addresses in store.batches(batch_size):
+        cached = get_cached_coordinates_bulk(cache, addresses)
+        hits += len(cached)
+        for address_id, address in enumerate(addresses, first_id):
+            entry = cached.get(address)
+            if entry is None:
+                if retry_failed:
+                    store.set(address_id, SKIPPED)
+            elif isinstance(entry, CachedFailure):
+                if entry.failed_at + failure_expiry.get(entry.status, 0) > now:
+                    store.set(address_id, entry.status)
+            else:
+                store.set(address_id, FOUND)
+                result_writer.add(address, *entry)
+    return hits
+
+def schedule_ids(pending, schedule="locality"):
+    """IDs of the pending (id, address) rows in the order they are to be queried.
+
+    locality sorts them by postcode, suburb, street and house number, so queries for
+    the same street run back to back and Nominatim finds the rows they need in its
+    database cache; keys that do not parse go last. unordered keeps the store's order,
+    which follows the hash-based deduplication and is effectively random.
+    """
+    if schedule == "unordered":
+        return pending["id"].to_list()
+    parsed = parse_keys(pending["address"])
+    return (
+        pending.select("id").with_columns(parsed.select("postcode", "suburb", "street", "house", "key"))
+        .sort("postcode", "suburb", "street", "house", "key", nulls_last=True)["id"].to_list()
+    )
+
+def report_failures(failures, top_n=10):
+    """Log the most common shapes of addresses that failed to geocode.
+    
+    failures is a DataFrame with address and status columns, such as ResultStore.select().
+    """
+    if not failures.height:
+        return
+    patterns = Counter((status, address_pattern(address)) for address, status in failures.select("address", "status").iter_rows())
+    logger.info(f"Top failure patterns ({failures.height} failed addresses):")
+    for (status, pattern), count in patterns.most_common(top_n):
+        logger.info(f"  {status:<9} {pattern:<30} {count} ({count/failures.height*100:.2f}%)")
+
+def build_search_params(combined_address, country_code="au", state="NSW"):
+    """Build the Nominatim /search query parameters for an address."""
+    return {
         'q': f"{combined_address}, {state}, Australia",  # Add state to the query
         'format': 'json',
         'countrycodes': country_code,  # Limit to specified country
         'limit': 1  # Just get the top result
     }
+
+def build_structured_params(combined_address, country_code="au", state="NSW"):
+    """Build structured /search parameters (street, city, postalcode) for an address, or None without a street."""
+    street, suburb, postcode = split_address_key(combined_address)
+    if street is None:
+        return None
+    params = {'street': street, 'state': state, 'country': 'Australia', 'format': 'json', 'countrycodes': country_code, 'limit': 1}
+    if suburb:
+        params['city'] = suburb
+    if postcode:
+        params['postalcode'] = postcode
+    return params
+
+def build_postcode_params(combined_address, country_code="au", state="NSW"):
+    """Build /search parameters for the centroid of an address's postcode, or None without a postcode."""
+    _, _, postcode = split_address_key(combined_address)
+    if postcode is None:
+        return None
+    return {'postalcode': postcode, 'state': state, 'country': 'Australia', 'format': 'json', 'countrycodes': country_code, 'limit': 1}
+
+# Query tiers in cascade order. Structured queries skip Nominatim's free-text parsing,
+# the most expensive search path; postcode centroids are only approximate locations.
+QUERY_TIERS = {
+    "structured": build_structured_params,
+    "free_text": build_search_params,
+    "postcode": build_postcode_params,
+}
+
+def parse_query_tiers(value):
+    """Parse a comma-separated list of query tiers, keeping cascade order as given."""
+    tiers = tuple(tier.strip() for tier in value.split(",") if tier.strip())
+    unknown = [tier for tier in tiers if tier not in QUERY_TIERS]
+    if unknown or not tiers:
+        raise ValueError(f"Unknown query tiers {unknown}, expected some of {', '.join(QUERY_TIERS)}")
+    return tiers
+
+def plan_queries(combined_address, tiers=("free_text",), country_code="au", state="NSW"):
+    """Return the (tier, params) queries to try in order for an address, skipping tiers it lacks the parts for."""
+    plan = []
+    for tier in tiers:
+        params = QUERY_TIERS[tier](combined_address, country_code, state)
+        if params is not None:
+            plan.append((tier, params))
+    return plan
+
+def parse_search_results(results):
+    """Extract (lat, lon) from a Nominatim /search response, or None if there was no match."""
+    if results and len(results) > 0:
+        return float(results[0]['lat']), float(results[0]['lon'])
+    return None
+
+def geocode_address(combined_address:str, session:"requests.Session", cache, cache_expiry, base_url="http://localhost:8080", country_code="au", state="NSW", timeout=None):
+    """Geocode a single address using local Nominatim."""
+    # Check cache first
+    cached_coords = get_cached_coordinates(cache, combined_address)
+    if cached_coords:
+        return combined_address, cached_coords
+    
+    address_key, (lat, lon), _ = query_nominatim(combined_address, session, base_url, country_code, state, timeout)
+    # Cache the successful result
+    cache_coordinates(cache, combined_address, lat, lon, cache_expiry)
+    return address_key, (lat, lon)
+
+def query_nominatim(combined_address:str, session:"requests.Session", base_url="http://localhost:8080", country_code="au", state="NSW", timeout=None):
+    """Geocode a single address using local Nominatim, bypassing the cache.
+    
+    Returns (address, (lat, lon), status) where status is "ok", NOT_FOUND or ERROR.
+    """
+    coords, status, _ = search_nominatim(combined_address, session, base_url, country_code, state, timeout)
+    return combined_address, coords, status
+
+def search_nominatim(combined_address:str, session:"requests.Session", base_url="http://localhost:8080", country_code="au", state="NSW", timeout=None, params=None):
+    """Send one /search request and classify the outcome.
+    
+    The request is a free-text query for the address unless params are given.
+    Returns ((lat, lon), status, retryable). Network errors, timeouts and
+    RETRYABLE_STATUS_CODES are retryable; other HTTP errors are not.
+    """
+    params = params or build_search_params(combined_address, country_code, state)
     
     try:
-        response = session.get(f"{base_url}/search", params=params)
+        with metrics.timer("http"):
+            response = session.get(f"{base_url}/search", params=params, timeout=timeout)
         if response.status_code == 200:
-            results = response.json()
-            if results and len(results) > 0:
-                lat, lon = float(results[0]['lat']), float(results[0]['lon'])
-                # Cache the successful result
-                cache_coordinates(redis_client, combined_address, lat, lon, cache_expiry)
-                return combined_address, (lat, lon)
-            else:
-                pass
-                #logger.warning(f"No results found for {combined_address} got {results}")
-        else:
-            logger.error(f"Error {response.status_code} for {combined_address}")
-        return combined_address, (None, None)
+            with metrics.timer("parse"):
+                coords = parse_search_results(response.json())
+            if coords:
+                return coords, "ok", False
+            return (None, None), NOT_FOUND, False
+        logger.debug(f"Error {response.status_code} for {combined_address} from {base_url}")
+        return (None, None), ERROR, response.status_code in RETRYABLE_STATUS_CODES
+    except Exception as e:
+        logger.debug(f"Exception during geocoding {combined_address} on {base_url}: {str(e)}")
+        return (None, None), ERROR, True
+
+async def query_nominatim_async(combined_address:str, client, base_url="http://localhost:8080", country_code="au", state="NSW"):
+    """Geocode a single address using local Nominatim without blocking the event loop.
+    
+    Returns the same (address, (lat, lon), status) tuple as query_nominatim. The
+    request timeout is taken from the client.
+    """
+    coords, status, _ = await search_nominatim_async(combined_address, client, base_url, country_code, state)
+    return combined_address, coords, status
+
+async def search_nominatim_async(combined_address:str, client, base_url="http://localhost:8080", country_code="au", state="NSW", params=None):
+    """Async version of search_nominatim."""
+    params = params or build_search_params(combined_address, country_code, state)
+    
+    try:
+        with metrics.timer("http"):
+            response = await client.get(f"{base_url}/search", params=params)
+        if response.status_code == 200:
+            with metrics.timer("parse"):
+                coords = parse_search_results(response.json())
+            if coords:
+                return coords, "ok", False
+            return (None, None), NOT_FOUND, False
+        logger.debug(f"Error {response.status_code} for {combined_address} from {base_url}")
+        return (None, None), ERROR, response.status_code in RETRYABLE_STATUS_CODES
     except Exception as e:
-        logger.error(f"Exception during geocoding {combined_address}: {str(e)}")
-        return combined_address, (None, None)
+        logger.debug(f"Exception during geocoding {combined_address} on {base_url}: {e!r}")
+        return (None, None), ERROR, True
+
+def query_backend(pool, combined_address:str, session:"requests.Session", country_code="au", state="NSW", timeout=None, max_retries=3, retry_backoff=0.5, tiers=("free_text",)):
+    """Geocode a single address through the backend pool, retrying retryable errors.
+    
+    Every attempt waits for a backend with spare capacity and reports its outcome to
+    the pool, so failures also shrink that backend's concurrency limit. Retries sleep
+    for a jittered, exponentially growing delay.
+    
+    The query tiers are tried in order until one finds a match; an error ends the
+    cascade. Matches are returned as (lat, lon, tier).
+    """
+    coords, status = (None, None), NOT_FOUND
+    for tier, params in plan_queries(combined_address, tiers, country_code, state):
+        for attempt in range(max_retries + 1):
+            backend = pool.acquire()
+            start = time.monotonic()
+            coords, status, retryable = search_nominatim(combined_address, session, backend.url, country_code, state, timeout, params)
+            pool.release(backend, time.monotonic() - start, ok=status != ERROR)
+            metrics.inc("requests", status=status)
+            if not retryable or attempt == max_retries:
+                break
+            metrics.inc("retries")
+            time.sleep(backoff_delay(attempt, retry_backoff))
+        if status != NOT_FOUND:
+            break
+    if status == ERROR:
+        logger.error(f"Giving up on {combined_address} after {attempt + 1} attempts")
+    elif status == "ok":
+        metrics.inc("tier_hits", tier=tier)
+        coords = (*coords, tier)
+    return combined_address, coords, status
+
+async def query_backend_async(pool, combined_address:str, client, country_code="au", state="NSW", max_retries=3, retry_backoff=0.5, tiers=("free_text",)):
+    """Async version of query_backend."""
+    coords, status = (None, None), NOT_FOUND
+    for tier, params in plan_queries(combined_address, tiers, country_code, state):
+        for attempt in range(max_retries + 1):
+            backend = await pool.acquire_async()
+            start = time.monotonic()
+            coords, status, retryable = await search_nominatim_async(combined_address, client, backend.url, country_code, state, params)
+            pool.release(backend, time.monotonic() - start, ok=status != ERROR)
+            metrics.inc("requests", status=status)
+            if not retryable or attempt == max_retries:
+                break
+            metrics.inc("retries")
+            await asyncio.sleep(backoff_delay(attempt, retry_backoff))
+        if status != NOT_FOUND:
+            break
+    if status == ERROR:
+        logger.error(f"Giving up on {combined_address} after {attempt + 1} attempts")
+    elif status == "ok":
+        metrics.inc("tier_hits", tier=tier)
+        coords = (*coords, tier)
+    return combined_address, coords, status
+
+def max_query_seconds(timeout, max_retries=3, retry_backoff=0.5, tiers=("free_text",)):
+    """Longest an address can take in query_backend: every tier timing out on every attempt, with the longest backoffs."""
+    backoff = sum(min(BACKOFF_CAP, retry_backoff * 2 ** attempt) for attempt in range(max_retries))
+    return len(tiers) * ((max_retries + 1) * timeout + backoff)
+
+def worker(id_queue, result_writer, store, progress_counter, cache_writer, pool, country_code="au", state="NSW", timeout=None, max_retries=3, retry_backoff=0.5, tiers=("free_text",), single_flight=None):
+    """Worker function that geocodes cache misses from a queue of store IDs and buffers them for caching.
+    
+    With single_flight, addresses are claimed before they are queried. An address
+    claimed by another worker or run goes back on the queue as a (due, ID) pair and
+    is picked up again once it is due.
+    """
+    import requests
 
-def worker(address_queue, results_dict, results_lock, progress_counter, redis_client, cache_expiry, base_url="http://localhost:8080", country_code="au", state="NSW"):
-    """Worker function that processes addresses from a queue."""
     local_session = requests.Session()
     while True:
         try:
             # Get the next address from the queue (non-blocking)
-            combined_address = address_queue.get_nowait()
-            # Process the address
-            address_key, coords = geocode_address(combined_address, local_session, redis_client, cache_expiry, base_url, country_code, state)
-            # Store the result in the shared results dictionary
-            with results_lock:
-                results_dict[address_key] = coords
+            item = id_queue.get_nowait()
+            if isinstance(item, tuple):
+                # An address deferred while another worker held its lease
+                due, address_id = item
+                time.sleep(max(due - time.monotonic(), 0))
+            else:
+                address_id = item
+            address = store.address(address_id)
+            claim, value = single_flight.claim(address) if single_flight else (CLAIMED, None)
+            if claim == BUSY:
+                metrics.inc("lease_waits")
+                id_queue.put((time.monotonic() + POLL_INTERVAL, address_id))
+                id_queue.task_done()
+                continue
+            if claim == DONE:
+                # Another worker or run has just geocoded it
+                metrics.inc("coalesced")
+                coords, status = cached_outcome(value)
+                address_key = address
+            else:
+                try:
+                    address_key, coords, status = query_backend(pool, address, local_session, country_code, state, timeout, max_retries, retry_backoff, tiers)
+                except Exception:
+                    if single_flight:
+                        single_flight.release(address)
+                    raise
+                if single_flight:
+                    single_flight.release(address, cache_value(coords, status))
+            store.set(address_id, status)
+            # Append the result to the checkpointed output before caching it
+            with metrics.timer("write"):
+                result_writer.add(address_key, *coords)
+            cache_writer.add(address_key, coords, status)
+            with progress_counter['lock']:
                 # Increment the progress counter
                 progress_counter['count'] += 1
             # Mark the task as done
-            address_queue.task_done()
+            id_queue.task_done()
         except queue.Empty:
             # No more addresses to process
             break
         except Exception as e:
             logger.error(f"Error processing address: {str(e)}")
             # Ensure task is marked as done even in case of error
-            address_queue.task_done()
+            id_queue.task_done()
+
+async def run_async_geocoder(address_ids, result_writer, store, progress_counter, cache_writer, pool, country_code="au", state="NSW", concurrency=64, timeout=None, max_retries=3, retry_backoff=0.5, tiers=("free_text",), single_flight=None):
+    """Geocode the addresses of store IDs on a single event loop, keeping up to `concurrency` requests in flight.
+    
+    All requests share one pooled HTTP client sized to the concurrency limit, so
+    throughput is bounded by the server rather than by the number of client threads.
+    Addresses claimed by another worker or run are deferred like in worker().
+    Results are handed to a writer thread, so the disk and cache writes of their
+    segments and batches never stall the requests in flight.
+    """
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    pending = deque(address_ids)
+
+    async def off_loop(call, *args):
+        # Redis round trips of the leases run in a thread, so they never stall the other requests
+        if single_flight.redis_client is None:
+            return call(*args)
+        return await asyncio.to_thread(call, *args)
+
+    results = queue.Queue()
+
+    def write_results():
+        while (item := results.get()) is not None:
+            address_key, coords, status = item
+            try:
+                with metrics.timer("write"):
+                    result_writer.add(address_key, *coords)
+                cache_writer.add(address_key, coords, status)
+            except Exception as e:
+                logger.error(f"Error writing the result of {address_key}: {str(e)}")
 
-def progress_reporter(progress_counter, total_addresses, stop_event):
-    """Report progress at regular intervals."""
+    async def consume(client):
+        # Each consumer pulls the next address as soon as its previous request finishes
+        while pending:
+            item = pending.popleft()
+            if isinstance(item, tuple):
+                due, address_id = item
+                await asyncio.sleep(max(due - time.monotonic(), 0))
+            else:
+                address_id = item
+            try:
+                address = store.address(address_id)
+                claim, value = await off_loop(single_flight.claim, address) if single_flight else (CLAIMED, None)
+                if claim == BUSY:
+                    metrics.inc("lease_waits")
+                    pending.append((time.monotonic() + POLL_INTERVAL, address_id))
+                    continue
+                if claim == DONE:
+                    metrics.inc("coalesced")
+                    coords, status = cached_outcome(value)
+                    address_key = address
+                else:
+                    try:
+                        address_key, coords, status = await query_backend_async(pool, address, client, country_code, state, max_retries, retry_backoff, tiers)
+                    except Exception:
+                        if single_flight:
+                            await off_loop(single_flight.release, address)
+                        raise
+                    if single_flight:
+                        single_flight.release(address, cache_value(coords, status))
+                store.set(address_id, status)
+                results.put((address_key, coords, status))
+            except Exception as e:
+                logger.error(f"Error processing address: {str(e)}")
+            with progress_counter['lock']:
+                progress_counter['count'] += 1
+
+    writer = threading.Thread(target=write_results, daemon=True)
+    writer.start()
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            await asyncio.gather(*(consume(client) for _ in range(concurrency)))
+    finally:
+        # Every result queued so far is written before the run's final flushes
+        results.put(None)
+        await asyncio.to_thread(writer.join)
+
+def progress_reporter(progress_counter, total_addresses, stop_event, pool=None, metrics_sinks=()):
+    """Report progress, and the pool's current concurrency if given, at regular intervals.
+    
+    Metrics sinks are updated at the same interval.
+    """
     last_count = 0
     last_time = time.time()
     
-    while not stop_event.is_set():
-        time.sleep(10)  # Report every 10 seconds
-        
+    # Report every 10 seconds; waiting on the event lets the run stop the reporter at once
+    while not stop_event.wait(10):
         with progress_counter['lock']:
             current_count = progress_counter['count']
             current_time = time.time()
@@ -155,13 +604,93 @@ def progress_reporter(progress_counter, total_addresses, stop_event):
                 eta_str = "N/A"
             
             # Log progress
-            logger.info(f"Progress: {current_count}/{total_addresses} ({progress_percent:.2f}%) - Rate: {rate:.2f} addr/sec - ETA: {eta_str}")
+            concurrency_str = ""
+            if pool is not None:
+                limit, in_flight = pool.concurrency()
+                concurrency_str = f" - Concurrency: {in_flight} in flight, limit {limit:.1f}"
+            logger.info(f"Progress: {current_count}/{total_addresses} ({progress_percent:.2f}%) - Rate: {rate:.2f} addr/sec - ETA: {eta_str}{concurrency_str}")
             
             # Update last values
             last_count = current_count
             last_time = current_time
 
-@click.command()
+        # Outside the progress lock, so workers are not held up by slow sinks
+        for sink in metrics_sinks:
+            sink.update(metrics.REGISTRY)
+
+# Upper bounds (in seconds) of the TTL histogram buckets reported by cache-stats
+TTL_BUCKETS = [
+    ("< 1 day", 60*60*24),
+    ("1-7 days", 60*60*24*7),
+    ("7-30 days", 60*60*24*30),
+    ("> 30 days", float("inf")),
+]
+
+def collect_cache_stats(redis_client, scan_count=1000, sample_size=10000):
+    """Gather cache statistics with incremental SCAN so other Redis clients are never stalled.
+    
+    Every key is counted; TTLs and memory usage are measured on the first
+    `sample_size` keys and memory is extrapolated to the full keyspace.
+    """
+    key_count = 0
+    sampled = 0
+    sampled_memory = 0
+    no_expiry = 0
+    ttl_counts = {label: 0 for label, _ in TTL_BUCKETS}
+
+    batch = []
+    def measure(keys):
+        nonlocal sampled, sampled_memory, no_expiry
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+        replies = pipe.execute()
+        for ttl, memory in zip(replies[::2], replies[1::2]):
+            if ttl == -2:
+                continue  # Key expired between SCAN and TTL
+            sampled += 1
+            sampled_memory += memory or 0
+            if ttl == -1:
+                no_expiry += 1
+                continue
+            for label, upper in TTL_BUCKETS:
+                if ttl < upper:
+                    ttl_counts[label] += 1
+                    break
+
+    for key in redis_client.scan_iter(match="geocode:*", count=scan_count):
+        key_count += 1
+        if key_count <= sample_size:
+            batch.append(key)
+            if len(batch) >= scan_count:
+                measure(batch)
+                batch = []
+    if batch:
+        measure(batch)
+
+    hits = int(redis_client.get(CACHE_HITS_KEY) or 0)
+    misses = int(redis_client.get(CACHE_MISSES_KEY) or 0)
+    lookups = hits + misses
+    return {
+        "key_count": key_count,
+        "approx_addresses_ever_cached": redis_client.pfcount(CACHE_CENSUS_KEY),
+        "sampled_keys": sampled,
+        "sampled_memory_bytes": sampled_memory,
+        "estimated_memory_bytes": int(sampled_memory / sampled * key_count) if sampled else 0,
+        "redis_used_memory": redis_client.info("memory").get("used_memory_human"),
+        "ttl_distribution": dict(ttl_counts, **{"no expiry": no_expiry}),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / lookups if lookups else None,
+    }
+
+@click.group()
+def cli():
+    """Batch geocoding against a local Nominatim server with a Redis cache."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+
+@cli.command("geocode")
 @click.argument('input_file', type=click.Path(exists=True))
 @click.argument('output_file', type=click.Path())
 @click.option('--limit', type=int, help='Limit the number of addresses to process (for testing)')
@@ -169,60 +698,202 @@ def progress_reporter(progress_counter, total_addresses, stop_event):
 @click.option('--redis-port', default=16379, help='Redis port')
 @click.option('--redis-db', default=0, help='Redis database number')
 @click.option('--cache-expiry', default=60*60*24*30, help='Cache expiry in seconds (default: 30 days)')
-@click.option('--nominatim-url', default='http://localhost:8080', help='Nominatim server URL')
+@click.option('--nominatim-url', 'nominatim_urls', multiple=True, default=['http://localhost:8080'], help='Nominatim server URL; repeat to balance load across several replicas')
+@click.option('--max-failures', default=3, help='Consecutive errors or slow responses before a backend is ejected')
+@click.option('--eject-seconds', default=30.0, help='How long an ejected backend is kept out of the pool')
+@click.option('--slow-threshold', type=float, help='Responses slower than this many seconds count as failures for health checks')
+@click.option('--query-tiers', default='free_text', help='Comma-separated query cascade, tried in order until one matches: structured, free_text, postcode (centroid)')
 @click.option('--country-code', default='au', help='Country code for geocoding')
 @click.option('--state', default='NSW', help='State/province for geocoding')
 @click.option('--address-column', default='address', help='Name of the address column in the input file')
 @click.option('--postcode-column', default='post_code', help='Name of the postcode column in the input file')
-@click.option('--separator', default='\t', help='Input file separator')
+@click.option('--separator', default='\t', help='Separator for CSV input and output')
+@click.option('--output-format', type=click.Choice(FORMATS), help='Output format (default: from the OUTPUT_FILE extension, else csv)')
+@click.option('--engine', type=click.Choice(['threads', 'async']), default='threads', help='Geocoding engine: a thread pool or a single asyncio event loop')
+@click.option('--concurrency', type=int, help='Maximum requests in flight (default per backend: 32 threads, or CPU count with --no-adaptive; 64 for async)')
+@click.option('--adaptive/--no-adaptive', default=True, help='Adjust requests in flight per backend to its observed latency and error rate')
+@click.option('--initial-concurrency', default=4, help='Requests in flight per backend when the adaptive limiter starts')
+@click.option('--max-retries', default=3, help='Retries for timeouts, network errors and 429/5xx responses')
+@click.option('--retry-backoff', default=0.5, help='Base delay in seconds for jittered exponential backoff between retries')
+@click.option('--timeout', default=30.0, help='Per-request timeout in seconds')
+@click.option('--cache-batch-size', default=10000, help='Number of keys per cache lookup batch and Redis MGET/pipeline')
+@click.option('--lru-size', default=100000, help='Entries kept in the in-memory cache tier (0 disables it)')
+@click.option('--cache-path', default='geocode_cache.sqlite', help='Local SQLite cache file (empty string disables it)')
+@click.option('--redis/--no-redis', 'use_redis', default=True, help='Use Redis as a shared cache tier if it is reachable')
+@click.option('--negative-expiry', default=60*60*24*7, help='Seconds before an address with no match is queried again (default: 7 days)')
+@click.option('--error-expiry', default=60*60*24, help='Seconds before an address that hit an HTTP or network error is queried again (default: 1 day)')
+@click.option('--retry-failed', is_flag=True, help='Only re-query addresses whose cached failure has expired')
+@click.option('--gazetteer', 'gazetteer_file', type=click.Path(exists=True), help='Gazetteer from gazetteer.py build; variants of known addresses resolve from it without a request')
+@click.option('--interpolate', is_flag=True, help='With --gazetteer, interpolate unknown house numbers between known ones on the same street')
+@click.option('--interpolate-max-gap', default=20, help='Largest gap between known house numbers to interpolate across')
+@click.option('--single-flight/--no-single-flight', default=True, help='Claim addresses before querying them, so concurrent runs sharing Redis, and runs in one process, never query the same address at once')
+@click.option('--lease-ttl', type=float, help='Seconds a claim on an address lasts (default: the longest a query can take with its retries and tiers, plus the wait for its cache write)')
+@click.option('--schedule', type=click.Choice(['locality', 'unordered']), default='locality', help='Query order: grouped by postcode, suburb and street for Nominatim\'s database cache, or as deduplicated')
+@click.option('--chunk-size', default=10000, help='Results per checkpointed output segment')
+@click.option('--resume', is_flag=True, help='Skip addresses already written by an interrupted run with the same OUTPUT_FILE')
+@click.option('--delta', is_flag=True, help='Only geocode addresses not processed by earlier --delta runs into the same OUTPUT_FILE, and merge the results into it')
+@click.option('--rows-output', type=click.Path(), help='Also write every input row, with all its columns, plus the coordinates of its address')
+@click.option('--rows-format', type=click.Choice(FORMATS), help='Format of --rows-output (default: from its extension, else csv)')
+@click.option('--metrics-file', type=click.Path(), help='Prometheus text file with counters and stage timings, rewritten as the run goes')
+@click.option('--metrics-port', type=int, help='Serve Prometheus metrics at http://0.0.0.0:PORT/metrics during the run')
+@click.option('--metrics-json', type=click.Path(), help='Write a JSON summary of counters and stage timings at the end of the run')
+@click.option('--profile', 'profile_mode', type=click.Choice(['cprofile', 'sample']), help='Profile the run with cProfile (main thread only) or a sampling profiler (all threads)')
+@click.option('--profile-output', type=click.Path(), help='Profile output (default: geocode.prof for cprofile, geocode.folded for sample)')
 def main(input_file, output_file, limit, redis_host, redis_port, redis_db, cache_expiry, 
-         nominatim_url, country_code, state, address_column, postcode_column, separator):
-    """Geocode addresses from a CSV file using local Nominatim server.
+         nominatim_urls, max_failures, eject_seconds, slow_threshold, query_tiers, country_code, state, address_column, postcode_column, separator,
+         output_format, engine, concurrency, adaptive, initial_concurrency, max_retries, retry_backoff, timeout, cache_batch_size, lru_size, cache_path, use_redis,
+         negative_expiry, error_expiry, retry_failed, gazetteer_file, interpolate, interpolate_max_gap, single_flight, lease_ttl, schedule, chunk_size, resume, delta, rows_output, rows_format, metrics_file, metrics_port, metrics_json, profile_mode, profile_output):
+    """Geocode addresses from a CSV, Parquet or Arrow IPC file using local Nominatim server.
     
-    INPUT_FILE: Path to the input CSV file containing addresses
+    INPUT_FILE: Path to the input file containing addresses, or a LazyFrame of
+    property rows when invoked from etl.py run
     OUTPUT_FILE: Path where the geocoded data will be saved
     """
     logger.info("Starting geocoding process")
+    run_start = time.time()
+    try:
+        query_tiers = parse_query_tiers(query_tiers)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--query-tiers')
+
+    # Counters and timers start from zero on every run; sinks export them as the run goes
+    metrics.REGISTRY.reset()
+    metrics_sinks = []
+    if metrics_file:
+        metrics_sinks.append(metrics.PrometheusFileSink(metrics_file))
+    if metrics_port is not None:
+        metrics_sinks.append(metrics.PrometheusHTTPSink(metrics.REGISTRY, metrics_port))
+    if metrics_json:
+        metrics_sinks.append(metrics.JSONSummarySink(metrics_json))
+    if profile_mode:
+        profile_output = profile_output or {"cprofile": "geocode.prof", "sample": "geocode.folded"}[profile_mode]
+        # Profiling stops when the command returns
+        click.get_current_context().with_resource(metrics.profile(profile_mode, profile_output))
     
-    # Initialize Redis connection
-    redis_client = init_redis(redis_host, redis_port, redis_db)
+    # Initialize the cache tiers; Redis is optional
+    redis_client = init_redis(redis_host, redis_port, redis_db) if use_redis else None
+    cache = build_cache(lru_size, cache_path, redis_client, cache_batch_size, cache_expiry)
+    logger.info(f"Using cache tiers: {cache.describe() or 'none'}")
+    if single_flight:
+        # Leases live in Redis when it is in use, so concurrent runs share them. Created
+        # before the cache lookup, so results published after it are picked up.
+        lease_ttl = lease_ttl or max_query_seconds(timeout, max_retries, retry_backoff, query_tiers) + 2 * PUBLISH_SECONDS
+        single_flight = SingleFlight(redis_client, lease_ttl)
+    else:
+        single_flight = None
     
-    # Read input file
-    df = pl.read_csv(input_file, truncate_ragged_lines=True, separator=separator)
+    rows = input_file if isinstance(input_file, pl.LazyFrame) else scan(input_file, PROPERTY_SCHEMA, separator=separator)
     
     # Apply limit if specified
     if limit:
-        df = df.head(limit)
+        rows = rows.head(limit)
         logger.info(f"Limited to first {limit} addresses for testing")
-    
-    logger.info(f"Loaded {len(df)} properties to geocode")
 
-    # Strip unit numbers from addresses when preparing the data
+    # Read only the two columns we need, with fixed types
+    lf = rows.select(address_column, postcode_column)
+
+    # Strip unit numbers and build "<address> <postcode>" keys as one vectorized expression
     logger.info("Stripping unit numbers from addresses...")
-    stripped_addresses = []
-    for row in df.iter_rows(named=True):
-        address = row[address_column]
-        stripped_address = strip_unit(address)
-        stripped_addresses.append(f"{stripped_address} {str(row[postcode_column])}")
+    with metrics.timer("address_keys"):
+        keys = lf.select(address_key_expr(address_column, postcode_column).alias("key")).collect()["key"]
+    row_count = len(keys)
+    logger.info(f"Loaded {row_count} properties to geocode")
     
     # Remove duplicates before geocoding
     logger.info("Removing duplicate addresses...")
-    unique_addresses = list(set(stripped_addresses))
-    logger.info(f"Removed {len(stripped_addresses) - len(unique_addresses)} duplicate addresses")
-    logger.info(f"Prepared {len(unique_addresses)} unique addresses for geocoding")
+    with metrics.timer("dedupe"):
+        unique_keys = keys.unique()
+    logger.info(f"Removed {len(keys) - len(unique_keys)} duplicate addresses")
+    del keys
+
+    result_file = output_file
+    if delta:
+        # Only keys that no earlier delta run has processed; results go to a side file first
+        manifest = load_manifest(output_file, output_format, separator, negative_expiry)
+        all_count = len(unique_keys)
+        unique_keys = new_keys(unique_keys, manifest)
+        logger.info(f"Delta mode: {len(unique_keys)} of {all_count} unique addresses are new since the last run")
+        result_file = delta_path(output_file)
+    unique_count = len(unique_keys)
+    logger.info(f"Prepared {unique_count} unique addresses for geocoding")
 
-    # Get the number of available CPU cores (workers)
-    num_workers = os.cpu_count() or 4
-    logger.info(f"Using {num_workers} workers for parallel geocoding")
+    # Results are streamed to checkpointed segments instead of being held in memory
+    result_writer = CheckpointWriter(result_file, separator, chunk_size, resume, output_format)
+    addresses = unique_keys
+    del unique_keys
+    resumed_found = pl.Series("address", [], pl.Utf8)
+    if resume:
+        completed = result_writer.completed_addresses()
+        addresses = addresses.filter(~addresses.is_in(completed.implode()))
+        logger.info(f"Skipping {len(completed)} addresses already in the partial output")
+        del completed
+        if delta:
+            # Segments write no-match and error results alike without coordinates, so
+            # only their matches count as processed; the rest are looked up next run
+            resumed_found = result_writer.completed_addresses(successes_only=True)
+    # Addresses are referred to by position from here on, with one status byte each
+    store = ResultStore(addresses)
+    del addresses
 
-    # Create a thread-safe queue and populate it with unique addresses
-    address_queue = queue.Queue()
-    for addr in unique_addresses:
-        address_queue.put(addr)
+    # Resolve everything we can from the cache up front so only misses reach Nominatim;
+    # hits go straight to the output, batch by batch
+    logger.info("Checking cache for previously geocoded addresses...")
+    cache_lookups = len(store)
+    cache_hits = resolve_cached(store, cache, result_writer, cache_batch_size, negative_expiry, error_expiry, retry_failed)
+    metrics.inc("cache_hits", cache_hits)
+    metrics.inc("cache_misses", cache_lookups - cache_hits)
+    counts = store.counts()
+    logger.info(f"Found {cache_hits} cached addresses ({counts[NOT_FOUND] + counts[ERROR]} known failures), {counts[PENDING]} left to geocode")
+    if retry_failed:
+        logger.info(f"Retry mode: re-querying {counts[PENDING]} addresses whose cached failure has expired")
 
-    # Create results dictionary with lock for thread safety
-    results = {}
-    results_lock = threading.Lock()
+    gazetteer_hits = 0
+    if gazetteer_file:
+        # Variants of addresses geocoded before, including ones Nominatim could not match, resolve in memory
+        with metrics.timer("gazetteer"):
+            gazetteer = Gazetteer.load(gazetteer_file)
+            unresolved = store.select(PENDING, NOT_FOUND, ERROR)
+            resolved = gazetteer.resolve(unresolved["address"], interpolate, interpolate_max_gap)
+        for address_id, combined_address, lat, lon in unresolved.join(resolved, on="address").select("id", "address", "lat", "lon").iter_rows():
+            store.set(address_id, FOUND)
+            result_writer.add(combined_address, lat, lon, "gazetteer")
+        for match, count in resolved.group_by("match").len().iter_rows():
+            metrics.inc("gazetteer_hits", count, match=match)
+        gazetteer_hits = resolved.height
+        logger.info(f"Resolved {gazetteer_hits} addresses from the gazetteer of {len(gazetteer)} "
+                    f"({resolved['match'].eq('interpolated').sum()} interpolated), {store.counts()[PENDING]} left to geocode")
+        del gazetteer, unresolved, resolved
+
+    # Cached failures are written without coordinates, so a resumed run skips them too
+    for combined_address in store.select(NOT_FOUND, ERROR)["address"]:
+        result_writer.add(combined_address, None, None)
+    with metrics.timer("schedule"):
+        pending_ids = schedule_ids(store.select(PENDING), schedule)
+
+    # Default concurrency scales with the number of backends so every replica is kept busy.
+    # With the adaptive limiter it is only a ceiling, so it can be generous.
+    backend_count = len(nominatim_urls)
+    if engine == 'async':
+        num_workers = concurrency or 64 * backend_count
+        logger.info(f"Using async engine with up to {num_workers} concurrent requests")
+    else:
+        # Default to the number of available CPU cores (workers) per backend
+        num_workers = concurrency or (32 if adaptive else os.cpu_count() or 4) * backend_count
+        logger.info(f"Using {num_workers} workers for parallel geocoding")
+
+    if adaptive:
+        # Each backend finds its own capacity, starting low and growing while latency allows
+        limiter_factory = lambda: AdaptiveLimiter(min(initial_concurrency, num_workers), max_limit=num_workers)
+        logger.info(f"Adapting concurrency to server capacity, starting at {initial_concurrency} requests per backend")
+    else:
+        limiter_factory = StaticLimiter
+    pool = BackendPool(nominatim_urls, max_failures, eject_seconds, slow_threshold, limiter_factory)
+    if len(pool) > 1:
+        logger.info(f"Balancing requests across {len(pool)} Nominatim backends")
+
+    # Other runs wait on the leases of buffered results, so those are not held back long
+    publish_age = PUBLISH_SECONDS if single_flight and redis_client else None
+    cache_writer = CacheWriteBuffer(cache, cache_expiry, min(cache_batch_size, 1000), single_flight, publish_age)
     
     # Create a progress counter with a lock
     progress_counter = {'count': 0, 'lock': threading.Lock()}
@@ -233,68 +904,170 @@ def main(input_file, output_file, limit, redis_host, redis_port, redis_db, cache
     # Start the progress reporter thread
     progress_thread = threading.Thread(
         target=progress_reporter,
-        args=(progress_counter, len(unique_addresses), stop_event)
+        args=(progress_counter, max(len(pending_ids), 1), stop_event, pool, metrics_sinks)
     )
     progress_thread.daemon = True
     progress_thread.start()
 
-    # Create and start worker threads
-    threads = []
-    total_addresses = len(unique_addresses)
+    total_addresses = len(pending_ids)
     start_time = time.time()
-    logger.info(f"Starting geocoding of {total_addresses} unique addresses with {num_workers} workers")
-
-    for _ in range(num_workers):
-        thread = threading.Thread(
-            target=worker,
-            args=(address_queue, results, results_lock, progress_counter, redis_client, cache_expiry, 
-                  nominatim_url, country_code, state)
-        )
-        thread.daemon = True
-        thread.start()
-        threads.append(thread)
-
-    # Wait for all addresses to be processed
-    logger.info("Processing addresses...")
-    address_queue.join()
-    logger.info("All addresses processed")
-    
-    # Stop the progress reporter
+    logger.info(f"Starting geocoding of {total_addresses} unique addresses with {num_workers} workers in {schedule} order, querying {' then '.join(query_tiers)}")
+    if single_flight:
+        logger.info(f"Claiming addresses before querying them with {'Redis and in-process' if redis_client else 'in-process'} leases of {lease_ttl:.0f}s")
+
+    try:
+        if engine == 'async':
+            logger.info("Processing addresses...")
+            asyncio.run(run_async_geocoder(pending_ids, result_writer, store, progress_counter, cache_writer,
+                                           pool, country_code, state, num_workers, timeout, max_retries, retry_backoff, query_tiers, single_flight))
+            logger.info("All addresses processed")
+        else:
+            # Create a thread-safe queue and populate it with the IDs of pending addresses
+            id_queue = queue.Queue()
+            for address_id in pending_ids:
+                id_queue.put(address_id)
+
+            # Create and start worker threads
+            threads = []
+            for _ in range(num_workers):
+                thread = threading.Thread(
+                    target=worker,
+                    args=(id_queue, result_writer, store, progress_counter, cache_writer,
+                          pool, country_code, state, timeout, max_retries, retry_backoff, query_tiers, single_flight)
+                )
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            # Wait for all addresses to be processed; joining with a timeout (rather than
+            # id_queue.join()) lets Ctrl-C reach the main thread
+            logger.info("Processing addresses...")
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+            logger.info("All addresses processed")
+    except KeyboardInterrupt:
+        # Keep everything finished so far so the run can be resumed
+        result_writer.flush()
+        cache_writer.close()
+        logger.warning(f"Interrupted; partial results are in {result_writer.parts_dir}, rerun with --resume to continue")
+        for sink in metrics_sinks:
+            sink.close(metrics.REGISTRY)
+        raise
+    
+    # Write back whatever is left in the cache buffer
+    cache_writer.close()
+
+    # Stop the progress reporter, which wakes up at once
     stop_event.set()
-    progress_thread.join(timeout=1)
+    progress_thread.join()
     
     elapsed_time = time.time() - start_time
     logger.info(f"Total processing time: {elapsed_time:.2f} seconds ({elapsed_time/60:.2f} minutes)")
     addresses_per_second = total_addresses / elapsed_time if elapsed_time > 0 else 0
     logger.info(f"Processing speed: {addresses_per_second:.2f} addresses/second")
+    if total_addresses:
+        pool.log_stats()
+    coalesced = metrics.REGISTRY.counters.get(("coalesced", ()), 0)
+    if coalesced:
+        logger.info(f"Took {coalesced} results from concurrent runs instead of querying them")
 
-    # Extract results
-    success_count = 0
-    lat_values = []
-    lon_values = []
-    
-    for combined_address in unique_addresses:
-        lat, lon = results.get(combined_address, (None, None))
-        lat_values.append(lat)
-        lon_values.append(lon)
-        if lat is not None and lon is not None:
-            success_count += 1
-
-    # Create a simplified dataframe with just the unique combined address and coordinates
-    simplified_df = pl.DataFrame({
-        "address": unique_addresses,
-        "lat": lat_values,
-        "lon": lon_values
-    })
-    
-    # Drop rows where lat or lon is None
-    simplified_df = simplified_df.filter(
-        (pl.col("lat").is_not_null()) & (pl.col("lon").is_not_null())
-    )
+    # Merge the checkpointed segments into the final output
+    with metrics.timer("finalize"):
+        result_writer.finalize()
+    success_count = result_writer.success_count
 
-    logger.info(f"Geocoding complete. Successfully geocoded {success_count}/{len(unique_addresses)} unique properties ({success_count/len(unique_addresses)*100:.2f}%)")
-    simplified_df.write_csv(output_file, separator=separator)
+    success_share = success_count / unique_count * 100 if unique_count else 100.0
+    logger.info(f"Geocoding complete. Successfully geocoded {success_count}/{unique_count} unique properties ({success_share:.2f}%)")
+    report_failures(store.select(NOT_FOUND, ERROR))
+
+    if delta:
+        with metrics.timer("delta_merge"):
+            merge_into_store(output_file, result_file, output_format, separator)
+            # Addresses that hit errors, or were skipped or never queried, are left out so the next run tries them
+            found = pl.concat([resumed_found, store.select(FOUND)["address"]])
+            manifest_count = update_manifest(output_file, manifest, found, store.select(NOT_FOUND)["address"])
+        logger.info(f"Merged {success_count} new results into {output_file}; {manifest_count} addresses processed so far")
     logger.info(f"Saved geocoded data to {output_file}")
 
+    if rows_output:
+        logger.info("Joining coordinates back onto every input row...")
+        with metrics.timer("join_rows"):
+            write_joined_rows(rows, output_file, rows_output, address_column, postcode_column, separator, output_format, rows_format)
+        logger.info(f"Saved {row_count} rows with coordinates to {rows_output}")
+
+    metrics.log_stage_summary()
+    for sink in metrics_sinks:
+        sink.close(metrics.REGISTRY)
+
+    # Summary for callers that invoke the command programmatically, such as benchmark.py
+    return {
+        "rows": row_count,
+        "unique_addresses": unique_count,
+        "cache_lookups": cache_lookups,
+        "cache_hits": cache_hits,
+        "gazetteer_hits": gazetteer_hits,
+        "queried": total_addresses,
+        "coalesced": coalesced,
+        "geocoded": success_count,
+        "geocoding_seconds": elapsed_time,
+        "total_seconds": time.time() - run_start,
+        "stage_seconds": metrics.REGISTRY.stage_totals(),
+        **pool.latency_summary(),
+    }
+
+def write_joined_rows(rows, geocoded_file, rows_output, address_column="address", postcode_column="post_code", separator="\t", geocoded_format=None, rows_format=None):
+    """Stream the property rows, with the coordinates from geocoded_file joined on, to rows_output."""
+    geocoded = scan(geocoded_file, GEOCODED_SCHEMA, geocoded_format, separator)
+    joined = join_coordinates(rows, geocoded, address_column, postcode_column)
+    sink(joined, rows_output, ENRICHED_SCHEMA, rows_format, separator)
+
+@cli.command("join-rows")
+@click.argument('input_file', type=click.Path(exists=True))
+@click.argument('geocoded_file', type=click.Path(exists=True))
+@click.argument('output_file', type=click.Path())
+@click.option('--address-column', default='address', help='Name of the address column in the input file')
+@click.option('--postcode-column', default='post_code', help='Name of the postcode column in the input file')
+@click.option('--separator', default='\t', help='Separator for CSV input and output')
+@click.option('--output-format', type=click.Choice(FORMATS), help='Output format (default: from the OUTPUT_FILE extension, else csv)')
+def join_rows(input_file, geocoded_file, output_file, address_column, postcode_column, separator, output_format):
+    """Join coordinates from an earlier geocode run back onto every input row.
+    
+    INPUT_FILE: The file that was geocoded
+    GEOCODED_FILE: The geocode command's OUTPUT_FILE
+    OUTPUT_FILE: Where to write the input rows with lat and lon columns added
+    """
+    rows = scan(input_file, PROPERTY_SCHEMA, separator=separator)
+    write_joined_rows(rows, geocoded_file, output_file, address_column, postcode_column, separator, rows_format=output_format)
+    logger.info(f"Saved rows with coordinates to {output_file}")
+
+@cli.command("cache-stats")
+@click.option('--redis-host', default='localhost', help='Redis host')
+@click.option('--redis-port', default=16379, help='Redis port')
+@click.option('--redis-db', default=0, help='Redis database number')
+@click.option('--scan-count', default=1000, help='SCAN batch size hint')
+@click.option('--sample-size', default=10000, help='Number of keys to sample for TTL and memory statistics')
+@click.option('--json', 'as_json', is_flag=True, help='Print the statistics as JSON')
+def cache_stats(redis_host, redis_port, redis_db, scan_count, sample_size, as_json):
+    """Report key count, memory use, TTL distribution and hit ratio of the geocode cache."""
+    redis_client = init_redis(redis_host, redis_port, redis_db)
+    if redis_client is None:
+        sys.exit(1)
+    stats = collect_cache_stats(redis_client, scan_count, sample_size)
+    if as_json:
+        click.echo(json.dumps(stats, indent=2))
+        return
+
+    logger.info(f"Cached addresses: {stats['key_count']} (~{stats['approx_addresses_ever_cached']} ever cached)")
+    logger.info(f"Estimated cache memory: {stats['estimated_memory_bytes'] / 1024**2:.2f} MiB "
+                f"(sampled {stats['sampled_keys']} keys; Redis total {stats['redis_used_memory']})")
+    for label, count in stats['ttl_distribution'].items():
+        share = count / stats['sampled_keys'] * 100 if stats['sampled_keys'] else 0
+        logger.info(f"TTL {label}: {count} ({share:.2f}%)")
+    if stats['hit_ratio'] is None:
+        logger.info("Hit ratio: no lookups recorded yet")
+    else:
+        logger.info(f"Hit ratio: {stats['hit_ratio']*100:.2f}% ({stats['hits']} hits, {stats['misses']} misses)")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
@@ -0,0 +1,504 @@
+"""
+Offline benchmark of the geocoding pipeline.
+
+Runs batch_geocode_local's geocode command end to end on synthetic NSW-style property
+data, against a local mock of Nominatim's /search endpoint and an in-memory stand-in
+for Redis, so no external services are needed. Each case runs in a fresh process so
+its peak RSS is its own. Results are saved as JSON; pass the JSON of an earlier run as
+--baseline to flag regressions.
+"""
+
+import fnmatch
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import click
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# Streets, suburbs and postcodes for synthetic addresses in the style of the NSW property sales data
+STREETS = ["BELLEVUE", "PACIFIC", "VICTORIA", "GEORGE", "PITT", "MILITARY", "KULGOA", "DUXFORD", "PARRAMATTA",
+           "OXFORD", "CHURCH", "KING", "QUEEN", "BOTANY", "ELIZABETH", "MACQUARIE", "HARRIS", "CROWN", "BRIDGE", "MARKET"]
+STREET_TYPES = ["ST", "RD", "AVE", "PDE", "HWY", "CRES", "PL", "LANE", "DR", "CCT"]
+SUBURBS = [("BELLEVUE HILL", 2023), ("PADDINGTON", 2021), ("RYDE", 2112), ("MOSMAN", 2088), ("NEWTOWN", 2042),
+           ("BONDI", 2026), ("PARRAMATTA", 2150), ("CHATSWOOD", 2067), ("MANLY", 2095), ("BLACKTOWN", 2148),
+           ("PENRITH", 2750), ("LIVERPOOL", 2170), ("HORNSBY", 2077), ("CRONULLA", 2230), ("WOLLONGONG", 2500),
+           ("NEWCASTLE", 2300), ("GOSFORD", 2250), ("ORANGE", 2800), ("DUBBO", 2830), ("ALBURY", 2640)]
+
+# Sydney's bounding box, for made-up coordinates
+LAT_RANGE = (-34.1, -33.6)
+LON_RANGE = (150.6, 151.35)
+
+
+def make_corpus(rows, seed=0, unit_share=0.3):
+    """Return a DataFrame of synthetic property sales with address and post_code columns.
+
+    Roughly unit_share of the rows are units ("14/154 BELLEVUE RD"), which share a
+    geocoding key with the other units in their building.
+    """
+    rng = random.Random(seed)
+    # Enough distinct buildings that most rows are unique addresses, as in the real data
+    buildings = max(1, int(rows * 0.7))
+    addresses = []
+    postcodes = []
+    for _ in range(rows):
+        building = rng.randrange(buildings)
+        street = STREETS[building % len(STREETS)]
+        street_type = STREET_TYPES[building // len(STREETS) % len(STREET_TYPES)]
+        suburb, postcode = SUBURBS[building // (len(STREETS) * len(STREET_TYPES)) % len(SUBURBS)]
+        number = building // (len(STREETS) * len(STREET_TYPES) * len(SUBURBS)) + 1
+        unit = f"{rng.randint(1, 40)}/" if rng.random() < unit_share else ""
+        addresses.append(f"{unit}{number} {street} {street_type}, {suburb}")
+        postcodes.append(postcode)
+    return pl.DataFrame({"address": addresses, "post_code": postcodes}, schema={"address": pl.Utf8, "post_code": pl.Int64})
+
+
+class InMemoryRedis:
+    """Single-process stand-in for the subset of redis.Redis used by the geocode cache."""
+
+    def __init__(self):
+        self.values = {}
+        self.expires_at = {}
+        self.sets = {}
+        self.lock = threading.Lock()
+
+    def ping(self):
+        return True
+
+    def _live(self, key):
+        # Caller holds the lock
+        expires_at = self.expires_at.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.values.pop(key, None)
+            self.expires_at.pop(key, None)
+        return self.values.get(key)
+
+    def get(self, key):
+        with self.lock:
+            return self._live(key)
+
+    def mget(self, keys):
+        with self.lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and self._live(key) is not None:
+                return None
+            self.values[key] = value
+            if px is None:
+                self.expires_at.pop(key, None)
+            else:
+                self.expires_at[key] = time.time() + px / 1000
+        return True
+
+    def setex(self, key, seconds, value):
+        with self.lock:
+            self.values[key] = value
+            self.expires_at[key] = time.time() + seconds
+        return True
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self._live(key) or 0) + amount
+            self.values[key] = str(value)
+            return value
+
+    def ttl(self, key):
+        with self.lock:
+            if self._live(key) is None:
+                return -2
+            expires_at = self.expires_at.get(key)
+            return -1 if expires_at is None else int(expires_at - time.time())
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        from single_flight import RELEASE_SCRIPT
+
+        # Only the lease release script, run atomically like Redis would
+        if script != RELEASE_SCRIPT:
+            raise NotImplementedError("InMemoryRedis only runs single_flight.RELEASE_SCRIPT")
+        key, owner = keys_and_args
+        with self.lock:
+            if self._live(key) != owner:
+                return 0
+            self.values.pop(key)
+            self.expires_at.pop(key, None)
+            return 1
+
+    def pfadd(self, key, *members):
+        # An exact set rather than a HyperLogLog; fine at benchmark sizes
+        with self.lock:
+            members_set = self.sets.setdefault(key, set())
+            before = len(members_set)
+            members_set.update(members)
+            return int(len(members_set) > before)
+
+    def pfcount(self, key):
+        with self.lock:
+            return len(self.sets.get(key, ()))
+
+    def scan_iter(self, match=None, count=None):
+        with self.lock:
+            keys = [key for key in list(self.values) if self._live(key) is not None]
+        return iter([key for key in keys if match is None or fnmatch.fnmatchcase(key, match)])
+
+    def memory_usage(self, key):
+        # Rough: the key and value bytes, without Redis's per-key overhead
+        with self.lock:
+            value = self._live(key)
+        return None if value is None else len(key) + len(value)
+
+    def info(self, section=None):
+        with self.lock:
+            used = sum(len(key) + len(str(value)) for key, value in self.values.items())
+        return {"used_memory": used, "used_memory_human": f"{used / 1024:.2f}K"}
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    """Queues commands for InMemoryRedis and runs them on execute()."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue_command(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue_command
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Listen backlog with room for every worker's connection
+    request_queue_size = 1024
+
+
+class MockNominatim:
+    """Local HTTP server answering /search like Nominatim, with configurable latency and failures.
+
+    Every request takes latency seconds, plus up to jitter seconds more. failure_rate of
+    requests get a 503, and so do all requests beyond capacity in flight, if set.
+    not_found_rate of addresses get no match; which ones depends only on the query, so
+    repeated runs agree. Queries containing any of the strings in no_match never match.
+    Structured queries (street, city, postalcode) are matched on those parts joined
+    together; ones whose street contains any of structured_no_match never match,
+    like addresses Nominatim only finds through free-text parsing.
+    With db_cache set, the server models a database cache holding that many
+    localities (the query without its house number: street, suburb and postcode),
+    least recently used first out; a query for a locality not in it takes
+    miss_latency seconds longer, like a read from disk on a host short of memory.
+    Use as a context manager; url is set while it is running.
+    """
+
+    def __init__(self, latency=0.005, jitter=0.0, failure_rate=0.0, not_found_rate=0.05, capacity=None, seed=0, no_match=(), structured_no_match=(),
+                 db_cache=None, miss_latency=0.02):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.not_found_rate = not_found_rate
+        self.capacity = capacity
+        self.no_match = no_match
+        self.structured_no_match = structured_no_match
+        self.db_cache = db_cache
+        self.miss_latency = miss_latency
+        self.localities = OrderedDict()
+        self.cache_misses = 0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.server = None
+        self.url = None
+
+    def respond(self, query):
+        """Return (status, body) for a /search query string."""
+        params = {name: values[0] for name, values in parse_qs(query).items()}
+        text = params.get("q") or ", ".join(params[name] for name in ("street", "city", "postalcode") if name in params)
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            overloaded = self.capacity is not None and self.in_flight > self.capacity
+            failed = overloaded or self.rng.random() < self.failure_rate
+            delay = self.latency + self.rng.random() * self.jitter
+            if failed:
+                self.failures += 1
+            elif self.db_cache is not None:
+                locality = text.split(" ", 1)[-1]
+                if locality in self.localities:
+                    self.localities.move_to_end(locality)
+                else:
+                    self.cache_misses += 1
+                    delay += self.miss_latency
+                    self.localities[locality] = True
+                    if len(self.localities) > self.db_cache:
+                        self.localities.popitem(last=False)
+        try:
+            if failed:
+                return 503, b'{"error": "Service Unavailable"}'
+            time.sleep(delay)
+            digest = zlib.crc32(text.encode())
+            if digest % 10000 < self.not_found_rate * 10000 or any(part in text for part in self.no_match):
+                return 200, b"[]"
+            if any(part in params.get("street", "") for part in self.structured_no_match):
+                return 200, b"[]"
+            lat = LAT_RANGE[0] + (digest % 100003) / 100003 * (LAT_RANGE[1] - LAT_RANGE[0])
+            lon = LON_RANGE[0] + (digest // 100003 % 100019) / 100019 * (LON_RANGE[1] - LON_RANGE[0])
+            return 200, json.dumps([{"lat": f"{lat:.7f}", "lon": f"{lon:.7f}", "display_name": text}]).encode()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def __enter__(self):
+        mock_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like Nominatim behind a web server
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.rstrip("/") == "/search":
+                    status, body = mock_server.respond(url.query)
+                else:
+                    status, body = 404, b"[]"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = MockServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.url = None
+
+
+@contextmanager
+def in_memory_redis(client):
+    """Make batch_geocode_local use client as its Redis tier instead of connecting to a server."""
+    import batch_geocode_local
+    with mock.patch.object(batch_geocode_local, "init_redis", lambda host, port, db: client):
+        yield client
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(corpus_path, nominatim_url, workdir, engine="threads", warm_fraction=0.0, extra_args=(), seed=0, verbose=False, schedule="locality"):
+    """Geocode one corpus end to end and return the run's metrics.
+
+    warm_fraction of the unique addresses are put in the Redis stand-in beforehand, to
+    measure runs against a partly warm cache. Meant to run in a process of its own.
+    """
+    import batch_geocode_local
+    from addr_utils import address_key_expr
+    from geocode_cache import RedisCache
+
+    if not verbose:
+        for name in ("batch_geocode_local", "backend_pool", "checkpoint", "geocode_cache", "metrics"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    client = InMemoryRedis()
+    if warm_fraction:
+        keys = pl.scan_parquet(corpus_path).select(address_key_expr("address", "post_code").alias("key")).unique().collect()["key"]
+        warm = keys.sample(fraction=warm_fraction, seed=seed).to_list()
+        RedisCache(client).set_many([(key, (-33.87, 151.21)) for key in warm], 60*60)
+
+    workdir = Path(workdir)
+    args = [
+        str(corpus_path), str(workdir / f"geocoded-{engine}.parquet"),
+        "--nominatim-url", nominatim_url,
+        "--engine", engine,
+        "--schedule", schedule,
+        "--cache-path", str(workdir / f"cache-{engine}.sqlite"),
+        *extra_args,
+    ]
+    with in_memory_redis(client):
+        summary = batch_geocode_local.main.main(args, standalone_mode=False)
+
+    return {
+        "rows": summary["rows"],
+        "unique_addresses": summary["unique_addresses"],
+        "engine": engine,
+        "schedule": schedule,
+        "addresses_per_second": summary["unique_addresses"] / summary["total_seconds"] if summary["total_seconds"] else 0.0,
+        "queries_per_second": summary["queried"] / summary["geocoding_seconds"] if summary["geocoding_seconds"] else 0.0,
+        "total_seconds": summary["total_seconds"],
+        "p50_latency": summary["p50_latency"],
+        "p99_latency": summary["p99_latency"],
+        "requests": summary["requests"],
+        "errors": summary["errors"],
+        "geocoded": summary["geocoded"],
+        "cache_hit_ratio": summary["cache_hits"] / summary["cache_lookups"] if summary["cache_lookups"] else 0.0,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "stage_seconds": summary["stage_seconds"],
+    }
+
+
+def run_case_in_process(**kwargs):
+    """Run run_case in a fresh spawned process, so peak RSS and caches start from zero."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as process_pool:
+        return process_pool.apply(run_case, kwds=kwargs)
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """Return descriptions of metrics that regressed by more than tolerance against a baseline run.
+
+    Cases are matched on rows, engine and schedule; cases missing from either run are ignored.
+    """
+    # Metric and whether higher is better
+    metrics = [("addresses_per_second", True), ("p99_latency", False), ("peak_rss_bytes", False)]
+    baseline_cases = {(case["rows"], case["engine"], case.get("schedule")): case for case in baseline["results"]}
+    regressions = []
+    for case in results["results"]:
+        previous = baseline_cases.get((case["rows"], case["engine"], case.get("schedule")))
+        if previous is None:
+            continue
+        for metric, higher_is_better in metrics:
+            old, new = previous[metric], case[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{case['rows']} rows, {case['engine']}, {case.get('schedule')} order: {metric} {old:.4g} -> {new:.4g} ({change*100:+.1f}%)")
+    return regressions
+
+
+def git_revision():
+    """Short hash of the checked out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--sizes', default='10000,100000', help='Comma-separated corpus sizes in rows (e.g. 10000,100000,1000000)')
+@click.option('--engine', 'engines', type=click.Choice(['threads', 'async']), multiple=True, default=['threads', 'async'], help='Geocoding engine to benchmark; repeat for several')
+@click.option('--schedule', 'schedules', type=click.Choice(['locality', 'unordered']), multiple=True, default=['locality'], help='Query order of the geocode command; repeat to compare several')
+@click.option('--latency', default=0.005, help='Mock server response time in seconds')
+@click.option('--jitter', default=0.005, help='Extra random response time of up to this many seconds')
+@click.option('--failure-rate', default=0.0, help='Share of requests the mock server answers with a 503')
+@click.option('--not-found-rate', default=0.05, help='Share of addresses the mock server has no match for')
+@click.option('--capacity', type=int, help='Requests in flight beyond which the mock server answers with a 503')
+@click.option('--db-cache', type=int, help='Localities the mock server keeps in its database cache (default: no cache model)')
+@click.option('--miss-latency', default=0.02, help='Extra response time in seconds for a locality outside the mock database cache')
+@click.option('--warm-fraction', default=0.0, help='Share of unique addresses already in the cache before each run')
+@click.option('--concurrency', type=int, help='Passed on to the geocode command')
+@click.option('--adaptive/--no-adaptive', default=True, help='Passed on to the geocode command')
+@click.option('--seed', default=0, help='Seed for the synthetic corpus and the mock server')
+@click.option('--output', default='benchmark_results.json', help='Where to save the results as JSON')
+@click.option('--baseline', type=click.Path(exists=True), help='Results JSON of an earlier run to check for regressions')
+@click.option('--tolerance', default=0.2, help='Relative change in throughput, p99 latency or peak RSS counted as a regression')
+@click.option('--verbose', is_flag=True, help='Show the geocode command log')
+def main(sizes, engines, schedules, latency, jitter, failure_rate, not_found_rate, capacity, db_cache, miss_latency, warm_fraction, concurrency, adaptive,
+         seed, output, baseline, tolerance, verbose):
+    """Benchmark the geocoding pipeline against a local mock Nominatim server."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sizes = [int(size) for size in sizes.split(',') if size.strip()]
+    extra_args = ["--adaptive" if adaptive else "--no-adaptive"]
+    if concurrency:
+        extra_args += ["--concurrency", str(concurrency)]
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "cpu_count": multiprocessing.cpu_count(),
+        "config": {
+            "latency": latency, "jitter": jitter, "failure_rate": failure_rate, "not_found_rate": not_found_rate,
+            "capacity": capacity, "db_cache": db_cache, "miss_latency": miss_latency, "warm_fraction": warm_fraction, "concurrency": concurrency, "adaptive": adaptive, "seed": seed,
+        },
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in sizes:
+            corpus_path = Path(workdir) / f"corpus-{rows}.parquet"
+            make_corpus(rows, seed).write_parquet(corpus_path)
+            for engine in engines:
+                for schedule in schedules:
+                    # A fresh server per case, so request counts, overload and its database cache do not carry over
+                    with MockNominatim(latency, jitter, failure_rate, not_found_rate, capacity, seed, db_cache=db_cache, miss_latency=miss_latency) as server:
+                        case_dir = Path(workdir) / f"{rows}-{engine}-{schedule}"
+                        case_dir.mkdir()
+                        logger.info(f"Benchmarking {rows} rows with the {engine} engine in {schedule} order")
+                        case = run_case_in_process(corpus_path=str(corpus_path), nominatim_url=server.url, workdir=str(case_dir),
+                                                   engine=engine, warm_fraction=warm_fraction, extra_args=extra_args,
+                                                   seed=seed, verbose=verbose, schedule=schedule)
+                        case["db_cache_hit_ratio"] = 1 - server.cache_misses / server.requests if db_cache is not None and server.requests else None
+                    results["results"].append(case)
+                    logger.info(
+                        f"  {case['unique_addresses']} unique addresses: {case['addresses_per_second']:.1f} addresses/s, "
+                        f"p50 {case['p50_latency']*1000:.1f}ms p99 {case['p99_latency']*1000:.1f}ms, "
+                        f"peak RSS {case['peak_rss_bytes'] / 1024**2:.0f} MiB, cache hit ratio {case['cache_hit_ratio']*100:.1f}%"
+                        + (f", server database cache hit ratio {case['db_cache_hit_ratio']*100:.1f}%" if case["db_cache_hit_ratio"] is not None else "")
+                    )
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Saved benchmark results to {output}")
+
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        if baseline_results.get("config") != results["config"]:
+            logger.warning(f"{baseline} was run with different settings, so the comparison may be misleading")
+        regressions = compare_results(results, baseline_results, tolerance)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regressions beyond {tolerance*100:.0f}% against {baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Crash-safe, incremental output for long geocoding runs.
+
+Results are appended in fixed-size CSV segments under "<output>.parts/". A segment
+is written to a temporary file and renamed into place before it is recorded in
+manifest.json, so after a crash the manifest only lists complete segments and a
+resumed run can skip every address they contain.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+
+import polars as pl
+
+from pipeline_io import GEOCODED_SCHEMA, sink, write
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Segments and the merged output also record the query tier that found each address
+SEGMENT_SCHEMA = {**GEOCODED_SCHEMA, "tier": pl.Utf8}
+
+
+class CheckpointWriter:
+    """Thread-safe writer that flushes results to disk every chunk_size rows.
+
+    Segments are always CSV; fmt only picks the format of the merged output file.
+    """
+
+    def __init__(self, output_file, separator="\t", chunk_size=10000, resume=False, fmt=None):
+        self.output_file = output_file
+        self.separator = separator
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.parts_dir = f"{output_file}.parts"
+        self.manifest_path = os.path.join(self.parts_dir, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.buffer = []
+
+        if resume and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            logger.info(f"Resuming from {len(self.manifest['segments'])} checkpointed segments in {self.parts_dir}")
+        else:
+            # A fresh run never mixes with segments left over from an earlier one
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            self.manifest = {"separator": separator, "segments": []}
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self.success_count = sum(segment["successes"] for segment in self.manifest["segments"])
+
+    def completed_addresses(self, successes_only=False):
+        """Return a Series of the addresses already stored in checkpointed segments.
+
+        With successes_only, only those stored with coordinates.
+        """
+        if not self.manifest["segments"]:
+            return pl.Series("address", [], dtype=pl.Utf8)
+        lf = self._scan()
+        if successes_only:
+            lf = lf.filter(pl.col("lat").is_not_null() & pl.col("lon").is_not_null())
+        return lf.select("address").collect()["address"]
+
+    def add(self, address, lat, lon, tier=None):
+        """Append one result, writing a segment once chunk_size rows are buffered."""
+        with self.lock:
+            self.buffer.append((address, lat, lon, tier))
+            if len(self.buffer) >= self.chunk_size:
+                self._write_segment()
+
+    def flush(self):
+        """Write any buffered rows as a final, possibly short, segment."""
+        with self.lock:
+            if self.buffer:
+                self._write_segment()
+
+    def finalize(self):
+        """Flush, merge all segments into the output file and remove the checkpoint directory.
+
+        Only rows with coordinates are kept. The merge streams through polars, so
+        memory does not grow with the number of rows.
+        """
+        self.flush()
+        if self.manifest["segments"]:
+            lf = self._scan().filter((pl.col("lat").is_not_null()) & (pl.col("lon").is_not_null()))
+            sink(lf, self.output_file, SEGMENT_SCHEMA, self.fmt, self.separator)
+        else:
+            write(pl.DataFrame(schema=SEGMENT_SCHEMA), self.output_file, fmt=self.fmt, separator=self.separator)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def _scan(self):
+        paths = [os.path.join(self.parts_dir, segment["file"]) for segment in self.manifest["segments"]]
+        return pl.scan_csv(paths, separator=self.manifest["separator"], schema=SEGMENT_SCHEMA)
+
+    def _write_segment(self):
+        # Caller holds the lock
+        rows, self.buffer = self.buffer, []
+        name = f"part-{len(self.manifest['segments']):05d}.csv"
+        path = os.path.join(self.parts_dir, name)
+        df = pl.DataFrame(rows, schema=SEGMENT_SCHEMA, orient="row")
+        df.write_csv(f"{path}.tmp", separator=self.manifest["separator"])
+        os.replace(f"{path}.tmp", path)
+
+        successes = df.filter(pl.col("lat").is_not_null() & pl.col("lon").is_not_null()).height
+        self.success_count += successes
+        self.manifest["segments"].append({"file": name, "rows": len(rows), "successes": successes})
+        with open(f"{self.manifest_path}.tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+        logger.debug(f"Checkpointed {len(rows)} results to {path}")
@@ -0,0 +1,112 @@
+"""
+Incremental geocoding of new releases of the property dataset.
+
+A delta run treats the geocode OUTPUT_FILE as a store that grows from release to
+release. Next to it, "<store>.manifest.parquet" lists every address key processed
+so far, geocoded or not found. Only keys missing from the manifest are geocoded;
+their results are merged into the store and their keys added to the manifest. Keys
+whose lookup ended in an HTTP or network error, or that a run skipped or never got
+to, stay out of the manifest, so the next run tries them again.
+
+Keys with no match are recorded with the time they were looked up, and leave the
+manifest once --negative-expiry has passed, so a later run queries them again just
+as a full run would once their cached failure expires.
+
+The manifest stores the keys themselves rather than hashes. Sorted and
+zstd-compressed they take less space than 64-bit hashes (shared prefixes compress
+well, random hashes do not), membership is exact, and the file does not depend on a
+hash function that can change between polars versions.
+"""
+
+import logging
+import os
+import time
+from pathlib import Path
+
+import polars as pl
+
+from pipeline_io import GEOCODED_SCHEMA, detect_format, read, scan, sink
+
+logger = logging.getLogger(__name__)
+
+# not_found_at is when a key had no match, in seconds since the epoch; null for geocoded keys
+MANIFEST_SCHEMA = {"address": pl.Utf8, "not_found_at": pl.Float64}
+
+
+def manifest_path(store_path):
+    """Path of the manifest of processed keys for a geocoded store."""
+    return f"{store_path}.manifest.parquet"
+
+
+def delta_path(store_path):
+    """Path for a delta run's own results before they are merged, in the store's format."""
+    path = Path(store_path)
+    return str(path.with_name(f"{path.stem}.delta{path.suffix}"))
+
+
+def load_manifest(store_path, fmt=None, separator="\t", negative_expiry=None, now=None):
+    """Return the processed keys of a store as a DataFrame with MANIFEST_SCHEMA.
+
+    With negative_expiry, keys whose no-match is older than that many seconds are
+    left out, so they are processed again. A store without a manifest, such as the
+    output of a full run, is seeded from its own addresses, which all have
+    coordinates; no store at all means nothing has been processed.
+    """
+    path = manifest_path(store_path)
+    if os.path.exists(path):
+        manifest = pl.read_parquet(path)
+        # Manifests written before not-found keys were timed hold only geocoded ones
+        if "not_found_at" not in manifest.columns:
+            manifest = manifest.with_columns(pl.lit(None, pl.Float64).alias("not_found_at"))
+        if negative_expiry is not None:
+            cutoff = (time.time() if now is None else now) - negative_expiry
+            manifest = manifest.filter(pl.col("not_found_at").is_null() | (pl.col("not_found_at") > cutoff))
+        return manifest.select(list(MANIFEST_SCHEMA))
+    if os.path.exists(store_path):
+        logger.info(f"No manifest found, seeding it from the addresses in {store_path}")
+        keys = read(store_path, GEOCODED_SCHEMA, fmt, separator, columns=["address"])["address"]
+    else:
+        keys = pl.Series("address", [], pl.Utf8)
+    return manifest_rows(keys, None)
+
+
+def manifest_rows(keys, not_found_at):
+    """Manifest rows for keys, all with the same not_found_at."""
+    return keys.rename("address").to_frame().with_columns(pl.lit(not_found_at, pl.Float64).alias("not_found_at"))
+
+
+def new_keys(keys, manifest):
+    """Keys not in the manifest."""
+    return keys.filter(~keys.is_in(manifest["address"].implode()))
+
+
+def merge_into_store(store_path, delta_file, fmt=None, separator="\t"):
+    """Merge the rows of delta_file into the store, replacing rows for the same address.
+
+    The merged store is written next to the old one and renamed over it, so a crash
+    leaves either the old or the new store. delta_file is removed afterwards.
+    """
+    fmt = detect_format(store_path, fmt)
+    parts = [scan(delta_file, GEOCODED_SCHEMA, fmt, separator)]
+    if os.path.exists(store_path):
+        parts.insert(0, scan(store_path, GEOCODED_SCHEMA, fmt, separator))
+    # Stores written before results recorded their query tier lack that column
+    merged = pl.concat(parts, how="diagonal_relaxed").unique(subset="address", keep="last", maintain_order=True)
+    tmp_path = f"{store_path}.tmp"
+    sink(merged, tmp_path, GEOCODED_SCHEMA, fmt, separator)
+    os.replace(tmp_path, store_path)
+    os.remove(delta_file)
+
+
+def update_manifest(store_path, manifest, found, not_found=None, now=None):
+    """Add geocoded and not-found keys to the manifest and save it atomically; returns the new key count."""
+    now = time.time() if now is None else now
+    parts = [manifest, manifest_rows(found, None)]
+    if not_found is not None:
+        parts.append(manifest_rows(not_found, now))
+    # A key processed again keeps its latest outcome
+    keys = pl.concat(parts).unique(subset="address", keep="last", maintain_order=True).sort("address")
+    path = manifest_path(store_path)
+    keys.write_parquet(f"{path}.tmp", compression="zstd")
+    os.replace(f"{path}.tmp", path)
+    return len(keys)
@@ -0,0 +1,57 @@
+"""
+Single entry point for the ETL scripts: python etl.py COMMAND [ARGS]...
+
+Each command is the click command of one of the scripts, imported only when it is
+run. Listing the commands with --help therefore never loads polars, h3 or the HTTP
+and Redis clients, and a command pays only for the modules it uses. The scripts
+still run on their own as before.
+"""
+
+import importlib
+import logging
+import sys
+
+import click
+
+# Command name -> (module, click command in that module, summary shown by --help)
+COMMANDS = {
+    "filter": ("filter", "main", "Filter the NSW property dump to a set of councils."),
+    "councils": ("unique_council_names", "main", "Extract the unique council names."),
+    "geocode": ("batch_geocode_local", "main", "Geocode addresses against Nominatim with a tiered cache."),
+    "join-rows": ("batch_geocode_local", "join_rows", "Join geocoded coordinates back onto every input row."),
+    "cache-stats": ("batch_geocode_local", "cache_stats", "Report statistics of the Redis geocode cache."),
+    "gazetteer": ("gazetteer", "cli", "Build the local gazetteer of geocoded addresses."),
+    "h3": ("add_h3_col", "main", "Add H3 cell IDs to geocoded addresses."),
+    "aggregate": ("h3_cube", "main", "Aggregate geocoded sales into the H3 price cube."),
+    "spatial": ("spatial_index", "cli", "Radius and nearest-neighbour queries over geocoded sales."),
+    "pipeline": ("run_pipeline", "main", "Run filter, geocode and H3 on shards in a process pool."),
+    "run": ("etl_run", "run", "Chain stages over one in-memory LazyFrame."),
+}
+
+
+class LazyGroup(click.Group):
+    """Group whose commands are imported from COMMANDS when they are first used."""
+
+    def list_commands(self, ctx):
+        return list(COMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+        module, attribute, _ = COMMANDS[name]
+        return getattr(importlib.import_module(module), attribute)
+
+    def format_commands(self, ctx, formatter):
+        # The summaries are static, so --help imports none of the commands
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, summary) for name, (_, _, summary) in COMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+def cli():
+    """Sydney property data ETL: filter, geocode, index and aggregate the NSW sales."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,149 @@
+"""
+Chained ETL stages over one in-memory LazyFrame, run as etl.py run STAGE [ARGS]...
+
+    python etl.py run --input nsw_property_data.csv \\
+        filter councils councils.csv \\
+        geocode --nominatim-url http://localhost:8080 geocoded.parquet \\
+        h3 --resolutions 8,9 aggregate cube.parquet write sales.parquet
+
+Each stage takes the rows of the stage before it as a LazyFrame and hands on
+another, so there are no intermediate files between stages. The geocode and
+aggregate stages collect the rows into memory once, together with any pending
+councils or write outputs, so the input is parsed a single time and later stages
+work on the collected rows. The geocode stage still writes its (address, lat, lon)
+output, which is its checkpoint and what --resume and --delta work from, reads it
+back once and joins the coordinates onto the rows. Outputs still pending run
+together at the end. Stages take the options of the commands they come from, which go
+before a stage's arguments: parsing moves on to the next stage after them.
+"""
+
+import logging
+import os
+
+import click
+import polars as pl
+
+import add_h3_col
+import batch_geocode_local
+import h3_cube
+from h3_index import add_h3_columns, parse_resolutions
+from pipeline_io import FORMATS, GEOCODED_SCHEMA, read, run_sinks, sink
+from property_data import DEFAULT_INPUT, filter_councils, join_coordinates, load_councils, scan_property_data, unique_councils
+
+logger = logging.getLogger(__name__)
+
+
+def stage_params(command, *skip):
+    """Parameters of a command, except the named ones, to reuse for a stage."""
+    return [param for param in command.params if param.name not in skip]
+
+
+def materialize(lf, sinks):
+    """Collect the rows so far into memory, running the pending sinks in the same pass, and clear them."""
+    rows = pl.collect_all([lf, *sinks], engine="streaming")[0]
+    sinks.clear()
+    return rows
+
+
+def checked_resolutions(resolutions):
+    try:
+        return parse_resolutions(resolutions)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--resolutions')
+
+
+@click.group(chain=True)
+@click.option('--input', 'input_file', default=DEFAULT_INPUT, type=click.Path(dir_okay=False), help='Raw Kaggle NSW property data (CSV, Parquet or Arrow IPC)')
+@click.option('--input-separator', default=',', help='Input file separator')
+def run(input_file, input_separator):
+    """Chain stages over the property data without intermediate files."""
+
+
+@run.result_callback()
+def run_stages(stages, input_file, input_separator):
+    # Checked here rather than by click, so every stage's --help works without the input
+    if not os.path.exists(input_file):
+        raise click.BadParameter(f"Path '{input_file}' does not exist.", param_hint='--input')
+    # Each stage returns a function from the rows so far, and the pending sinks, to its rows
+    lf = scan_property_data(input_file, input_separator)
+    sinks = []
+    for stage in stages:
+        lf = stage(lf, sinks)
+    if sinks:
+        run_sinks(sinks)
+
+
+@run.command("filter")
+@click.option('--councils', help='Comma-separated council names to keep (default: Greater Sydney councils)')
+@click.option('--councils-file', type=click.Path(exists=True), help='File with one council name per line to keep')
+def filter_stage(councils, councils_file):
+    """Keep the sales in a set of councils."""
+    council_list = load_councils(councils, councils_file)
+    return lambda lf, sinks: filter_councils(lf, council_list)
+
+
+@run.command("councils")
+@click.argument('output_file', type=click.Path())
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+def councils_stage(output_file, fmt):
+    """Also save the unique council names of the rows so far."""
+    def apply(lf, sinks):
+        sinks.append(sink(unique_councils(lf), output_file, fmt=fmt, separator=",", lazy=True))
+        return lf
+    return apply
+
+
+@run.command("geocode")
+def geocode_stage(**options):
+    """Geocode the rows and join on their coordinates.
+
+    OUTPUT_FILE gets the (address, lat, lon) table, as for the geocode command.
+    """
+    def apply(lf, sinks):
+        rows = materialize(lf, sinks).lazy()
+        ctx = click.get_current_context()
+        ctx.invoke(batch_geocode_local.main, input_file=rows, limit=None, rows_output=None, rows_format=None, **options)
+        geocoded = read(options["output_file"], GEOCODED_SCHEMA, options["output_format"], options["separator"], ["address", "lat", "lon"])
+        return join_coordinates(rows, geocoded.lazy(), options["address_column"], options["postcode_column"]).collect().lazy()
+    return apply
+
+
+geocode_stage.params.extend(stage_params(batch_geocode_local.main, "input_file", "limit", "rows_output", "rows_format"))
+
+
+@run.command("h3")
+def h3_stage(resolutions, hex_strings):
+    """Add H3 cell IDs at several resolutions to the geocoded rows."""
+    resolutions = checked_resolutions(resolutions)
+    return lambda lf, sinks: add_h3_columns(lf, resolutions, hex_strings=hex_strings)
+
+
+h3_stage.params.extend(stage_params(add_h3_col.main, "input_file", "output_file", "fmt", "separator"))
+
+
+@run.command("aggregate")
+def aggregate_stage(cube_file, resolutions, period, window, date_column, price_column, update):
+    """Aggregate the geocoded rows into the H3 price cube CUBE_FILE."""
+    resolutions = checked_resolutions(resolutions)
+
+    def apply(lf, sinks):
+        rows = materialize(lf, sinks).lazy()
+        h3_cube.update_cube(rows, cube_file, resolutions, period, window, date_column, price_column, update)
+        return rows
+    return apply
+
+
+aggregate_stage.params.extend(stage_params(h3_cube.main, "sales_file", "separator"))
+
+
+@run.command("write")
+@click.argument('output_file', type=click.Path())
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+@click.option('--separator', default='\t', help='Separator for CSV output')
+def write_stage(output_file, fmt, separator):
+    """Save the rows so far."""
+    def apply(lf, sinks):
+        sinks.append(sink(lf, output_file, fmt=fmt, separator=separator, lazy=True))
+        logger.info(f"Saving rows to {output_file}")
+        return lf
+    return apply
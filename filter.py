@@ -2,50 +2,33 @@
 Filter the data to only include properties in Sydney
 """
 
-import polars as pl
+import click
 
-df = pl.read_csv("large-files/nsw_property_data.csv")
-sydney_councils = [
-    "BAYSIDE",
-    "BLACKTOWN",
-    "BLUE MOUNTAINS",
-    "BURWOOD",
-    "CAMDEN",
-    "CAMPBELLTOWN",
-    "CANADA BAY",
-    "CANTERBURY-BANKSTOWN",
-    "CITY OF PARRAMATTA",
-    "CITY OF SYDNEY",
-    "CUMBERLAND",
-    "FAIRFIELD",
-    "GEORGES RIVER",
-    "HAWKESBURY",
-    "HORNSBY",
-    "HUNTERS HILL",
-    "INNER WEST",
-    "KU-RING-GAI",
-    "LANE COVE",
-    "LIVERPOOL",
-    "MOSMAN",
-    "NORTH SYDNEY",
-    "NORTHERN BEACHES",
-    "PENRITH",
-    "RANDWICK",
-    "RYDE",
-    "STRATHFIELD",
-    "SUTHERLAND",
-    "THE HILLS SHIRE",
-    "UNINCORPORATED SYDNEY HARBOUR",
-    "WAVERLEY",
-    "WILLOUGHBY",
-    "WOLLONDILLY",
-    "WOOLLAHRA"
-]
+from pipeline_io import FORMATS, PROPERTY_SCHEMA, run_sinks, sink
+from property_data import DEFAULT_INPUT, filter_councils, load_councils, scan_property_data, unique_councils
 
-# suburb name is stored in column council_name
-df = df.filter(pl.col("council_name").is_in(sydney_councils))
-print(df.head())
+@click.command()
+@click.option('--input', 'input_file', default=DEFAULT_INPUT, type=click.Path(exists=True), help='Raw Kaggle NSW property data (CSV, Parquet or Arrow IPC)')
+@click.option('--input-separator', default=',', help='Input file separator')
+@click.option('--output', 'output_file', default='sydney_property_data.csv', help='Where to save the filtered data')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+@click.option('--separator', default='\t', help='Separator for CSV output')
+@click.option('--councils', help='Comma-separated council names to keep (default: Greater Sydney councils)')
+@click.option('--councils-file', type=click.Path(exists=True), help='File with one council name per line to keep')
+@click.option('--councils-output', help='Also save the unique council names of the whole input here, in the same pass')
+def main(input_file, input_separator, output_file, fmt, separator, councils, councils_file, councils_output):
+    """Filter the NSW property dump to a set of councils with a single streaming pass."""
+    council_list = load_councils(councils, councils_file)
+    lf = scan_property_data(input_file, input_separator)
 
-# save the filtered data
-df.write_csv("sydney_property_data.csv", separator="\t")
+    sinks = [sink(filter_councils(lf, council_list), output_file, PROPERTY_SCHEMA, fmt, separator, lazy=True)]
+    if councils_output:
+        sinks.append(sink(unique_councils(lf), councils_output, separator=",", lazy=True))
+    run_sinks(sinks)
 
+    print(f"Saved sales in {len(council_list)} councils to {output_file}")
+    if councils_output:
+        print(f"Saved unique council names to {councils_output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Local gazetteer of previously geocoded addresses.
+
+Many geocoding keys name the same place: "154 BELLEVUE ROAD, BELLEVUE HILL 2023",
+"154  BELLEVUE RD, BELLEVUE HILL 2023" and "154 BELLEVUE RD,BELLEVUE HILL 02023" are
+separate cache entries, so each costs a Nominatim request. The gazetteer parses keys
+into a canonical (number, street, suburb, postcode) with abbreviated street types and
+indexes the coordinates of every address geocoded so far. The geocode command checks
+it in memory before any HTTP call.
+
+Optionally, house numbers missing from the gazetteer are interpolated between the
+nearest known numbers on the same side of the same street.
+"""
+
+import logging
+import os
+import time
+
+import click
+import polars as pl
+
+from geocode_cache import SQLiteCache
+from pipeline_io import GEOCODED_SCHEMA, read
+
+logger = logging.getLogger(__name__)
+
+# Spellings of street types mapped to the abbreviation used in the NSW sales data
+STREET_TYPES = {
+    "STREET": "ST", "STR": "ST",
+    "ROAD": "RD",
+    "AVENUE": "AVE", "AV": "AVE", "AVN": "AVE",
+    "PARADE": "PDE",
+    "HIGHWAY": "HWY",
+    "CRESCENT": "CRES", "CR": "CRES", "CRS": "CRES",
+    "PLACE": "PL",
+    "LN": "LANE",
+    "DRIVE": "DR", "DRV": "DR",
+    "CIRCUIT": "CCT",
+    "COURT": "CT",
+    "CLOSE": "CL",
+    "TERRACE": "TCE",
+    "BOULEVARD": "BVD", "BLVD": "BVD", "BOULEVARDE": "BVDE",
+    "ESPLANADE": "ESP",
+    "GROVE": "GR",
+    "SQUARE": "SQ",
+    "PARKWAY": "PWY",
+    "CIRCLE": "CIR",
+    "RIDGE": "RDG",
+    "GARDENS": "GDNS",
+    "MOTORWAY": "MWY",
+    "PROMENADE": "PROM",
+}
+
+# "<number> <street>[, <suburb>] <postcode>", the shape of keys from address_key_expr.
+# Numbers may carry a letter suffix or be a range such as 12-14; postcodes may be zero-padded.
+KEY_PATTERN = r"^\s*(\d+[A-Z]?(?:\s*-\s*\d+[A-Z]?)?)\s+([^,]*?)\s*(?:,\s*(.*?))?\s+0*(\d{3,4})\s*$"
+
+CANONICAL_KEY = ["number", "street", "suburb", "postcode"]
+
+
+def collapse_spaces(expr):
+    return expr.str.replace_all(r"\s+", " ").str.strip_chars()
+
+
+def parse_keys(keys):
+    """Parse a Series of geocoding keys into canonical columns, plus the numeric house number.
+
+    Keys that do not look like "<number> <street>, <suburb> <postcode>" (lots, shop
+    numbers, missing postcodes) get null columns and never match.
+    """
+    # Postcodes read as floats end in ".0"; other dots are abbreviation marks
+    key = pl.col("key").str.to_uppercase().str.replace(r"\.0\s*$", "").str.replace_all(r"\.", "")
+    parts = key.str.extract_groups(KEY_PATTERN)
+    street = collapse_spaces(parts.struct.field("2"))
+    street_type = street.str.extract(r"(\S+)$")
+    canonical_street = pl.concat_str(
+        [street.str.replace(r"\s*\S+$", ""), street_type.replace(STREET_TYPES)], separator=" "
+    ).str.strip_chars()
+    number = parts.struct.field("1").str.replace_all(r"\s", "")
+    return pl.DataFrame({"key": keys}).select(
+        "key",
+        number.alias("number"),
+        canonical_street.alias("street"),
+        collapse_spaces(parts.struct.field("3")).fill_null("").alias("suburb"),
+        parts.struct.field("4").cast(pl.Int32).alias("postcode"),
+        number.cast(pl.Int32, strict=False).alias("house"),
+    )
+
+
+class Gazetteer:
+    """Coordinates of known addresses keyed by canonical number, street, suburb and postcode."""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    @classmethod
+    def from_coordinates(cls, coordinates):
+        """Build from an (address, lat, lon) DataFrame of geocoded keys.
+
+        Variants of one canonical address keep the coordinates of the first key in
+        sorted order, so rebuilding gives the same gazetteer.
+        """
+        coordinates = coordinates.filter(pl.col("lat").is_not_null() & pl.col("lon").is_not_null()).sort("address")
+        parsed = parse_keys(coordinates["address"]).drop("key").with_columns(coordinates.select("lat", "lon"))
+        entries = parsed.drop_nulls(["number", "street", "postcode"]).unique(CANONICAL_KEY, keep="first", maintain_order=True)
+        return cls(entries.sort("postcode", "street", "suburb", "number"))
+
+    @classmethod
+    def from_sources(cls, geocoded_files=(), cache_path=None, separator="\t"):
+        """Build from geocoded output files and the successful entries of a SQLite cache."""
+        frames = [read(path, GEOCODED_SCHEMA, separator=separator, columns=["address", "lat", "lon"]) for path in geocoded_files]
+        if cache_path:
+            frames.append(pl.DataFrame(SQLiteCache(cache_path).coordinates(), schema=GEOCODED_SCHEMA, orient="row"))
+        return cls.from_coordinates(pl.concat(frames) if frames else pl.DataFrame(schema=GEOCODED_SCHEMA))
+
+    @classmethod
+    def load(cls, path):
+        return cls(pl.read_parquet(path))
+
+    def save(self, path):
+        self.entries.write_parquet(path, compression="zstd")
+
+    def __len__(self):
+        return self.entries.height
+
+    def resolve(self, addresses, interpolate=False, max_gap=20):
+        """Look up a list or Series of geocoding keys; returns (address, lat, lon, match) for those resolved.
+
+        match is "exact" for a known canonical address. With interpolate, a house
+        number between two known numbers on the same side of the same street, at most
+        max_gap apart, is placed proportionally between them ("interpolated").
+        """
+        schema = {"address": pl.Utf8, "lat": pl.Float64, "lon": pl.Float64, "match": pl.Utf8}
+        addresses = pl.Series(addresses, dtype=pl.Utf8)
+        if addresses.is_empty() or not len(self):
+            return pl.DataFrame(schema=schema)
+        queries = parse_keys(addresses).rename({"key": "address"})
+        exact = queries.join(self.entries.drop("house"), on=CANONICAL_KEY).select(
+            "address", "lat", "lon", pl.lit("exact").alias("match")
+        )
+        found = [exact]
+        if interpolate:
+            street = ["street", "suburb", "postcode", "side"]
+            # Both sides are sorted by house number, as join_asof needs within each street
+            known = self.entries.drop_nulls("house").with_columns(side=pl.col("house") % 2).sort("house")
+            missing = (
+                queries.join(exact, on="address", how="anti").drop_nulls("house")
+                .with_columns(side=pl.col("house") % 2).sort("house")
+            )
+            below = known.select(*street, pl.col("house").alias("low"), pl.col("lat").alias("low_lat"), pl.col("lon").alias("low_lon"))
+            above = known.select(*street, pl.col("house").alias("high"), pl.col("lat").alias("high_lat"), pl.col("lon").alias("high_lon"))
+            share = (pl.col("house") - pl.col("low")) / (pl.col("high") - pl.col("low"))
+            interpolated = (
+                missing.join_asof(below, left_on="house", right_on="low", by=street, strategy="backward", check_sortedness=False)
+                .join_asof(above, left_on="house", right_on="high", by=street, strategy="forward", check_sortedness=False)
+                .filter(pl.col("low").is_not_null() & pl.col("high").is_not_null()
+                        & (pl.col("high") > pl.col("low")) & (pl.col("high") - pl.col("low") <= max_gap))
+                .select(
+                    "address",
+                    (pl.col("low_lat") + share * (pl.col("high_lat") - pl.col("low_lat"))).alias("lat"),
+                    (pl.col("low_lon") + share * (pl.col("high_lon") - pl.col("low_lon"))).alias("lon"),
+                    pl.lit("interpolated").alias("match"),
+                )
+            )
+            found.append(interpolated)
+        return pl.concat(found)
+
+
+@click.group()
+def cli():
+    """Local gazetteer of geocoded addresses, checked by the geocode command before Nominatim."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+@cli.command("build")
+@click.argument('gazetteer_file', type=click.Path())
+@click.option('--geocoded', 'geocoded_files', multiple=True, type=click.Path(exists=True), help='Geocoded output of batch_geocode_local.py; repeat for several')
+@click.option('--cache-path', default='geocode_cache.sqlite', help='SQLite geocode cache to include (empty string skips it)')
+@click.option('--separator', default='\t', help='Separator for CSV input')
+def build(gazetteer_file, geocoded_files, cache_path, separator):
+    """Build a gazetteer from geocoded files and the local SQLite cache."""
+    start = time.time()
+    if cache_path and not os.path.exists(cache_path):
+        logger.warning(f"No SQLite cache at {cache_path}, skipping it")
+        cache_path = None
+    gazetteer = Gazetteer.from_sources(geocoded_files, cache_path, separator)
+    gazetteer.save(gazetteer_file)
+    logger.info(f"Saved {len(gazetteer)} canonical addresses to {gazetteer_file} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,232 @@
+"""
+Tiered cache for geocoding results.
+
+Lookups go through an in-process LRU, then a local SQLite file, then an optional
+shared Redis tier. Hits found in a lower tier are copied into the tiers above it.
+Every tier maps an address string to either a (lat, lon) tuple or a CachedFailure
+recording that Nominatim could not resolve the address.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# HyperLogLog of every address ever cached; kept outside the geocode:* keyspace
+CACHE_CENSUS_KEY = "geocode-meta:addresses"
+CACHE_HITS_KEY = "geocode-meta:hits"
+CACHE_MISSES_KEY = "geocode-meta:misses"
+
+# Cache states for addresses that did not geocode
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+# A negative result and when it happened (epoch seconds); callers decide when it is worth a retry
+CachedFailure = namedtuple("CachedFailure", ["status", "failed_at"])
+
+
+def encode_entry(value):
+    """Serialize a cache value: [lat, lon] or [lat, lon, tier] for hits, an object for failures."""
+    if isinstance(value, CachedFailure):
+        return json.dumps({"status": value.status, "failed_at": value.failed_at})
+    return json.dumps(list(value))
+
+
+def decode_entry(raw):
+    """Inverse of encode_entry."""
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        return CachedFailure(data["status"], data["failed_at"])
+    return tuple(data)
+
+
+class LRUCache:
+    """Bounded in-memory cache that evicts the least recently used addresses."""
+
+    name = "memory"
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, addresses):
+        hits = {}
+        with self.lock:
+            for address in addresses:
+                value = self.entries.get(address)
+                if value is not None:
+                    self.entries.move_to_end(address)
+                    hits[address] = value
+        return hits
+
+    def set_many(self, items, cache_expiry):
+        # Entries live for the lifetime of the process, so expiry is ignored here
+        with self.lock:
+            for address, value in items:
+                self.entries[address] = value
+                self.entries.move_to_end(address)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """Persistent cache in a local SQLite file, opened in WAL mode."""
+
+    name = "sqlite"
+
+    # Stay well below SQLite's limit on host parameters per statement
+    MAX_QUERY_PARAMS = 900
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "address TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def get_many(self, addresses):
+        hits = {}
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(addresses), self.MAX_QUERY_PARAMS):
+                batch = addresses[start:start + self.MAX_QUERY_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT address, value FROM geocode WHERE address IN ({placeholders}) AND expires_at > ?",
+                    (*batch, now),
+                )
+                for address, value in rows:
+                    hits[address] = decode_entry(value)
+        return hits
+
+    def set_many(self, items, cache_expiry):
+        expires_at = time.time() + cache_expiry
+        rows = [(address, encode_entry(value), expires_at) for address, value in items]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)", rows)
+            self.conn.execute("COMMIT")
+
+    def purge_expired(self):
+        """Delete expired rows and return how many were removed."""
+        with self.lock:
+            return self.conn.execute("DELETE FROM geocode WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def coordinates(self):
+        """Return (address, lat, lon) of every unexpired entry that geocoded, skipping failures."""
+        with self.lock:
+            rows = self.conn.execute("SELECT address, value FROM geocode WHERE expires_at > ?", (time.time(),)).fetchall()
+        hits = []
+        for address, value in rows:
+            entry = decode_entry(value)
+            if not isinstance(entry, CachedFailure):
+                hits.append((address, *entry[:2]))
+        return hits
+
+
+class RedisCache:
+    """Shared cache tier stored under geocode:* keys in Redis."""
+
+    name = "redis"
+
+    def __init__(self, redis_client, batch_size=10000):
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+
+    def get_many(self, addresses):
+        hits = {}
+        for start in range(0, len(addresses), self.batch_size):
+            batch = addresses[start:start + self.batch_size]
+            values = self.redis_client.mget([f"geocode:{address}" for address in batch])
+            for address, cached_data in zip(batch, values):
+                if cached_data:
+                    hits[address] = decode_entry(cached_data)
+        # Keep running hit/miss totals for cache-stats
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.incrby(CACHE_HITS_KEY, len(hits))
+        pipe.incrby(CACHE_MISSES_KEY, len(addresses) - len(hits))
+        pipe.execute()
+        return hits
+
+    def set_many(self, items, cache_expiry):
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for address, value in batch:
+                pipe.setex(f"geocode:{address}", cache_expiry, encode_entry(value))
+            pipe.pfadd(CACHE_CENSUS_KEY, *(address for address, _ in batch))
+            pipe.execute()
+
+
+class TieredCache:
+    """Read-through cache over an ordered list of tiers, fastest first.
+
+    Hits promoted from a lower tier are written to the tiers above it with
+    promote_expiry, since the original TTL is not known.
+    """
+
+    def __init__(self, tiers, promote_expiry=60*60*24*30):
+        self.tiers = tiers
+        self.promote_expiry = promote_expiry
+
+    def get_many(self, addresses):
+        hits = {}
+        remaining = list(addresses)
+        # Tiers above the one that answered, so hits can be promoted into them
+        missed_tiers = []
+        for tier in self.tiers:
+            if not remaining:
+                break
+            with metrics.timer(f"cache_lookup.{tier.name}"):
+                tier_hits = tier.get_many(remaining)
+            if tier_hits:
+                logger.debug(f"{tier.name} cache answered {len(tier_hits)} of {len(remaining)} lookups")
+                promoted = list(tier_hits.items())
+                for upper in missed_tiers:
+                    upper.set_many(promoted, self.promote_expiry)
+                hits.update(tier_hits)
+                remaining = [address for address in remaining if address not in tier_hits]
+            missed_tiers.append(tier)
+        return hits
+
+    def set_many(self, items, cache_expiry):
+        """Write (address, value) pairs to every tier."""
+        if not items:
+            return
+        for tier in self.tiers:
+            with metrics.timer(f"cache_write.{tier.name}"):
+                tier.set_many(items, cache_expiry)
+
+    def describe(self):
+        return " -> ".join(tier.name for tier in self.tiers)
+
+
+def build_cache(lru_size=100000, cache_path="geocode_cache.sqlite", redis_client=None, redis_batch_size=10000, cache_expiry=60*60*24*30):
+    """Assemble the tiered cache from the enabled tiers.
+
+    A zero lru_size, an empty cache_path or a missing redis_client disables that tier.
+    """
+    tiers = []
+    if lru_size:
+        tiers.append(LRUCache(lru_size))
+    if cache_path:
+        tiers.append(SQLiteCache(cache_path))
+    if redis_client is not None:
+        tiers.append(RedisCache(redis_client, redis_batch_size))
+    return TieredCache(tiers, cache_expiry)
@@ -0,0 +1,231 @@
+"""
+Materialized cube of property sale statistics per H3 cell and month or quarter.
+
+For every requested resolution, cell and period the cube holds the sale count, mean
+price, price percentiles, a rolling median over the trailing window and a price index
+(that rolling median relative to the cell's first period, as 100). Dashboards and maps
+read these small rows instead of re-aggregating millions of sales.
+
+Percentiles do not add up across cells or releases, so the cube is derived from a
+price histogram kept next to it in "<cube>.histogram.parquet": sale counts per
+finest-resolution cell, period and logarithmic price bucket. Bucket counts do add up,
+which makes parent roll-ups, rolling windows and incremental updates exact merges of
+the histogram; only the percentiles are approximate, within half a bucket (0.5%).
+"""
+
+import logging
+import math
+import os
+import time
+
+import click
+import polars as pl
+
+from h3_index import cell_to_parent_expr, h3_column, latlng_to_cell_expr, parse_resolutions
+from pipeline_io import scan
+
+logger = logging.getLogger(__name__)
+
+# Period column name -> polars truncation interval and its length in months
+PERIODS = {"month": ("1mo", 1), "quarter": ("1q", 3)}
+
+# Each price bucket spans 1%, so a bucket's midpoint is within 0.5% of its prices
+PRICE_BUCKET_RATIO = 1.01
+
+QUANTILES = {"p10_price": 0.1, "p25_price": 0.25, "median_price": 0.5, "p75_price": 0.75, "p90_price": 0.9}
+
+
+def histogram_path(cube_path):
+    """Path of the price histogram a cube is derived from."""
+    return f"{cube_path}.histogram.parquet"
+
+
+def price_bucket_expr(price):
+    return (pl.col(price).cast(pl.Float64).log() / math.log(PRICE_BUCKET_RATIO)).floor().cast(pl.UInt16)
+
+
+def bucket_price_expr(bucket):
+    """Midpoint price of a bucket."""
+    return ((pl.col(bucket).cast(pl.Float64) + 0.5) * math.log(PRICE_BUCKET_RATIO)).exp()
+
+
+def date_expr(column):
+    """Sale date as a Date, parsing the ISO strings of the raw data."""
+    return pl.col(column).cast(pl.Utf8).str.to_date(strict=False)
+
+
+def sales_histogram(lf, resolution, period, date_column="contract_date", price_column="purchase_price"):
+    """Aggregate sales into (cell, period, bucket, sales, price_sum) at one resolution.
+
+    Uses the h3_r<resolution> column when present, otherwise indexes lat and lon.
+    Sales without a cell, a date or a positive price are left out.
+    """
+    cell = h3_column(resolution)
+    if cell not in lf.collect_schema().names():
+        lf = lf.with_columns(latlng_to_cell_expr(resolution).alias(cell))
+    every, _ = PERIODS[period]
+    return (
+        lf.select(
+            pl.col(cell).alias("cell"),
+            date_expr(date_column).dt.truncate(every).alias(period),
+            pl.col(price_column).cast(pl.Float64).alias("price"),
+        )
+        .filter(pl.col("cell").is_not_null() & pl.col(period).is_not_null() & (pl.col("price") > 0))
+        .group_by("cell", period, price_bucket_expr("price").alias("bucket"))
+        .agg(sales=pl.len().cast(pl.UInt32), price_sum=pl.col("price").sum())
+    )
+
+
+def merge_histograms(*histograms):
+    """Add up histograms with the same resolution and period."""
+    period = histogram_period(histograms[0])
+    return (
+        pl.concat([h.lazy() for h in histograms])
+        .group_by("cell", period, "bucket")
+        .agg(pl.col("sales").sum(), pl.col("price_sum").sum())
+    )
+
+
+def histogram_period(hist):
+    """Name of the period column of a histogram or cube: "month" or "quarter"."""
+    names = hist.collect_schema().names()
+    return next(period for period in PERIODS if period in names)
+
+
+def histogram_quantiles(hist, keys, quantiles):
+    """Nearest-rank quantiles of each group of a (keys..., bucket, sales) histogram, as bucket midpoints.
+
+    A bucket may appear more than once in a group. Running totals within groups come
+    from one sort and a global cumulative sum, which is much faster than window
+    expressions over millions of small groups.
+    """
+    hist = hist.sort(*keys, "bucket").with_columns(group=pl.struct(keys).rle_id())
+    first = pl.col("group") != pl.col("group").shift(1, fill_value=-1)
+    last = pl.col("group") != pl.col("group").shift(-1, fill_value=-1)
+    running = pl.col("sales").cum_sum()
+    hist = hist.with_columns(cumulative=running - pl.when(first).then(running - pl.col("sales")).forward_fill())
+    hist = hist.with_columns(total=pl.when(last).then(pl.col("cumulative")).backward_fill())
+    # Exactly one row per group crosses each rank
+    return hist.group_by(keys).agg(
+        bucket_price_expr("bucket")
+        .filter((pl.col("cumulative") >= q * pl.col("total")) & (pl.col("cumulative") - pl.col("sales") < q * pl.col("total")))
+        .max().alias(name)
+        for name, q in quantiles.items()
+    )
+
+
+def rolling_histogram(hist, period, window):
+    """Histogram of each period merged with the window - 1 periods before it.
+
+    Buckets are not added up, so one can appear up to window times per group.
+    """
+    _, months = PERIODS[period]
+    return pl.concat([hist.select("cell", pl.col(period).dt.offset_by(f"{i * months}mo"), "bucket", "sales") for i in range(window)])
+
+
+def build_cube(hist, resolutions, window):
+    """Derive the cube rows of every resolution from a finest-resolution histogram.
+
+    Each coarser resolution merges the buckets of the one below it, with parents
+    computed by bit operations on the cell.
+    """
+    period = histogram_period(hist)
+    keys = ["cell", period]
+    parts = []
+    for res in sorted(resolutions, reverse=True):
+        if res != max(resolutions):
+            hist = (
+                hist.lazy().with_columns(cell=cell_to_parent_expr("cell", res))
+                .group_by("cell", period, "bucket")
+                .agg(pl.col("sales").sum(), pl.col("price_sum").sum())
+                .collect()
+            )
+        totals = hist.lazy().group_by(keys).agg(pl.col("sales").sum(), pl.col("price_sum").sum())
+        rolling = histogram_quantiles(rolling_histogram(hist.lazy(), period, window), keys, {"rolling_median_price": 0.5})
+        parts.append(
+            totals.join(histogram_quantiles(hist.lazy(), keys, QUANTILES), on=keys)
+            .join(rolling, on=keys, how="left")
+            .select(
+                pl.lit(res, dtype=pl.Int8).alias("resolution"), *keys, "sales",
+                (pl.col("price_sum") / pl.col("sales")).alias("mean_price"), *QUANTILES, "rolling_median_price",
+            )
+            .collect()
+        )
+    return (
+        pl.concat(parts)
+        .sort("resolution", "cell", period)
+        .with_columns(
+            price_index=100 * pl.col("rolling_median_price") / pl.col("rolling_median_price").first().over("resolution", "cell")
+        )
+    )
+
+
+def write_atomic(df, path):
+    df.write_parquet(f"{path}.tmp", compression="zstd")
+    os.replace(f"{path}.tmp", path)
+
+
+def scan_sales(path, separator):
+    """Scan sales from a file or from a hive-partitioned dataset written by run_pipeline.py."""
+    if os.path.isdir(path):
+        return pl.scan_parquet(path, hive_partitioning=True)
+    return scan(path, separator=separator)
+
+
+def update_cube(sales, cube_file, resolutions, period="quarter", window=None, date_column="contract_date", price_column="purchase_price", update=False):
+    """Build the cube of a LazyFrame of sales and save it and its histogram, or add the sales to the saved cube with update."""
+    start = time.time()
+    hist_file = histogram_path(cube_file)
+    old_hist = None
+    if update and os.path.exists(cube_file) and os.path.exists(hist_file):
+        # The existing cube decides the period and resolutions, so the histograms line up
+        old_hist = pl.read_parquet(hist_file)
+        period = histogram_period(old_hist)
+        resolutions = pl.read_parquet(cube_file, columns=["resolution"])["resolution"].unique().sort().to_list()
+        logger.info(f"Updating cube {cube_file} ({period}, resolutions {resolutions}) with {old_hist['sales'].sum()} sales")
+    elif update:
+        logger.info(f"No cube at {cube_file} yet, building a new one")
+    window = window or 12 // PERIODS[period][1]
+
+    hist = sales_histogram(sales, max(resolutions), period, date_column, price_column)
+    if old_hist is not None:
+        hist = merge_histograms(old_hist, hist)
+    hist = hist.sort("cell", period, "bucket").collect()
+    logger.info(f"Histogram: {hist['sales'].sum()} sales in {hist.height} (cell, {period}, price bucket) rows")
+
+    cube = build_cube(hist, resolutions, window)
+    write_atomic(hist, hist_file)
+    write_atomic(cube, cube_file)
+    for res, rows in cube.group_by("resolution").len().sort("resolution").iter_rows():
+        logger.info(f"  resolution {res}: {rows} (cell, {period}) rows")
+    logger.info(f"Saved cube of {cube.height} rows to {cube_file} in {time.time() - start:.1f}s")
+    return cube
+
+
+@click.command()
+@click.argument('sales_file', type=click.Path(exists=True))
+@click.argument('cube_file', type=click.Path())
+@click.option('--resolutions', default='7,8,9,10', help='Comma-separated H3 resolutions to aggregate at')
+@click.option('--period', type=click.Choice(list(PERIODS)), default='quarter', help='Time bucket of the cube')
+@click.option('--window', type=click.IntRange(1), help='Periods in the rolling median behind the price index (default: a year)')
+@click.option('--date-column', default='contract_date', help='Sale date column')
+@click.option('--price-column', default='purchase_price', help='Sale price column')
+@click.option('--separator', default='\t', help='Separator for CSV input')
+@click.option('--update', is_flag=True, help='Add SALES_FILE to the existing cube instead of replacing it; only pass sales not added before')
+def main(sales_file, cube_file, resolutions, period, window, date_column, price_column, separator, update):
+    """Aggregate geocoded sales into a cube of price statistics per H3 cell and period.
+
+    SALES_FILE needs lat and lon or h3_r<N> columns, such as the output of
+    batch_geocode_local.py join-rows or a run_pipeline.py dataset directory.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        resolutions = parse_resolutions(resolutions)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--resolutions')
+    logger.info(f"Aggregating sales from {sales_file}...")
+    update_cube(scan_sales(sales_file, separator), cube_file, resolutions, period, window, date_column, price_column, update)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Counters, latency histograms and stage timers for geocoding runs.
+
+Instrumented code records into the module-level REGISTRY through inc(), observe()
+and timer(), the way it logs through a module-level logger. Sinks export the registry:
+a Prometheus text file rewritten as the run goes, a Prometheus /metrics HTTP endpoint,
+or a JSON summary at exit. profile() wraps a run in cProfile or in a sampling profiler
+that sees every thread.
+"""
+
+import bisect
+import cProfile
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, from fast cache hits to slow HTTP timeouts
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style, plus sum, count and extremes."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One extra bucket for values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation within its bucket, kept within the observed range."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(self.buckets[i - 1] if i > 0 else 0.0, self.min)
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class Registry:
+    """Thread-safe store of counters and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block into the stage_seconds histogram, labelled with the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def summary(self):
+        """Return counters and histogram summaries as a JSON-serializable dict."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                          for key, h in self.histograms.items()}
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(counters.items())],
+            "histograms": [
+                {"name": name, "labels": dict(labels), "count": count, "sum": total,
+                 "mean": total / count if count else 0.0, "p50": p50, "p95": p95, "p99": p99}
+                for (name, labels), (count, total, p50, p95, p99) in sorted(histograms.items())
+            ],
+        }
+
+    def stage_totals(self):
+        """Return total seconds spent in each timed stage."""
+        with self.lock:
+            return {dict(labels)["stage"]: h.sum for (name, labels), h in self.histograms.items() if name == "stage_seconds"}
+
+    def render_prometheus(self, prefix="geocode_"):
+        """Render the registry in the Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.count, h.sum, h.buckets)) for key, h in self.histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{prefix}{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+        for (name, labels), (counts, count, total, buckets) in histograms:
+            metric = f"{prefix}{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip([*buckets, math.inf], counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Format (name, value) pairs as a Prometheus label set."""
+    if not labels:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# Default registry used by the module-level helpers
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+class MetricsSink:
+    """Base class for metrics exports; update() is called periodically during a run, close() at exit."""
+
+    def update(self, registry):
+        pass
+
+    def close(self, registry):
+        pass
+
+
+class PrometheusFileSink(MetricsSink):
+    """Rewrites a Prometheus text file, e.g. for node_exporter's textfile collector."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def update(self, registry):
+        # Write then rename, so scrapers never read a half-written file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(registry.render_prometheus())
+        os.replace(tmp_path, self.path)
+
+    def close(self, registry):
+        self.update(registry)
+
+
+class PrometheusHTTPSink(MetricsSink):
+    """Serves the registry at /metrics on a background thread for Prometheus to scrape."""
+
+    def __init__(self, registry, port, host="0.0.0.0"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics at http://{host}:{self.port}/metrics")
+
+    def close(self, registry):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JSONSummarySink(MetricsSink):
+    """Writes a JSON summary of the registry at the end of the run."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self, registry):
+        with open(self.path, "w") as f:
+            json.dump(registry.summary(), f, indent=2)
+        logger.info(f"Saved metrics summary to {self.path}")
+
+
+def log_stage_summary(registry=REGISTRY):
+    """Log count, total time and latency percentiles of every timed stage."""
+    stages = [h for h in registry.summary()["histograms"] if h["name"] == "stage_seconds"]
+    if not stages:
+        return
+    logger.info("Stage timings:")
+    for h in sorted(stages, key=lambda h: -h["sum"]):
+        logger.info(
+            f"  {h['labels']['stage']:<20} {h['count']:>9} calls  {h['sum']:>9.2f}s total  "
+            f"mean {h['mean']*1000:.2f}ms p50 {h['p50']*1000:.2f}ms p99 {h['p99']*1000:.2f}ms"
+        )
+
+
+class StackSampler:
+    """Sampling profiler: records the stack of every thread each interval seconds.
+
+    Unlike cProfile it sees worker threads and adds little overhead. Stacks are saved
+    in the folded format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile(mode, output):
+    """Profile the enclosed block with "cprofile" (calling thread only) or "sample" (all threads).
+
+    cProfile statistics are saved for pstats or snakeviz; samples as folded stacks.
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output)
+            logger.info(f"Saved cProfile statistics to {output}")
+    elif mode == "sample":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.save(output)
+            logger.info(f"Saved {sum(sampler.stacks.values())} stack samples to {output}")
+    else:
+        yield
@@ -0,0 +1,127 @@
+"""
+Shared reading and writing of the intermediate files passed between pipeline stages.
+
+Every stage can read and write Parquet, Arrow IPC or CSV, picked from the file
+extension (.parquet / .arrow, .ipc, .feather / anything else) unless a format is
+given explicitly. Columnar formats keep their types, so nothing is re-inferred
+between stages; CSV remains available for existing files and spreadsheets and is
+always read with the stage's fixed schema.
+
+Parquet is written with zstd compression for compact storage. Arrow IPC is written
+uncompressed by default and scanned memory-mapped, so reads are zero-copy.
+"""
+
+import polars as pl
+
+FORMATS = ["csv", "parquet", "ipc"]
+
+SUFFIX_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "ipc",
+    ".ipc": "ipc",
+    ".feather": "ipc",
+}
+
+# Raw Kaggle dump and the output of filter.py
+PROPERTY_SCHEMA = {
+    "property_id": pl.Int64,
+    "download_date": pl.Utf8,
+    "council_name": pl.Utf8,
+    "purchase_price": pl.Int64,
+    "address": pl.Utf8,
+    "post_code": pl.Int64,
+    "property_type": pl.Utf8,
+    "strata_lot_number": pl.Int64,
+    "property_name": pl.Utf8,
+    "area": pl.Float64,
+    "area_type": pl.Utf8,
+    "contract_date": pl.Utf8,
+    "settlement_date": pl.Utf8,
+    "zoning": pl.Utf8,
+    "nature_of_property": pl.Utf8,
+    "primary_purpose": pl.Utf8,
+    "legal_description": pl.Utf8,
+}
+
+# Output of batch_geocode_local.py
+GEOCODED_SCHEMA = {"address": pl.Utf8, "lat": pl.Float64, "lon": pl.Float64}
+
+# Property rows with their coordinates joined back on (batch_geocode_local.py --rows-output)
+ENRICHED_SCHEMA = {**PROPERTY_SCHEMA, "lat": pl.Float64, "lon": pl.Float64}
+
+
+def h3_schema(resolutions, hex_strings=False):
+    """Schema of the output of add_h3_col.py for the given resolutions."""
+    schema = {**GEOCODED_SCHEMA, **{f"h3_r{res}": pl.UInt64 for res in resolutions}}
+    if hex_strings:
+        schema.update({f"h3_r{res}_hex": pl.Utf8 for res in resolutions})
+    return schema
+
+
+def detect_format(path, fmt=None):
+    """Return the file format for path, preferring an explicit fmt."""
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+        return fmt
+    for suffix, suffix_format in SUFFIX_FORMATS.items():
+        if str(path).lower().endswith(suffix):
+            return suffix_format
+    return "csv"
+
+
+def apply_schema(lf, schema):
+    """Cast the columns of lf that appear in schema, leaving any others untouched."""
+    if not schema:
+        return lf
+    columns = lf.collect_schema().names()
+    return lf.cast({name: dtype for name, dtype in schema.items() if name in columns})
+
+
+def scan(path, schema=None, fmt=None, separator="\t"):
+    """Lazily scan a pipeline file.
+
+    CSV files are parsed with schema instead of inferring types; columnar files are
+    cast to it, which is free when the types already match.
+    """
+    fmt = detect_format(path, fmt)
+    if fmt == "parquet":
+        return apply_schema(pl.scan_parquet(path), schema)
+    if fmt == "ipc":
+        # Polars memory-maps uncompressed IPC files when scanning them
+        return apply_schema(pl.scan_ipc(path), schema)
+    return pl.scan_csv(path, separator=separator, schema_overrides=schema, truncate_ragged_lines=True)
+
+
+def read(path, schema=None, fmt=None, separator="\t", columns=None):
+    """Read a pipeline file into a DataFrame, optionally only some columns."""
+    lf = scan(path, schema, fmt, separator)
+    if columns:
+        lf = lf.select(columns)
+    return lf.collect()
+
+
+def sink(lf, path, schema=None, fmt=None, separator="\t", compression=None, lazy=False):
+    """Write lf to path in a streaming fashion.
+
+    With lazy=True the sink is returned unexecuted so several can run in one query
+    with run_sinks.
+    """
+    lf = apply_schema(lf, schema)
+    fmt = detect_format(path, fmt)
+    if fmt == "parquet":
+        return lf.sink_parquet(path, compression=compression or "zstd", lazy=lazy)
+    if fmt == "ipc":
+        return lf.sink_ipc(path, compression=compression or "uncompressed", lazy=lazy)
+    return lf.sink_csv(path, separator=separator, lazy=lazy)
+
+
+def write(df, path, schema=None, fmt=None, separator="\t", compression=None):
+    """Write an in-memory DataFrame to path."""
+    sink(df.lazy(), path, schema, fmt, separator, compression)
+
+
+def run_sinks(sinks):
+    """Execute several lazy sinks in one streaming query so shared scans are read only once."""
+    pl.collect_all(sinks, engine="streaming")
@@ -0,0 +1,111 @@
+"""
+Lazy access to the NSW property sales dump from Kaggle.
+
+Everything here returns or consumes polars LazyFrames so that filters and column
+selections are pushed down into the scan, and queries run on the streaming
+engine with bounded memory.
+"""
+
+import polars as pl
+
+from addr_utils import address_key_expr
+from pipeline_io import PROPERTY_SCHEMA, scan
+
+DEFAULT_INPUT = "large-files/nsw_property_data.csv"
+
+# Councils of Greater Sydney; suburb name is stored in column council_name
+SYDNEY_COUNCILS = [
+    "BAYSIDE",
+    "BLACKTOWN",
+    "BLUE MOUNTAINS",
+    "BURWOOD",
+    "CAMDEN",
+    "CAMPBELLTOWN",
+    "CANADA BAY",
+    "CANTERBURY-BANKSTOWN",
+    "CITY OF PARRAMATTA",
+    "CITY OF SYDNEY",
+    "CUMBERLAND",
+    "FAIRFIELD",
+    "GEORGES RIVER",
+    "HAWKESBURY",
+    "HORNSBY",
+    "HUNTERS HILL",
+    "INNER WEST",
+    "KU-RING-GAI",
+    "LANE COVE",
+    "LIVERPOOL",
+    "MOSMAN",
+    "NORTH SYDNEY",
+    "NORTHERN BEACHES",
+    "PENRITH",
+    "RANDWICK",
+    "RYDE",
+    "STRATHFIELD",
+    "SUTHERLAND",
+    "THE HILLS SHIRE",
+    "UNINCORPORATED SYDNEY HARBOUR",
+    "WAVERLEY",
+    "WILLOUGHBY",
+    "WOLLONDILLY",
+    "WOOLLAHRA"
+]
+
+
+def scan_property_data(path=DEFAULT_INPUT, separator=","):
+    """Lazily scan the property data with the known column types.
+
+    Besides the raw Kaggle CSV this accepts the Parquet or Arrow IPC files written
+    by filter.py.
+    """
+    return scan(path, PROPERTY_SCHEMA, separator=separator)
+
+
+def filter_councils(lf, councils):
+    """Keep only sales in the given councils."""
+    return lf.filter(pl.col("council_name").is_in(councils))
+
+
+def unique_councils(lf):
+    """Sorted unique council names."""
+    return lf.select("council_name").unique().sort("council_name")
+
+
+def load_councils(councils=None, councils_file=None):
+    """Resolve the council list from a comma-separated string or a file with one name per line.
+
+    Falls back to SYDNEY_COUNCILS when neither is given.
+    """
+    if councils_file:
+        with open(councils_file) as f:
+            return [line.strip() for line in f if line.strip()]
+    if councils:
+        return [name.strip() for name in councils.split(",") if name.strip()]
+    return SYDNEY_COUNCILS
+
+
+
+def join_coordinates(rows, geocoded, address_column="address", postcode_column="post_code"):
+    """Attach lat and lon from a geocoded (address, lat, lon) table to every property row.
+
+    Rows are matched through the same stripped "<address> <postcode>" key used for
+    geocoding, so every sale in a building gets the building's coordinates; rows
+    without a geocoded key get nulls. Both sides are joined on a 64-bit hash of the
+    key rather than the string, which makes the hash join much cheaper; the keys are
+    carried along and compared after it, so a hash collision leaves a row without
+    coordinates rather than with another address's.
+    Row order is kept and the join streams, with only the geocoded table in memory.
+    """
+    coords = (
+        geocoded.select(pl.col("address").hash().alias("_key_hash"), pl.col("address").alias("_key"), "lat", "lon")
+        # A duplicated address would otherwise repeat the rows it matches
+        .unique(subset="_key_hash", keep="first")
+    )
+    key = address_key_expr(address_column, postcode_column)
+    matched = pl.col("_row_key") == pl.col("_key")
+    return (
+        rows.with_columns(key.alias("_row_key"), key.hash().alias("_key_hash"))
+        .join(coords, on="_key_hash", how="left", maintain_order="left")
+        .with_columns(pl.when(matched).then(pl.col("lat")).alias("lat"), pl.when(matched).then(pl.col("lon")).alias("lon"))
+        .drop("_row_key", "_key_hash", "_key")
+    )
@@ -0,0 +1,66 @@
+"""
+Compact per-address state of a geocoding run.
+
+A run handles millions of unique address keys. Holding them as Python strings in
+lists, sets and dicts costs well over a hundred bytes per key for every copy. The
+ResultStore keeps the keys in the polars Series they were deduplicated into and
+refers to each one by its position, its ID. The outcome of every address is one
+byte in a bytearray, which worker threads set by ID; coordinates are not held here
+but streamed to the checkpointed output as they arrive.
+"""
+
+import polars as pl
+
+from geocode_cache import ERROR, NOT_FOUND
+
+PENDING = "pending"
+FOUND = "ok"
+# Left alone in --retry-failed mode: never looked up and never written
+SKIPPED = "skipped"
+
+# One byte per address; the position in this tuple is the code
+STATUSES = (PENDING, FOUND, NOT_FOUND, ERROR, SKIPPED)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+class ResultStore:
+    """Status of each address of a Series, addressed by position."""
+
+    def __init__(self, addresses):
+        self.addresses = addresses.rename("address").rechunk()
+        self.codes = bytearray(len(self.addresses))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def address(self, address_id):
+        return self.addresses[address_id]
+
+    def set(self, address_id, status):
+        # A single bytearray item assignment, so threads need no lock
+        self.codes[address_id] = STATUS_CODES[status]
+
+    def batches(self, size):
+        """Yield (first ID, list of addresses) for consecutive batches of at most size addresses."""
+        for start in range(0, len(self), size):
+            yield start, self.addresses.slice(start, size).to_list()
+
+    def frame(self):
+        """(id, address, status) of every address, with status as a string."""
+        codes = pl.Series("code", self.codes, dtype=pl.UInt8)
+        status = codes.replace_strict(list(STATUS_CODES.values()), list(STATUS_CODES), return_dtype=pl.Utf8)
+        return pl.DataFrame([self.addresses, status.rename("status")]).with_row_index("id")
+
+    def select(self, *statuses):
+        """(id, address, status) of the addresses with any of the given statuses."""
+        codes = pl.Series("code", self.codes, dtype=pl.UInt8)
+        mask = codes.is_in([STATUS_CODES[status] for status in statuses])
+        return self.frame().filter(mask)
+
+    def ids(self, status):
+        """IDs of the addresses with a status, as a list of ints."""
+        return self.select(status)["id"].to_list()
+
+    def counts(self):
+        """Number of addresses per status."""
+        return {status: self.codes.count(code) for code, status in enumerate(STATUSES)}
@@ -0,0 +1,187 @@
+"""
+Run filter, geocode and H3 stages on shards of the property data in a process pool.
+
+The input is filtered to a set of councils and split into one shard per council
+(or per postcode) in a single streaming pass. Each shard is then geocoded, joined
+back onto its rows and H3-indexed in a process of its own, so the CPU-heavy stages
+scale across cores instead of sharing one GIL. The result is a hive-partitioned
+Parquet dataset, OUTPUT_DIR/<column>=<value>/part-0.parquet, which polars reads back
+with pl.scan_parquet(OUTPUT_DIR, hive_partitioning=True).
+
+A shard's output only appears once it is complete, so rerunning the command skips
+finished shards and retries only the ones that failed.
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote
+
+import click
+import polars as pl
+
+from h3_index import add_h3_columns, parse_resolutions
+from pipeline_io import PROPERTY_SCHEMA, run_sinks, sink
+from property_data import DEFAULT_INPUT, filter_councils, load_councils, scan_property_data
+
+logger = logging.getLogger(__name__)
+
+# Shard column for each --shard-by choice
+SHARD_COLUMNS = {"council": "council_name", "postcode": "post_code"}
+
+# Directory name polars and Hive use for null partition values
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def partition_dir(column, value):
+    """Hive-style directory name for one shard, percent-encoded like polars writes it."""
+    return f"{column}={NULL_PARTITION if value is None else quote(str(value), safe='')}"
+
+
+def shard_filter(column, value):
+    return pl.col(column).is_null() if value is None else pl.col(column) == value
+
+
+def shard_values(lf, column):
+    """Distinct values of the shard column, nulls last."""
+    return lf.select(pl.col(column).unique()).collect(engine="streaming")[column].sort(nulls_last=True).to_list()
+
+
+def split_shards(lf, column, values, work_dir):
+    """Write the rows of each shard value to work_dir/<partition>/input.parquet in one streaming pass."""
+    sinks = []
+    for value in values:
+        shard_dir = os.path.join(work_dir, partition_dir(column, value))
+        os.makedirs(shard_dir, exist_ok=True)
+        sinks.append(sink(lf.filter(shard_filter(column, value)), os.path.join(shard_dir, "input.parquet"), PROPERTY_SCHEMA, lazy=True))
+    run_sinks(sinks)
+
+
+def run_shard(column, value, work_dir, output_dir, resolutions, geocode_args=(), verbose=False):
+    """Geocode one shard, join the coordinates onto its rows and add H3 cells.
+
+    Meant to run in a worker process. Returns a summary of the shard.
+    """
+    import batch_geocode_local
+
+    # Spawned workers start with logging unconfigured; this does nothing in forked ones
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not verbose:
+        for name in ("batch_geocode_local", "backend_pool", "checkpoint", "geocode_cache", "metrics"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    start = time.time()
+    name = partition_dir(column, value)
+    shard_dir = os.path.join(work_dir, name)
+    rows_file = os.path.join(shard_dir, "rows.parquet")
+    summary = batch_geocode_local.main.main([
+        os.path.join(shard_dir, "input.parquet"), os.path.join(shard_dir, "geocoded.parquet"),
+        "--rows-output", rows_file, *geocode_args,
+    ], standalone_mode=False)
+
+    # The shard column lives in the directory name, as usual for hive partitioning
+    out_dir = os.path.join(output_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "part-0.parquet")
+    indexed = add_h3_columns(pl.scan_parquet(rows_file), resolutions).drop(column)
+    sink(indexed, f"{out_file}.tmp", fmt="parquet")
+    # Renamed into place last, so a part file always means a finished shard
+    os.replace(f"{out_file}.tmp", out_file)
+    shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return {"shard": name, "rows": summary["rows"], "geocoded": summary["geocoded"],
+            "unique_addresses": summary["unique_addresses"], "seconds": time.time() - start}
+
+
+def run_shards(column, values, work_dir, output_dir, resolutions, geocode_args=(), processes=None, retries=1, verbose=False):
+    """Run every shard in a process pool, retrying failed shards up to retries times.
+
+    Returns (summaries, failed shard values).
+    """
+    context = multiprocessing.get_context("spawn")
+    summaries = []
+    attempts = {value: 0 for value in values}
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        def submit(value):
+            attempts[value] += 1
+            return executor.submit(run_shard, column, value, work_dir, output_dir, resolutions, geocode_args, verbose)
+
+        pending = {submit(value): value for value in values}
+        while pending:
+            for future in as_completed(list(pending)):
+                value = pending.pop(future)
+                name = partition_dir(column, value)
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    if attempts[value] <= retries:
+                        logger.warning(f"Shard {name} failed ({e!r}), retrying")
+                        pending[submit(value)] = value
+                    else:
+                        logger.error(f"Shard {name} failed after {attempts[value]} attempts: {e!r}")
+                        failed.append(value)
+                    continue
+                summaries.append(summary)
+                logger.info(f"Finished shard {name}: {summary['rows']} rows, {summary['geocoded']}/{summary['unique_addresses']} "
+                            f"addresses geocoded in {summary['seconds']:.1f}s ({len(summaries)}/{len(values)} shards)")
+    return summaries, failed
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument('output_dir', type=click.Path())
+@click.argument('geocode_args', nargs=-1, type=click.UNPROCESSED)
+@click.option('--input', 'input_file', default=DEFAULT_INPUT, type=click.Path(exists=True), help='Raw Kaggle NSW property data (CSV, Parquet or Arrow IPC)')
+@click.option('--input-separator', default=',', help='Input file separator')
+@click.option('--councils', help='Comma-separated council names to keep (default: Greater Sydney councils)')
+@click.option('--councils-file', type=click.Path(exists=True), help='File with one council name per line to keep')
+@click.option('--shard-by', type=click.Choice(list(SHARD_COLUMNS)), default='council', help='Column to shard the data and partition the output by')
+@click.option('--processes', type=int, help='Shards processed in parallel (default: CPU count)')
+@click.option('--retries', default=1, help='Times a failed shard is retried')
+@click.option('--resolutions', default='7,8,9,10', help='Comma-separated H3 resolutions, one h3_r<N> column each')
+@click.option('--work-dir', type=click.Path(), help='Scratch space for shard inputs (default: OUTPUT_DIR.work next to OUTPUT_DIR)')
+@click.option('--verbose', is_flag=True, help='Show the geocode log of every shard')
+def main(output_dir, geocode_args, input_file, input_separator, councils, councils_file, shard_by, processes, retries, resolutions, work_dir, verbose):
+    """Filter, geocode and H3-index the property data shard by shard into a partitioned dataset.
+
+    Arguments after OUTPUT_DIR (separate them with --) are passed on to every shard's
+    batch_geocode_local.py geocode run, e.g. -- --nominatim-url http://localhost:8080 --engine async.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        resolutions = parse_resolutions(resolutions)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--resolutions')
+    column = SHARD_COLUMNS[shard_by]
+    # Outside OUTPUT_DIR, so scans of the dataset never pick up scratch files
+    work_dir = work_dir or f"{output_dir.rstrip(os.sep)}.work"
+    start = time.time()
+
+    council_list = load_councils(councils, councils_file)
+    lf = filter_councils(scan_property_data(input_file, input_separator), council_list)
+    values = shard_values(lf, column)
+
+    # Shards finished by an earlier run are kept
+    todo = [value for value in values if not os.path.exists(os.path.join(output_dir, partition_dir(column, value), "part-0.parquet"))]
+    if len(todo) < len(values):
+        logger.info(f"Skipping {len(values) - len(todo)} shards already in {output_dir}")
+    logger.info(f"Splitting sales in {len(council_list)} councils into {len(todo)} shards by {column}...")
+    split_shards(lf, column, todo, work_dir)
+    logger.info(f"Processing {len(todo)} shards with {processes or os.cpu_count()} processes")
+
+    summaries, failed = run_shards(column, todo, work_dir, output_dir, resolutions, geocode_args, processes, retries, verbose)
+
+    rows = sum(summary["rows"] for summary in summaries)
+    logger.info(f"Processed {rows} rows in {len(summaries)} shards in {time.time() - start:.1f}s")
+    if failed:
+        logger.error(f"{len(failed)} shards failed: {', '.join(partition_dir(column, value) for value in failed)}; rerun to retry them")
+        raise SystemExit(1)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info(f"Saved partitioned dataset to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Single-flight coalescing of geocoding requests across threads and concurrent runs.
+
+Runs that share a cache but geocode overlapping addresses at the same time would
+each send Nominatim the same misses. Before querying an address a worker claims a
+short-lived lease on it: in a table shared by every thread of the process and, when
+Redis is in use, as a "geocode-lease:<address>" key set with NX. The lease holder
+queries Nominatim and publishes the result to the table at once. Its Redis lease is
+held until the geocode command's batched cache write has stored the address's Redis
+cache entry, and then dropped along with the rest of the batch, so the result reaches
+Redis through one write path. A run only drops leases it still holds. Everyone else finds the lease taken, moves on to other
+addresses and comes back later for the published result. Only results published
+since a run started count, so the table is no cache of its own and old cached
+failures keep their usual expiry.
+
+A lease expires after ttl seconds, so one left behind by a crashed run only delays
+its address. The ttl should exceed the longest a query can take with its retries,
+plus the time its result waits for the batched cache write. When Redis fails, claims
+fall back to the in-process leases and queries go ahead uncoordinated across runs.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+from geocode_cache import CachedFailure, decode_entry
+
+logger = logging.getLogger(__name__)
+
+LEASE_PREFIX = "geocode-lease:"
+
+# Seconds before a worker comes back to an address whose lease was taken
+POLL_INTERVAL = 0.5
+
+# Drops a lease only while it is still this run's: one that expired and was then
+# claimed by another run stays theirs
+RELEASE_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+# Outcomes of SingleFlight.claim
+CLAIMED = "claimed"
+DONE = "done"
+BUSY = "busy"
+
+
+class LocalLeases:
+    """Leases and recently published results shared by the threads of one process."""
+
+    def __init__(self, max_results=100000, clock=time.monotonic):
+        self.max_results = max_results
+        self.clock = clock
+        self.held = {}
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, address, ttl):
+        now = self.clock()
+        with self.lock:
+            expires_at = self.held.get(address)
+            if expires_at is not None and expires_at > now:
+                return False
+            self.held[address] = now + ttl
+            return True
+
+    def release(self, address, value=None):
+        with self.lock:
+            self.held.pop(address, None)
+            if value is not None:
+                self.results[address] = (value, time.time())
+                self.results.move_to_end(address)
+                while len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+
+    def result(self, address, since):
+        """Value published for an address at or after the time since, or None."""
+        with self.lock:
+            value, published_at = self.results.get(address, (None, 0.0))
+        return value if published_at >= since else None
+
+
+# One table for every run in this process, so concurrent runs coalesce without Redis
+LOCAL_LEASES = LocalLeases()
+
+
+class SingleFlight:
+    """Claims addresses before they are queried, so each is queried by only one worker at a time."""
+
+    def __init__(self, redis_client=None, ttl=60.0, local=LOCAL_LEASES):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.local = local
+        self.owner = uuid.uuid4().hex
+        self.started_at = time.time()
+
+    def claim(self, address):
+        """Try to take the lease on an address.
+
+        Returns (CLAIMED, None) when the caller should query the address and then call
+        release(), (DONE, value) when another worker already published its cache value,
+        or (BUSY, None) while another worker holds the lease.
+        """
+        if self.local.acquire(address, self.ttl):
+            if self.redis_client is None or self.acquire_redis(address):
+                # The result may have been published since this run looked the address up
+                value = self.result(address)
+                if value is None:
+                    return CLAIMED, None
+                self.release(address)
+                return DONE, value
+            self.local.release(address)
+        value = self.result(address)
+        return (DONE, value) if value is not None else (BUSY, None)
+
+    def acquire_redis(self, address):
+        try:
+            return bool(self.redis_client.set(f"{LEASE_PREFIX}{address}", self.owner, nx=True, px=int(self.ttl * 1000)))
+        except Exception as e:
+            # Better a query other runs may repeat than an address left out
+            metrics.inc("lease_errors")
+            logger.warning(f"Could not claim {address} in Redis, querying it without a lease: {e}")
+            return True
+
+    def result(self, address):
+        """Cache value of an address published since this run started, or None."""
+        value = self.local.result(address, self.started_at)
+        if value is None and self.redis_client is not None:
+            try:
+                raw = self.redis_client.get(f"geocode:{address}")
+            except Exception as e:
+                logger.warning(f"Could not read the cache entry of {address} from Redis: {e}")
+                return None
+            value = decode_entry(raw) if raw else None
+            # Coordinates in Redis are new to this run, which missed them up front,
+            # but a failure may be an expired one it chose to retry
+            if isinstance(value, CachedFailure) and value.failed_at < self.started_at:
+                value = None
+        return value
+
+    def release(self, address, value=None):
+        """Publish the cache value of a claimed address, if given, to this process and drop its local lease.
+
+        Without a value the Redis lease is dropped too. With one, it is held until
+        published() is called once the value is in the Redis cache.
+        """
+        self.local.release(address, value)
+        if value is None:
+            self.published([address])
+
+    def published(self, addresses):
+        """Drop the Redis leases this run holds on addresses whose cache entries have been written."""
+        if self.redis_client is None or not addresses:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for address in addresses:
+                pipe.eval(RELEASE_SCRIPT, 1, f"{LEASE_PREFIX}{address}", self.owner)
+            pipe.execute()
+        except Exception as e:
+            # They expire on their own
+            logger.warning(f"Could not drop {len(addresses)} Redis leases: {e}")
@@ -0,0 +1,242 @@
+"""
+Batch radius and nearest-neighbour queries over geocoded properties.
+
+Points are bucketed by their H3 cell. A radius query looks up the buckets in a disk
+of k rings around the query's cell, wide enough to contain the whole circle, and
+filters those candidates by exact haversine distance. Every step runs on whole
+columns of queries at once: the rings are computed once per distinct (cell, k),
+candidates come from a join, and distances from a polars expression. Large radii
+switch to coarser parent cells, so a query never looks at more than MAX_RINGS rings.
+
+The index is a Parquet file of (row_id, lat, lon, cell) sorted by cell, where
+row_id is the position of the point in the input file or the value of an ID column.
+"""
+
+import logging
+import math
+import time
+
+import click
+import h3
+import polars as pl
+
+from h3_index import RESOLUTION_OFFSET, cell_to_parent_expr, latlng_to_cell_expr
+from pipeline_io import FORMATS, read, scan, write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESOLUTION = 9
+
+# Mean earth radius used by h3.great_circle_distance
+EARTH_RADIUS_M = 6371007.180918475
+HALF_CIRCUMFERENCE_M = math.pi * EARTH_RADIUS_M
+
+# Shortest cell edge relative to the average one at the same resolution. The
+# shortest edges, next to the pentagons, are 0.70 of the average from resolution 2 on.
+MIN_EDGE_RATIO = 0.65
+
+# Widest disk searched at one resolution (127 cells); larger radii use parent cells
+MAX_RINGS = 6
+
+
+def min_edge_length(resolution):
+    """Lower bound in metres for the edge length of any cell at resolution.
+
+    A point outside the k-ring disk around a cell is at least k edges away from any
+    point in that cell, so k = ceil(radius / min_edge_length) rings cover a radius.
+    """
+    return MIN_EDGE_RATIO * h3.average_hexagon_edge_length(resolution, unit="m")
+
+
+def haversine_expr(lat1, lon1, lat2, lon2):
+    """Expression giving the great-circle distance in metres between two coordinate column pairs."""
+    lat1, lon1, lat2, lon2 = (pl.col(c).radians() for c in (lat1, lon1, lat2, lon2))
+    a = ((lat2 - lat1) / 2).sin() ** 2 + lat1.cos() * lat2.cos() * ((lon2 - lon1) / 2).sin() ** 2
+    return 2 * EARTH_RADIUS_M * a.sqrt().clip(upper_bound=1.0).arcsin()
+
+
+def cell_resolution(cell):
+    """Resolution of a UInt64 H3 cell, read from its index bits."""
+    return (cell >> RESOLUTION_OFFSET) & 0xF
+
+
+def query_resolution_expr(radius, finest):
+    """Expression giving the finest resolution at which MAX_RINGS rings cover radius.
+
+    Null when even resolution 0 cells are too small, meaning the query scans every point.
+    """
+    expr = pl.when(pl.col(radius) <= MAX_RINGS * min_edge_length(finest)).then(pl.lit(finest, dtype=pl.Int8))
+    for res in range(finest - 1, -1, -1):
+        expr = expr.when(pl.col(radius) <= MAX_RINGS * min_edge_length(res)).then(pl.lit(res, dtype=pl.Int8))
+    return expr.otherwise(None)
+
+
+def grid_disks(cells):
+    """Explode a (cell, rings) frame into (cell, rings, bucket) with every cell of each disk."""
+    disks = [h3.api.basic_int.grid_disk(cell, rings) for cell, rings in cells.iter_rows()]
+    return cells.with_columns(bucket=pl.Series(disks, dtype=pl.List(pl.UInt64))).explode("bucket")
+
+
+class SpatialIndex:
+    """Points bucketed by H3 cell, answering batch radius and k-nearest-neighbour queries."""
+
+    def __init__(self, points, resolution=DEFAULT_RESOLUTION):
+        self.points = points
+        self.resolution = cell_resolution(points["cell"][0]) if points.height else resolution
+
+    @classmethod
+    def build(cls, df, resolution=DEFAULT_RESOLUTION, lat="lat", lon="lon", id_column=None):
+        """Index the points of a DataFrame or LazyFrame; rows without coordinates are left out."""
+        lf = df.lazy()
+        lf = lf.with_row_index("row_id") if id_column is None else lf.rename({id_column: "row_id"})
+        points = (
+            lf.filter(pl.col(lat).is_not_null() & pl.col(lon).is_not_null())
+            .select("row_id", pl.col(lat).alias("lat"), pl.col(lon).alias("lon"),
+                    latlng_to_cell_expr(resolution, lat, lon).alias("cell"))
+            .sort("cell")
+            .collect()
+        )
+        return cls(points, resolution)
+
+    @classmethod
+    def load(cls, path):
+        return cls(pl.read_parquet(path))
+
+    def save(self, path):
+        self.points.write_parquet(path, compression="zstd")
+
+    def _prepare(self, queries, lat, lon, radius=0.0):
+        # Queries are numbered by position; ones without coordinates get no results
+        radius = pl.col(radius) if isinstance(radius, str) else pl.lit(radius)
+        return (
+            queries.lazy().with_row_index("query_id")
+            .select("query_id", pl.col(lat).alias("qlat"), pl.col(lon).alias("qlon"), radius.cast(pl.Float64).alias("radius"))
+            .filter(pl.col("qlat").is_not_null() & pl.col("qlon").is_not_null())
+            .collect()
+        )
+
+    def _empty(self):
+        return pl.DataFrame(schema={"query_id": pl.UInt32, "row_id": self.points.schema["row_id"], "distance": pl.Float64})
+
+    def _within(self, queries):
+        """Return (query_id, row_id, distance) for every point within each query's radius column."""
+        queries = queries.with_columns(
+            res=query_resolution_expr("radius", self.resolution),
+            cell=latlng_to_cell_expr(self.resolution, "qlat", "qlon"),
+        )
+        parts = []
+        for res in queries["res"].unique().to_list():
+            if res is None:
+                group = queries.filter(pl.col("res").is_null())
+                candidates = group.join(self.points, how="cross")
+            else:
+                group = queries.filter(pl.col("res") == res).with_columns(
+                    cell=cell_to_parent_expr("cell", res),
+                    rings=(pl.col("radius") / min_edge_length(res)).ceil().clip(lower_bound=1).cast(pl.Int32),
+                )
+                disks = grid_disks(group.select("cell", "rings").unique())
+                points = self.points.rename({"cell": "bucket"})
+                if res != self.resolution:
+                    points = points.with_columns(bucket=cell_to_parent_expr("bucket", res))
+                candidates = group.join(disks, on=["cell", "rings"]).join(points, on="bucket")
+            parts.append(
+                candidates.select("query_id", "row_id", haversine_expr("qlat", "qlon", "lat", "lon").alias("distance"), "radius")
+                .filter(pl.col("distance") <= pl.col("radius"))
+                .drop("radius")
+            )
+        return pl.concat(parts) if parts else self._empty()
+
+    def radius(self, queries, radius, lat="lat", lon="lon"):
+        """Find every point within radius metres of each query.
+
+        queries is a DataFrame of query points; radius is a number or the name of a
+        column of queries. Returns (query_id, row_id, distance) sorted by query and
+        distance, where query_id is the position of the query in queries.
+        """
+        return self._within(self._prepare(queries, lat, lon, radius)).sort("query_id", "distance", "row_id")
+
+    def knn(self, queries, k, lat="lat", lon="lon", max_distance=None):
+        """Find the k nearest points to each query, optionally only within max_distance metres.
+
+        Returns (query_id, row_id, distance) like radius(). The search radius starts
+        at what the finest disk covers and grows fourfold for queries that have found
+        fewer than k points, until it spans the globe.
+        """
+        pending = self._prepare(queries, lat, lon)
+        search_radius = MAX_RINGS * min_edge_length(self.resolution)
+        results = []
+        while pending.height:
+            last_round = search_radius >= HALF_CIRCUMFERENCE_M or (max_distance is not None and search_radius >= max_distance)
+            if max_distance is not None:
+                search_radius = min(search_radius, max_distance)
+            found = self._within(pending.with_columns(radius=pl.lit(float(search_radius))))
+            if not last_round:
+                # Only queries with k points inside the circle know their k nearest
+                done = found.group_by("query_id").len().filter(pl.col("len") >= k)["query_id"].implode()
+                found = found.filter(pl.col("query_id").is_in(done))
+                pending = pending.filter(~pl.col("query_id").is_in(done))
+            else:
+                pending = pending.clear()
+            results.append(found.sort("query_id", "distance", "row_id").group_by("query_id", maintain_order=True).head(k))
+            search_radius *= 4
+        return pl.concat(results).sort("query_id", "distance", "row_id") if results else self._empty()
+
+
+@click.group()
+def cli():
+    """Spatial index over geocoded properties for radius and nearest-neighbour queries."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+@cli.command("build")
+@click.argument('input_file', type=click.Path(exists=True))
+@click.argument('index_file', type=click.Path())
+@click.option('--resolution', default=DEFAULT_RESOLUTION, type=click.IntRange(0, 15), help='H3 resolution of the buckets')
+@click.option('--id-column', help='Column to report as row_id (default: the row number in INPUT_FILE)')
+@click.option('--separator', default='\t', help='Separator for CSV input')
+def build(input_file, index_file, resolution, id_column, separator):
+    """Index the points of a file with lat and lon columns, such as join-rows or add_h3_col.py output."""
+    start = time.time()
+    index = SpatialIndex.build(scan(input_file, separator=separator), resolution, id_column=id_column)
+    index.save(index_file)
+    logger.info(f"Indexed {index.points.height} points at resolution {resolution} in {time.time() - start:.1f}s, saved to {index_file}")
+
+
+@cli.command("query")
+@click.argument('index_file', type=click.Path(exists=True))
+@click.argument('queries_file', type=click.Path(exists=True))
+@click.argument('output_file', type=click.Path())
+@click.option('--radius', help='Radius in metres, or the name of a column of QUERIES_FILE holding one per query')
+@click.option('--k', type=int, help='Number of nearest points per query')
+@click.option('--max-distance', type=float, help='With --k, only return neighbours within this many metres')
+@click.option('--lat-column', default='lat', help='Latitude column of QUERIES_FILE')
+@click.option('--lon-column', default='lon', help='Longitude column of QUERIES_FILE')
+@click.option('--separator', default='\t', help='Separator for CSV input and output')
+@click.option('--output-format', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+def query(index_file, queries_file, output_file, radius, k, max_distance, lat_column, lon_column, separator, output_format):
+    """Write (query_id, row_id, distance) for every match of the points in QUERIES_FILE.
+
+    query_id is the row number in QUERIES_FILE; give either --radius or --k.
+    """
+    if (radius is None) == (k is None):
+        raise click.UsageError("Give exactly one of --radius and --k")
+    index = SpatialIndex.load(index_file)
+    queries = read(queries_file, separator=separator)
+    start = time.time()
+    if radius is not None:
+        try:
+            radius = float(radius)
+        except ValueError:
+            if radius not in queries.columns:
+                raise click.BadParameter(f"not a number or a column of {queries_file}", param_hint='--radius')
+        matches = index.radius(queries, radius, lat_column, lon_column)
+    else:
+        matches = index.knn(queries, k, lat_column, lon_column, max_distance)
+    elapsed = time.time() - start
+    logger.info(f"Answered {queries.height} queries in {elapsed:.2f}s ({queries.height / max(elapsed, 1e-9):.0f} queries/s), {matches.height} matches")
+    write(matches, output_file, fmt=output_format, separator=separator)
+    logger.info(f"Saved matches to {output_file}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,61 @@
+import random
+
+from adaptive_limiter import AdaptiveLimiter, backoff_delay
+
+def simulate(limiter, capacity, rounds=3000, base_latency=0.05, error_above=None):
+    """Drive the limiter against a server that queues requests beyond capacity and optionally fails when overloaded."""
+    for _ in range(rounds):
+        in_flight = limiter.capacity()
+        latency = base_latency * max(1.0, in_flight / capacity)
+        ok = error_above is None or in_flight <= error_above
+        limiter.update(latency, ok, in_flight - 1)
+    return limiter.limit
+
+def test_limit_grows_to_server_capacity():
+    """Test a low starting limit climbs until latency shows the server queueing."""
+    limit = simulate(AdaptiveLimiter(initial=2, max_limit=256), capacity=16)
+    assert 16 <= limit <= 16 * 2
+
+def test_limit_shrinks_when_server_fails():
+    """Test errors keep the limit below the point where the server starts failing."""
+    limiter = AdaptiveLimiter(initial=4, max_limit=256)
+    assert simulate(limiter, capacity=64, error_above=12) <= 13
+
+def test_limit_follows_server_slowdown():
+    """Test a server that slows down under the same load gets fewer requests in flight."""
+    limiter = AdaptiveLimiter(initial=2, max_limit=256)
+    simulate(limiter, capacity=32)
+    assert simulate(limiter, capacity=8) <= 8 * 2
+
+def test_limit_stays_within_bounds():
+    """Test the limit never leaves [min_limit, max_limit]."""
+    limiter = AdaptiveLimiter(initial=4, min_limit=2, max_limit=8)
+    assert simulate(limiter, capacity=1000) == 8
+    for _ in range(100):
+        limiter.update(1.0, False, 0)
+    assert limiter.capacity() == 2
+
+def test_limit_does_not_grow_when_unused():
+    """Test the limit only grows while callers actually fill it."""
+    limiter = AdaptiveLimiter(initial=4, max_limit=256)
+    for _ in range(1000):
+        limiter.update(0.05, True, 0)
+    assert limiter.limit == 4
+
+def test_calibration_ignores_requests_still_draining():
+    """Test the baseline is only measured on requests sent within the calibration limit."""
+    limiter = AdaptiveLimiter(initial=4, window_size=10)
+    for _ in range(10):
+        limiter.update(5.0, True, 20)
+    assert limiter.baseline is None
+    for _ in range(10):
+        limiter.update(0.05, True, 3)
+    assert limiter.baseline == 0.05
+
+def test_backoff_delay_is_jittered_and_capped():
+    """Test retry delays stay within the exponential bound and the cap."""
+    rng = random.Random(1)
+    delays = [backoff_delay(attempt, base=0.5, cap=4.0, rng=rng) for attempt in range(10) for _ in range(50)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert max(backoff_delay(0, base=0.5, rng=rng) for _ in range(100)) <= 0.5
+    assert len(set(delays)) == len(delays)
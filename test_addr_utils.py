@@ -1,5 +1,8 @@
+import random
+
+import polars as pl
 import pytest
-from addr_utils import strip_unit
+from addr_utils import address_key_expr, address_pattern, strip_unit, strip_unit_expr
 
 def test_strip_unit_with_unit_number():
     """Test stripping unit number from addresses with unit numbers."""
@@ -45,4 +48,50 @@ def test_strip_unit_edge_cases():
     assert strip_unit("14/BELLEVUE RD, BELLEVUE HILL 2023") == "BELLEVUE RD, BELLEVUE HILL 2023"
     
     # String with multiple unit numbers (should only remove the first one)
-    assert strip_unit("14/154/123 BELLEVUE RD, BELLEVUE HILL 2023") == "154/123 BELLEVUE RD, BELLEVUE HILL 2023" 
\ No newline at end of file
+    assert strip_unit("14/154/123 BELLEVUE RD, BELLEVUE HILL 2023") == "154/123 BELLEVUE RD, BELLEVUE HILL 2023"
+
+def test_address_pattern():
+    """Test addresses are reduced to the shape of their street part."""
+    assert address_pattern("154 BELLEVUE RD, BELLEVUE HILL 2023") == "N W RD"
+    assert address_pattern("27 A DARVALL RD, EASTWOOD 2122") == "N A W RD"
+    assert address_pattern("603 LAWRENCE HARGRAVE DR, WOMBARRA 2515") == "N W DR"
+    assert address_pattern("12-14 HIGH ST, PENRITH 2750") == "N-N W ST"
+    assert address_pattern("LOT 5 SMITH ST, CAMDEN 2570") == "LOT N W ST"
+    assert address_pattern("SP73961 2519") == "SP#"
+    assert address_pattern(" HAWTHORN ST, TARRAWANNA 2518") == "W ST"
+    assert address_pattern(", BULLI 2516") == "<empty>"
+
+def random_address(rng):
+    """Build a random address, mixing realistic shapes with awkward edge cases."""
+    street = f"{rng.randint(1, 999)}{rng.choice(['', ' A', 'B', '-12'])} {rng.choice(['BELLEVUE', 'ST CLAIR', 'KU-RING-GAI'])} {rng.choice(['RD', 'ST', 'AVE'])}"
+    suburb = rng.choice([", BELLEVUE HILL", ", RYDE", ""])
+    address = rng.choice([
+        f"{street}{suburb}",
+        f"{rng.randint(1, 2000)}/{street}{suburb}",
+        f"{rng.randint(1, 300)}/SP{rng.randint(10000, 99999)}",
+        f"{rng.randint(1, 9)}/{rng.randint(1, 9)}/{street}",
+    ])
+    edge = rng.random()
+    if edge < 0.05:
+        return rng.choice(["", "14/", "14/\n", "/5 X ST", "1// X ST", "1/ X ST", "1/-3 X ST", "1/_X", "١٢/ÉCOLE ST", "12/\n3 X ST"])
+    if edge < 0.1:
+        return address + "\n"
+    return address
+
+def test_strip_unit_expr_matches_strip_unit():
+    """Test the vectorized expression gives the same results as strip_unit over a large corpus."""
+    rng = random.Random(2023)
+    addresses = [random_address(rng) for _ in range(200_000)] + [None]
+    vectorized = pl.DataFrame({"address": addresses}).select(strip_unit_expr("address"))["address"].to_list()
+    assert vectorized == [strip_unit(address) for address in addresses]
+
+def test_address_key_expr_matches_loop():
+    """Test geocoding keys match the f"{strip_unit(address)} {postcode}" loop, including nulls."""
+    rng = random.Random(2112)
+    df = pl.DataFrame(
+        {"address": [random_address(rng) for _ in range(10_000)] + [None, "1/5 X ST"],
+         "post_code": [rng.randint(2000, 2999) for _ in range(10_000)] + [2000, None]},
+        schema={"address": pl.Utf8, "post_code": pl.Int64},
+    )
+    keys = df.select(address_key_expr("address", "post_code"))["address"].to_list()
+    assert keys == [f"{strip_unit(row['address'])} {str(row['post_code'])}" for row in df.iter_rows(named=True)]
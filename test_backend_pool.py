@@ -0,0 +1,81 @@
+import pytest
+from backend_pool import BackendPool
+
+class FakeClock:
+    """A controllable replacement for time.monotonic."""
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    """Create a fake clock starting at a fixed time."""
+    return FakeClock()
+
+def test_routes_to_least_outstanding_backend(clock):
+    """Test requests go to the backend with the fewest requests in flight."""
+    pool = BackendPool(["http://a:8080", "http://b:8080/"], clock=clock)
+    first, second = pool.acquire(), pool.acquire()
+    assert {first.url, second.url} == {"http://a:8080", "http://b:8080"}
+
+    # Once a finishes, it is the only backend without a request in flight
+    a = first if first.url == "http://a:8080" else second
+    pool.release(a, 0.01)
+    assert pool.acquire() is a
+
+def finish(pool, backend, latency=0.01, ok=True):
+    """Send a request to a specific backend and record its outcome."""
+    backend.outstanding += 1
+    pool.release(backend, latency, ok)
+
+def test_ejects_failing_backend_and_readmits_it(clock):
+    """Test a backend is ejected after max_failures errors and back in rotation after eject_seconds."""
+    pool = BackendPool(["http://a:8080", "http://b:8080"], max_failures=2, eject_seconds=30, clock=clock)
+    a, b = pool.backends
+    finish(pool, a, ok=False)
+    assert pool.healthy_count() == 2
+    finish(pool, a, ok=False)
+    assert pool.healthy_count() == 1
+    assert all(pool.acquire() is b for _ in range(5))
+
+    clock.now += 31
+    assert pool.healthy_count() == 2
+    assert pool.acquire() is a
+    # On probation a single failure ejects it again, a single success clears it
+    pool.release(a, 0.01, ok=False)
+    assert pool.healthy_count() == 1
+    clock.now += 31
+    finish(pool, a)
+    assert a.consecutive_failures == 0
+    assert a.stats()["ejections"] == 2
+
+def test_slow_responses_count_as_failures(clock):
+    """Test answers slower than slow_threshold eject a backend like errors do."""
+    pool = BackendPool(["http://a:8080", "http://b:8080"], max_failures=1, slow_threshold=1.0, clock=clock)
+    a = pool.backends[0]
+    finish(pool, a, latency=2.5)
+    assert pool.healthy_count() == 1
+    assert a.stats()["slow"] == 1
+    assert a.stats()["errors"] == 0
+
+def test_uses_soonest_backend_when_all_are_ejected(clock):
+    """Test the pool keeps serving when every backend has been ejected."""
+    pool = BackendPool(["http://a:8080", "http://b:8080"], max_failures=1, eject_seconds=30, clock=clock)
+    a, b = pool.backends
+    finish(pool, a, ok=False)
+    clock.now += 10
+    finish(pool, b, ok=False)
+    assert pool.healthy_count() == 0
+    assert pool.acquire() is a
+
+def test_stats_report_latency_percentiles(clock):
+    """Test per-backend stats summarise requests, errors and latency."""
+    pool = BackendPool(["http://a:8080"], clock=clock)
+    for latency in [0.1, 0.2, 0.3, 0.4]:
+        pool.release(pool.acquire(), latency, ok=latency < 0.4)
+    stats = pool.stats()[0]
+    assert stats["requests"] == 4
+    assert stats["errors"] == 1
+    assert stats["mean_latency"] == pytest.approx(0.25)
+    assert stats["p50_latency"] == pytest.approx(0.25)
@@ -1,152 +1,326 @@
+import json
+import subprocess
+import sys
+
+import click
+import polars as pl
 import pytest
-import redis
 import requests
-import time
-import os
+from click.testing import CliRunner
+
+import metrics
+from benchmark import InMemoryRedis, MockNominatim, in_memory_redis
 from batch_geocode_local import (
-    get_cached_coordinates,
+    CacheWriteBuffer,
+    cli,
     cache_coordinates,
     geocode_address,
-    REDIS_HOST,
-    REDIS_PORT,
-    REDIS_DB,
-    CACHE_EXPIRY
+    get_cached_coordinates,
+    init_redis,
+    main,
+    plan_queries,
+    query_backend,
+    resolve_cached,
+    schedule_ids,
 )
+from backend_pool import BackendPool
+from checkpoint import CheckpointWriter
+from geocode_cache import ERROR, NOT_FOUND, CachedFailure, build_cache
+from result_store import ResultStore
 
 # Test configuration
-TEST_ADDRESS = "14/154 BELLEVUE RD, 2037"
-TEST_ADDRESS_STRIPPED = "154 BELLEVUE RD, 2037"
-NOMINATIM_BASE_URL = "http://localhost:8080"
+TEST_ADDRESS = "154 BELLEVUE RD, BELLEVUE HILL 2023"
+CACHE_EXPIRY = 60 * 60
+
+@pytest.fixture
+def nominatim():
+    """Start a local mock Nominatim server that matches every address except those containing NOWHERE."""
+    with MockNominatim(latency=0, not_found_rate=0, no_match=["NOWHERE"]) as server:
+        yield server
 
-@pytest.fixture(scope="module")
+@pytest.fixture
 def redis_client():
-    """Create a Redis client for testing."""
-    client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
-    # Test connection
-    try:
-        client.ping()
-        print(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
-    except Exception as e:
-        pytest.skip(f"Could not connect to Redis: {e}")
-    return client
-
-@pytest.fixture(scope="module")
-def nominatim_session():
-    """Create a session for Nominatim requests."""
-    session = requests.Session()
-    # Test connection to Nominatim
-    try:
-        response = session.get(f"{NOMINATIM_BASE_URL}/search", params={"q": "Sydney, Australia", "format": "json", "limit": 1})
-        if response.status_code != 200:
-            pytest.skip(f"Could not connect to Nominatim: {response.status_code}")
-        print(f"Connected to Nominatim at {NOMINATIM_BASE_URL}")
-    except Exception as e:
-        pytest.skip(f"Could not connect to Nominatim: {e}")
-    return session
-
-def test_redis_connection(redis_client):
-    """Test that we can connect to Redis."""
-    assert redis_client.ping() is True
-
-def test_nominatim_connection(nominatim_session):
-    """Test that we can connect to Nominatim."""
-    response = nominatim_session.get(f"{NOMINATIM_BASE_URL}/search", params={"q": "Sydney, Australia", "format": "json", "limit": 1})
+    """Create an in-memory stand-in for Redis."""
+    return InMemoryRedis()
+
+@pytest.fixture
+def cache(tmp_path, redis_client):
+    """Create the full tiered cache with the Redis stand-in as its shared tier."""
+    return build_cache(lru_size=100, cache_path=str(tmp_path / "cache.sqlite"), redis_client=redis_client)
+
+def test_nominatim_connection(nominatim):
+    """Test the mock server answers /search like Nominatim."""
+    response = requests.get(f"{nominatim.url}/search", params={"q": "Sydney, Australia", "format": "json", "limit": 1})
     assert response.status_code == 200
     data = response.json()
     assert len(data) > 0
     assert "lat" in data[0]
     assert "lon" in data[0]
 
-def test_cache_coordinates(redis_client):
-    """Test that we can cache coordinates in Redis."""
-    # Clear any existing cache for this test
-    redis_client.delete(f"geocode:{TEST_ADDRESS_STRIPPED}")
-    
-    # Cache coordinates
-    cache_coordinates(TEST_ADDRESS_STRIPPED, -33.123, 151.456)
-    
-    # Verify they were cached
-    cached_data = redis_client.get(f"geocode:{TEST_ADDRESS_STRIPPED}")
-    assert cached_data is not None
-    
-    # Parse the cached data
-    lat, lon = eval(cached_data)
-    assert lat == -33.123
-    assert lon == 151.456
-    
-    # Check TTL is set
-    ttl = redis_client.ttl(f"geocode:{TEST_ADDRESS_STRIPPED}")
-    assert ttl > 0
-    assert ttl <= CACHE_EXPIRY
-
-def test_get_cached_coordinates(redis_client):
-    """Test that we can retrieve cached coordinates from Redis."""
-    # First cache some coordinates
-    redis_client.delete(f"geocode:{TEST_ADDRESS_STRIPPED}")
-    cache_coordinates(TEST_ADDRESS_STRIPPED, -33.123, 151.456)
-    
-    # Now retrieve them
-    coords = get_cached_coordinates(TEST_ADDRESS_STRIPPED)
-    assert coords is not None
-    lat, lon = coords
-    assert lat == -33.123
-    assert lon == 151.456
-
-def test_geocode_address_with_cache(nominatim_session, redis_client):
+def test_cache_coordinates(cache, redis_client):
+    """Test that coordinates are cached in Redis with an expiry."""
+    cache_coordinates(cache, TEST_ADDRESS, -33.123, 151.456, CACHE_EXPIRY)
+
+    assert redis_client.get(f"geocode:{TEST_ADDRESS}") == "[-33.123, 151.456]"
+    ttl = redis_client.ttl(f"geocode:{TEST_ADDRESS}")
+    assert 0 < ttl <= CACHE_EXPIRY
+
+def test_get_cached_coordinates(cache):
+    """Test that cached coordinates can be retrieved."""
+    cache_coordinates(cache, TEST_ADDRESS, -33.123, 151.456, CACHE_EXPIRY)
+    assert get_cached_coordinates(cache, TEST_ADDRESS) == (-33.123, 151.456)
+    assert get_cached_coordinates(cache, "1 NOWHERE ST, 2000") is None
+
+def test_geocode_address_with_cache(nominatim, cache):
     """Test that geocoding uses the cache when available."""
-    # Clear any existing cache
-    redis_client.delete(f"geocode:{TEST_ADDRESS_STRIPPED}")
-    
-    # First geocode (should hit Nominatim)
-    start_time = time.time()
-    address, coords = geocode_address(TEST_ADDRESS, nominatim_session, NOMINATIM_BASE_URL)
-    first_duration = time.time() - start_time
-    
-    assert coords is not None
-    assert coords[0] is not None
-    assert coords[1] is not None
-    
-    # Second geocode (should hit cache)
-    start_time = time.time()
-    address, cached_coords = geocode_address(TEST_ADDRESS, nominatim_session, NOMINATIM_BASE_URL)
-    second_duration = time.time() - start_time
-    
-    assert cached_coords is not None
-    assert cached_coords[0] is not None
-    assert cached_coords[1] is not None
+    address, coords = geocode_address(TEST_ADDRESS, requests.Session(), cache, CACHE_EXPIRY, nominatim.url)
+    assert address == TEST_ADDRESS
+    assert coords[0] is not None and coords[1] is not None
+    assert nominatim.requests == 1
+
+    # The second lookup is answered from the cache
+    _, cached_coords = geocode_address(TEST_ADDRESS, requests.Session(), cache, CACHE_EXPIRY, nominatim.url)
     assert cached_coords == coords
-    
-    # Cache should be faster
-    assert second_duration < first_duration
-
-def test_geocode_address_without_cache(nominatim_session, redis_client):
-    """Test that geocoding works when cache is empty."""
-    # Use a unique address to ensure it's not in cache
-    unique_address = f"TEST ADDRESS {time.time()}"
-    
-    # Clear any existing cache
-    redis_client.delete(f"geocode:{unique_address}")
-    
-    # Geocode (should hit Nominatim)
-    address, coords = geocode_address(unique_address, nominatim_session, NOMINATIM_BASE_URL)
-    
-    # Even if Nominatim doesn't find it, we should get a valid response
-    assert address == unique_address
-    # Note: We don't assert coords values as they might be None if Nominatim doesn't find the address
-
-def test_geocode_address_with_invalid_redis(redis_client, nominatim_session):
-    """Test that geocoding works when Redis is unavailable."""
-    # Temporarily change Redis host to an invalid one
-    original_host = REDIS_HOST
-    import batch_geocode_local
-    batch_geocode_local.REDIS_HOST = "invalid-host"
-    
-    try:
-        # Geocode should still work
-        address, coords = geocode_address(TEST_ADDRESS, nominatim_session, NOMINATIM_BASE_URL)
-        # The address should be stripped of the unit number, not the original address
-        assert address == TEST_ADDRESS_STRIPPED
-        # Note: We don't assert coords values as they might be None if Nominatim doesn't find the address
-    finally:
-        # Restore original Redis host
-        batch_geocode_local.REDIS_HOST = original_host 
\ No newline at end of file
+    assert nominatim.requests == 1
+
+def test_geocode_address_cache_hit_from_batch_run(nominatim, cache):
+    """Test a cache entry written by a geocode run, tier included, comes back as (lat, lon)."""
+    buffer = CacheWriteBuffer(cache, CACHE_EXPIRY)
+    buffer.add(TEST_ADDRESS, (-33.0, 151.0, "structured"), "ok")
+    buffer.flush()
+    assert geocode_address(TEST_ADDRESS, requests.Session(), cache, CACHE_EXPIRY, nominatim.url) == (TEST_ADDRESS, (-33.0, 151.0))
+    assert nominatim.requests == 0
+
+def test_cache_write_buffer_drops_failed_batches():
+    """Test a batch the cache rejects is counted and dropped instead of failing the worker."""
+    class FailingCache:
+        def set_many(self, items, expiry):
+            raise ConnectionError("cache down")
+
+    metrics.REGISTRY.reset()
+    buffer = CacheWriteBuffer(FailingCache(), CACHE_EXPIRY, batch_size=2)
+    buffer.add("1 PITT ST, 2000", (-33.0, 151.0), "ok")
+    buffer.add("2 PITT ST, 2000", (None, None), "not_found")
+    buffer.add("3 PITT ST, 2000", (-33.0, 151.0), "ok")
+    buffer.flush()
+    assert buffer.items == []
+    assert metrics.REGISTRY.counters[("cache_write_errors", ())] == 3
+
+def test_geocode_address_with_invalid_redis(nominatim, tmp_path):
+    """Test that geocoding works with only the local tiers when Redis is unavailable."""
+    redis_client = init_redis("127.0.0.1", 1, 0)
+    assert redis_client is None
+    cache = build_cache(cache_path=str(tmp_path / "cache.sqlite"), redis_client=redis_client)
+
+    address, coords = geocode_address(TEST_ADDRESS, requests.Session(), cache, CACHE_EXPIRY, nominatim.url)
+    assert address == TEST_ADDRESS
+    assert coords[0] is not None
+
+def test_query_backend_retries_transient_errors():
+    """Test 503 answers are retried, and reported as errors once retries run out."""
+    with MockNominatim(latency=0, failure_rate=0.5, not_found_rate=0, seed=3) as server:
+        pool = BackendPool([server.url])
+        results = [query_backend(pool, f"{n} PITT ST, 2000", requests.Session(), max_retries=8, retry_backoff=0.001) for n in range(20)]
+        assert all(status == "ok" for _, _, status in results)
+        assert server.failures > 0
+
+    with MockNominatim(latency=0, failure_rate=1.0) as server:
+        _, coords, status = query_backend(BackendPool([server.url]), TEST_ADDRESS, requests.Session(), max_retries=2, retry_backoff=0.001)
+        assert status == "error"
+        assert coords == (None, None)
+        assert server.requests == 3
+
+def test_plan_queries_skips_tiers_without_their_parts():
+    """Test the planner builds structured and postcode queries from the parts of a key."""
+    plan = dict(plan_queries(TEST_ADDRESS, ("structured", "free_text", "postcode")))
+    assert list(plan) == ["structured", "free_text", "postcode"]
+    assert plan["structured"]["street"] == "154 BELLEVUE RD"
+    assert plan["structured"]["city"] == "BELLEVUE HILL"
+    assert plan["structured"]["postalcode"] == "2023"
+    assert "q" not in plan["structured"] and "street" not in plan["postcode"]
+    # Rows without a postcode have no centroid to fall back to
+    assert [tier for tier, _ in plan_queries("SP73961 None", ("structured", "postcode"))] == ["structured"]
+
+def test_schedule_ids_groups_addresses_by_street():
+    """Test locality order puts a street's addresses together, in house order, and unparsed keys last."""
+    pending = pl.DataFrame({"id": [0, 1, 2, 3, 4], "address": [
+        "8 KULGOA AVE, RYDE 2112", "LOT 5 SMITH ST", "154 BELLEVUE RD, BELLEVUE HILL 2023",
+        "1 PITT ST, RYDE 2112", "6 KULGOA AVENUE, RYDE 2112",
+    ]})
+    assert schedule_ids(pending, "locality") == [2, 4, 0, 3, 1]
+    assert schedule_ids(pending, "unordered") == [0, 1, 2, 3, 4]
+
+def test_main_query_tiers_cascade(tmp_path):
+    """Test each address is found by the first tier that matches, and the output records it."""
+    input_file = tmp_path / "properties.parquet"
+    pl.DataFrame({
+        "address": ["6 KULGOA AVE, RYDE", "LOT 5 KULGOA AVE, RYDE", "1 NOWHERE ST, RYDE"],
+        "post_code": [2112, 2112, 2112],
+    }).write_parquet(input_file)
+    with MockNominatim(latency=0, not_found_rate=0, no_match=["NOWHERE"], structured_no_match=["LOT"]) as server:
+        summary = main.main([str(input_file), str(tmp_path / "geocoded.parquet"), "--nominatim-url", server.url, "--cache-path", "",
+                             "--no-redis", "--query-tiers", "structured,free_text,postcode"], standalone_mode=False)
+        # One structured query, then one more per fallback
+        assert server.requests == 1 + 2 + 3
+    assert summary["geocoded"] == 3
+    tiers = dict(pl.read_parquet(tmp_path / "geocoded.parquet").select("address", "tier").iter_rows())
+    assert tiers == {"6 KULGOA AVE, RYDE 2112": "structured", "LOT 5 KULGOA AVE, RYDE 2112": "free_text", "1 NOWHERE ST, RYDE 2112": "postcode"}
+
+    with pytest.raises(click.BadParameter):
+        main.main([str(input_file), str(tmp_path / "other.parquet"), "--query-tiers", "structured,exact"], standalone_mode=False)
+
+def test_resolve_cached_marks_hits_failures_and_misses(cache, tmp_path):
+    """Test that cache hits are written out, unexpired failures kept and the rest left pending."""
+    now = 1_000_000.0
+    cache.set_many([
+        ("1 FOUND ST, SYDNEY 2000", (-33.8, 151.2)),
+        ("2 NOWHERE ST, SYDNEY 2000", CachedFailure(NOT_FOUND, now - 60)),
+        ("3 FLAKY ST, SYDNEY 2000", CachedFailure(ERROR, now - 2 * 86400)),
+    ], CACHE_EXPIRY)
+    addresses = ["1 FOUND ST, SYDNEY 2000", "2 NOWHERE ST, SYDNEY 2000", "3 FLAKY ST, SYDNEY 2000", "4 NEW ST, SYDNEY 2000"]
+    writer = CheckpointWriter(str(tmp_path / "out.csv"))
+
+    store = ResultStore(pl.Series(addresses))
+    assert resolve_cached(store, cache, writer, batch_size=2, error_expiry=86400, now=now) == 3
+    assert store.frame()["status"].to_list() == ["ok", "not_found", "pending", "pending"]
+    assert writer.buffer == [("1 FOUND ST, SYDNEY 2000", -33.8, 151.2, None)]
+
+    # Retry mode only re-queries expired failures
+    store = ResultStore(pl.Series(addresses))
+    resolve_cached(store, cache, writer, error_expiry=86400, retry_failed=True, now=now)
+    assert store.ids("pending") == [2]
+    assert store.ids("skipped") == [3]
+
+def test_main_end_to_end(nominatim, redis_client, tmp_path):
+    """Test the geocode command from input file to output, then again from a warm cache."""
+    input_file = tmp_path / "properties.parquet"
+    pl.DataFrame({
+        "address": ["14/154 BELLEVUE RD, BELLEVUE HILL", "15/154 BELLEVUE RD, BELLEVUE HILL", "6 KULGOA AVE, RYDE", "1 NOWHERE ST, RYDE"],
+        "post_code": [2023, 2023, 2112, 2112],
+    }).write_parquet(input_file)
+    args = [str(input_file), str(tmp_path / "geocoded.csv"), "--nominatim-url", nominatim.url, "--cache-path", ""]
+
+    with in_memory_redis(redis_client):
+        summary = main.main([*args, "--metrics-json", str(tmp_path / "metrics.json"), "--rows-output", str(tmp_path / "rows.parquet")], standalone_mode=False)
+    assert summary["rows"] == 4
+    assert summary["unique_addresses"] == 3
+    assert summary["cache_hits"] == 0
+    assert nominatim.requests == 3
+    assert summary["geocoded"] == 2
+    # Addresses without a match are left out of the output
+    output = pl.read_csv(tmp_path / "geocoded.csv", separator="\t")
+    assert sorted(output["address"].to_list()) == ["154 BELLEVUE RD, BELLEVUE HILL 2023", "6 KULGOA AVE, RYDE 2112"]
+    # Every input row comes back, units included, with its building's coordinates
+    rows = pl.read_parquet(tmp_path / "rows.parquet")
+    assert rows["address"].to_list() == ["14/154 BELLEVUE RD, BELLEVUE HILL", "15/154 BELLEVUE RD, BELLEVUE HILL", "6 KULGOA AVE, RYDE", "1 NOWHERE ST, RYDE"]
+    assert rows["lat"][0] == rows["lat"][1]
+    assert rows["lat"].null_count() == 1
+    counters = {(c["name"], c["labels"].get("status")): c["value"] for c in json.loads((tmp_path / "metrics.json").read_text())["counters"]}
+    assert counters[("requests", "ok")] == 2
+    assert counters[("requests", "not_found")] == 1
+    assert counters[("cache_misses", None)] == 3
+    assert {"address_keys", "cache_lookup", "http", "parse", "write", "finalize"} <= set(summary["stage_seconds"])
+
+    # A second run finds everything, including the failure, in Redis
+    with in_memory_redis(redis_client):
+        summary = main.main(args, standalone_mode=False)
+    assert summary["cache_hits"] == 3
+    assert summary["queried"] == 0
+    assert nominatim.requests == 3
+    # Stopping the progress reporter takes no time out of the run's timings
+    assert summary["geocoding_seconds"] < 1
+
+def test_main_delta_geocodes_only_new_addresses(nominatim, tmp_path):
+    """Test a delta run on a new release only queries addresses missing from the manifest."""
+    store = str(tmp_path / "geocoded.parquet")
+    first = tmp_path / "release-1.parquet"
+    pl.DataFrame({"address": ["6 KULGOA AVE, RYDE", "1 NOWHERE ST, RYDE"], "post_code": [2112, 2112]}).write_parquet(first)
+    second = tmp_path / "release-2.parquet"
+    pl.DataFrame({"address": ["6 KULGOA AVE, RYDE", "1 NOWHERE ST, RYDE", "2/56 DUXFORD ST, PADDINGTON"], "post_code": [2112, 2112, 2021]}).write_parquet(second)
+    # No cache tiers, so every address not skipped by the manifest reaches the server
+    options = ["--nominatim-url", nominatim.url, "--cache-path", "", "--lru-size", "0", "--no-redis", "--delta"]
+
+    summary = main.main([str(first), store, *options], standalone_mode=False)
+    assert summary["queried"] == 2
+    summary = main.main([str(second), store, *options], standalone_mode=False)
+    assert summary["queried"] == 1
+    assert nominatim.requests == 3
+
+    assert sorted(pl.read_parquet(store)["address"].to_list()) == ["56 DUXFORD ST, PADDINGTON 2021", "6 KULGOA AVE, RYDE 2112"]
+    assert pl.read_parquet(f"{store}.manifest.parquet").height == 3
+
+def test_main_delta_leaves_skipped_addresses_for_the_next_run(tmp_path):
+    """Test addresses a --retry-failed --delta run skips stay out of the manifest, so the next --delta run geocodes them."""
+    store = str(tmp_path / "geocoded.parquet")
+    release = tmp_path / "release.parquet"
+    pl.DataFrame({"address": ["6 KULGOA AVE, RYDE", "8 KULGOA AVE, RYDE"], "post_code": [2112, 2112]}).write_parquet(release)
+    options = ["--cache-path", "", "--lru-size", "0", "--no-redis", "--delta"]
+
+    with MockNominatim(latency=0, not_found_rate=0) as server:
+        # Nothing is cached, so retry mode skips both addresses
+        summary = main.main([str(release), store, "--nominatim-url", server.url, *options, "--retry-failed"], standalone_mode=False)
+        assert summary["queried"] == 0
+        assert pl.read_parquet(f"{store}.manifest.parquet").height == 0
+
+        summary = main.main([str(release), store, "--nominatim-url", server.url, *options], standalone_mode=False)
+        assert summary["queried"] == 2
+        assert server.requests == 2
+    assert pl.read_parquet(f"{store}.manifest.parquet")["address"].to_list() == ["6 KULGOA AVE, RYDE 2112", "8 KULGOA AVE, RYDE 2112"]
+
+def test_async_engine_matches_threads(tmp_path):
+    """Test the async engine writes the same output and cached failures, with the same requests per backend, as threads."""
+    input_file = tmp_path / "properties.parquet"
+    pl.DataFrame({
+        "address": [f"{n} PITT ST, SYDNEY" for n in range(1, 21)] + ["1 NOWHERE ST, RYDE", "2 NOWHERE ST, RYDE"],
+        "post_code": [2000] * 20 + [2112] * 2,
+    }).write_parquet(input_file)
+
+    runs = {}
+    for engine in ("threads", "async"):
+        redis_client = InMemoryRedis()
+        with MockNominatim(latency=0, not_found_rate=0, no_match=["NOWHERE"]) as first, \
+                MockNominatim(latency=0, not_found_rate=0, no_match=["NOWHERE"]) as second, in_memory_redis(redis_client):
+            # One request at a time, so the pool alternates between backends the same way for both engines
+            summary = main.main([
+                str(input_file), str(tmp_path / f"{engine}.csv"), "--nominatim-url", first.url, "--nominatim-url", second.url,
+                "--engine", engine, "--concurrency", "1", "--no-adaptive", "--cache-path", "",
+                "--metrics-json", str(tmp_path / f"{engine}.json"),
+            ], standalone_mode=False)
+            requests_per_backend = (first.requests, second.requests)
+        failures = sorted(key.removeprefix("geocode:") for key, value in redis_client.values.items() if "not_found" in value)
+        counters = {(c["name"], c["labels"].get("status")): c["value"] for c in json.loads((tmp_path / f"{engine}.json").read_text())["counters"]}
+        output = pl.read_csv(tmp_path / f"{engine}.csv", separator="\t").sort("address")
+        runs[engine] = (summary["geocoded"], output, failures, requests_per_backend, counters[("requests", "ok")], counters[("requests", "not_found")])
+
+    geocoded, output, failures, requests_per_backend, ok, not_found = runs["threads"]
+    assert geocoded == 20 and output.height == 20
+    assert failures == ["1 NOWHERE ST, RYDE 2112", "2 NOWHERE ST, RYDE 2112"]
+    assert requests_per_backend == (11, 11)
+    assert (ok, not_found) == (20, 2)
+    assert runs["async"][0] == geocoded
+    assert runs["async"][1].equals(output)
+    assert runs["async"][2:] == runs["threads"][2:]
+
+def test_cache_stats(redis_client):
+    """Test cache-stats counts geocode keys only, buckets their TTLs and reports the hit ratio."""
+    for n, ttl in enumerate([60, 60*60*24*3, 60*60*24*3, 60*60*24*60]):
+        redis_client.setex(f"geocode:{n} PITT ST, 2000", ttl, "[-33.8, 151.2]")
+    redis_client.set("geocode:9 PITT ST, 2000", "[-33.8, 151.2]")
+    redis_client.set("geocode-lease:1 KING ST, 2000", "owner", px=60000)
+    redis_client.incrby("geocode-meta:hits", 3)
+    redis_client.incrby("geocode-meta:misses", 1)
+
+    with in_memory_redis(redis_client):
+        result = CliRunner().invoke(cli, ["cache-stats", "--json"])
+    assert result.exit_code == 0, result.output
+    stats = json.loads(result.output[result.output.index("{"):])
+    assert stats["key_count"] == 5
+    assert stats["ttl_distribution"] == {"< 1 day": 1, "1-7 days": 2, "7-30 days": 0, "> 30 days": 1, "no expiry": 1}
+    assert stats["hit_ratio"] == 0.75
+    assert stats["estimated_memory_bytes"] > 0
+
+def test_import_defers_clients():
+    """Test importing the module loads none of the HTTP and Redis clients."""
+    code = "import sys, batch_geocode_local\nprint([name in sys.modules for name in ('requests', 'httpx', 'redis')])"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[False, False, False]"
@@ -0,0 +1,42 @@
+import pytest
+from addr_utils import address_key_expr
+from benchmark import MockNominatim, compare_results, make_corpus, run_case
+
+def test_make_corpus_is_reproducible():
+    """Test the synthetic corpus depends only on its seed and has units sharing a building."""
+    corpus = make_corpus(5000, seed=1)
+    assert corpus.equals(make_corpus(5000, seed=1))
+    assert corpus.columns == ["address", "post_code"]
+    assert corpus["address"].str.contains("/").any()
+    unique_keys = corpus.select(address_key_expr("address", "post_code")).n_unique()
+    assert 0.3 * corpus.height < unique_keys < corpus.height
+
+def test_run_case_reports_metrics(tmp_path):
+    """Test one benchmark case runs end to end and measures a partly warm cache."""
+    corpus_path = tmp_path / "corpus.parquet"
+    make_corpus(500).write_parquet(corpus_path)
+    with MockNominatim(latency=0) as server:
+        case = run_case(str(corpus_path), server.url, str(tmp_path), warm_fraction=0.5)
+        assert server.requests == case["requests"]
+    assert case["rows"] == 500
+    assert case["cache_hit_ratio"] == pytest.approx(0.5, abs=0.01)
+    # Only cache misses reach the server
+    assert case["requests"] == round(case["unique_addresses"] * (1 - case["cache_hit_ratio"]))
+    assert case["addresses_per_second"] > 0
+    assert case["peak_rss_bytes"] > 0
+
+def test_compare_results_flags_regressions():
+    """Test only changes beyond the tolerance in the wrong direction count as regressions."""
+    case = {"rows": 10000, "engine": "threads", "addresses_per_second": 1000.0, "p99_latency": 0.1, "peak_rss_bytes": 100}
+    baseline = {"results": [case]}
+    slower = {"results": [{**case, "addresses_per_second": 700.0, "p99_latency": 0.05}]}
+    assert len(compare_results(slower, baseline, tolerance=0.2)) == 1
+    assert compare_results({"results": [{**case, "addresses_per_second": 900.0}]}, baseline, tolerance=0.2) == []
+    assert compare_results({"results": [{**case, "engine": "async", "peak_rss_bytes": 1000}]}, baseline) == []
+
+def test_mock_database_cache_counts_locality_misses():
+    """Test queries for another house on a cached street are database cache hits."""
+    server = MockNominatim(latency=0, not_found_rate=0, db_cache=1, miss_latency=0)
+    for address in ["6 KULGOA AVE, RYDE 2112", "8 KULGOA AVE, RYDE 2112", "1 PITT ST, RYDE 2112", "10 KULGOA AVE, RYDE 2112"]:
+        assert server.respond(f"q={address}")[0] == 200
+    assert server.cache_misses == 3
@@ -0,0 +1,34 @@
+import json
+import os
+
+import polars as pl
+from batch_geocode_local import main
+from benchmark import MockNominatim
+from checkpoint import MANIFEST_NAME, CheckpointWriter
+
+def test_resume_after_crash_queries_only_missing_addresses(tmp_path):
+    """Test a crashed run leaves only complete segments in the manifest, and resuming it skips what they hold."""
+    input_file = tmp_path / "properties.parquet"
+    keys = [f"{n} PITT ST, SYDNEY 2000" for n in range(1, 21)]
+    pl.DataFrame({"address": [key.removesuffix(" 2000") for key in keys], "post_code": [2000] * 20}).write_parquet(input_file)
+    output_file = tmp_path / "geocoded.csv"
+
+    # A run that wrote two segments of 5, then crashed with 2 results still buffered
+    writer = CheckpointWriter(str(output_file), chunk_size=5)
+    for key in keys[:12]:
+        writer.add(key, -33.87, 151.21, "free_text")
+    # ...and a third segment half written when it died
+    (tmp_path / "geocoded.csv.parts" / "part-00002.csv.tmp").write_text("address\tlat\n13 PIT")
+    with open(tmp_path / "geocoded.csv.parts" / MANIFEST_NAME) as f:
+        assert [segment["file"] for segment in json.load(f)["segments"]] == ["part-00000.csv", "part-00001.csv"]
+
+    with MockNominatim(latency=0, not_found_rate=0) as server:
+        summary = main.main([str(input_file), str(output_file), "--nominatim-url", server.url, "--no-redis", "--cache-path", "",
+                             "--chunk-size", "5", "--resume"], standalone_mode=False)
+        assert server.requests == 10
+    assert summary["geocoded"] == 20
+
+    output = pl.read_csv(output_file, separator="\t")
+    assert sorted(output["address"].to_list()) == sorted(keys)
+    assert output["address"].n_unique() == 20
+    assert not os.path.exists(f"{output_file}.parts")
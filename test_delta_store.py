@@ -0,0 +1,48 @@
+import polars as pl
+from delta_store import delta_path, load_manifest, manifest_path, merge_into_store, new_keys, update_manifest
+
+def test_manifest_round_trip(tmp_path):
+    """Test keys added to the manifest are skipped by the next run."""
+    store = str(tmp_path / "geocoded.parquet")
+    manifest = load_manifest(store)
+    assert len(manifest) == 0
+
+    assert update_manifest(store, manifest, pl.Series(["6 KULGOA AVE, RYDE 2112", "1 NOWHERE ST, RYDE 2112"])) == 2
+    keys = pl.Series(["6 KULGOA AVE, RYDE 2112", "56 DUXFORD ST, PADDINGTON 2021", "1 NOWHERE ST, RYDE 2112"])
+    assert new_keys(keys, load_manifest(store)).to_list() == ["56 DUXFORD ST, PADDINGTON 2021"]
+
+def test_not_found_keys_leave_manifest_after_negative_expiry(tmp_path):
+    """Test keys with no match are processed again once --negative-expiry has passed, and geocoded keys never."""
+    store = str(tmp_path / "geocoded.parquet")
+    found, not_found = pl.Series(["6 KULGOA AVE, RYDE 2112"]), pl.Series(["1 NOWHERE ST, RYDE 2112"])
+    assert update_manifest(store, load_manifest(store), found, not_found, now=1000.0) == 2
+    assert load_manifest(store, negative_expiry=60, now=1059.0)["address"].to_list() == ["1 NOWHERE ST, RYDE 2112", "6 KULGOA AVE, RYDE 2112"]
+    manifest = load_manifest(store, negative_expiry=60, now=1061.0)
+    assert manifest["address"].to_list() == ["6 KULGOA AVE, RYDE 2112"]
+
+    # Found on the retry, the key is kept for good
+    assert update_manifest(store, manifest, not_found, now=1061.0) == 2
+    assert load_manifest(store, negative_expiry=60, now=10**9)["not_found_at"].null_count() == 2
+
+def test_manifest_is_seeded_from_existing_store(tmp_path):
+    """Test a store written by a full run counts as processed on the first delta run."""
+    store = str(tmp_path / "geocoded.csv")
+    pl.DataFrame({"address": ["6 KULGOA AVE, RYDE 2112"], "lat": [-33.81], "lon": [151.1]}).write_csv(store, separator="\t")
+    assert load_manifest(store)["address"].to_list() == ["6 KULGOA AVE, RYDE 2112"]
+
+def test_merge_into_store_replaces_and_appends(tmp_path):
+    """Test delta results are appended to the store, replacing rows for the same address."""
+    store = str(tmp_path / "geocoded.parquet")
+    delta = delta_path(store)
+    assert delta == str(tmp_path / "geocoded.delta.parquet")
+    pl.DataFrame({"address": ["A 2000", "B 2000"], "lat": [1.0, 2.0], "lon": [1.0, 2.0]}).write_parquet(store)
+    pl.DataFrame({"address": ["B 2000", "C 2000"], "lat": [3.0, 4.0], "lon": [3.0, 4.0]}).write_parquet(delta)
+
+    merge_into_store(store, delta)
+
+    merged = pl.read_parquet(store).sort("address")
+    assert merged["address"].to_list() == ["A 2000", "B 2000", "C 2000"]
+    assert merged["lat"].to_list() == [1.0, 3.0, 4.0]
+    assert not (tmp_path / "geocoded.delta.parquet").exists()
+    assert not (tmp_path / "geocoded.parquet.tmp").exists()
+    assert not (tmp_path / manifest_path("geocoded.parquet")).exists()
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import polars as pl
+from benchmark import InMemoryRedis, MockNominatim, in_memory_redis
+from click.testing import CliRunner
+from etl import cli
+from etl_run import materialize
+from pipeline_io import sink
+
+def test_help_imports_no_command():
+    """Test listing the commands loads none of them, nor polars."""
+    code = "import sys, etl\nfrom click.testing import CliRunner\nCliRunner().invoke(etl.cli, ['--help'])\nprint('polars' in sys.modules, 'batch_geocode_local' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "False"]
+
+def test_run_chains_stages_in_memory(tmp_path):
+    """Test filter, geocode, h3, aggregate and write chained over one input, with side outputs in the same run."""
+    input_file = tmp_path / "nsw.csv"
+    pl.DataFrame({
+        "council_name": ["RYDE", "RYDE", "WOOLLAHRA", "ALBURY"],
+        "address": ["6 KULGOA AVE, RYDE", "8 KULGOA AVE, RYDE", "154 BELLEVUE RD, BELLEVUE HILL", "1 DEAN ST, ALBURY"],
+        "post_code": [2112, 2112, 2023, 2640],
+        "contract_date": ["2021-02-01", "2021-05-01", "2021-03-01", "2021-03-01"],
+        "purchase_price": [1000000, 1200000, 3000000, 500000],
+    }).write_csv(input_file)
+
+    with MockNominatim(latency=0, not_found_rate=0) as nominatim, in_memory_redis(InMemoryRedis()):
+        result = CliRunner().invoke(cli, [
+            "run", "--input", str(input_file),
+            "councils", str(tmp_path / "councils.csv"),
+            "filter", "--councils", "RYDE,WOOLLAHRA",
+            "geocode", "--nominatim-url", nominatim.url, "--cache-path", "", str(tmp_path / "geocoded.parquet"),
+            "h3", "--resolutions", "8,9",
+            "aggregate", "--resolutions", "8,9", str(tmp_path / "cube.parquet"),
+            "write", str(tmp_path / "sales.parquet"),
+        ])
+        assert result.exit_code == 0, result.output
+        assert nominatim.requests == 3
+
+    assert pl.read_csv(tmp_path / "councils.csv")["council_name"].to_list() == ["ALBURY", "RYDE", "WOOLLAHRA"]
+    sales = pl.read_parquet(tmp_path / "sales.parquet")
+    assert sales["address"].to_list() == ["6 KULGOA AVE, RYDE", "8 KULGOA AVE, RYDE", "154 BELLEVUE RD, BELLEVUE HILL"]
+    assert sales["lat"].null_count() == 0
+    assert {"h3_r8", "h3_r9"} <= set(sales.columns)
+    cube = pl.read_parquet(tmp_path / "cube.parquet")
+    assert cube.filter(pl.col("resolution") == 9)["sales"].sum() == 3
+
+def test_materialize_runs_pending_sinks_in_the_same_pass(tmp_path):
+    """Test collecting the rows also writes the outputs waiting on them, once."""
+    lf = pl.LazyFrame({"council_name": ["RYDE", "MOSMAN", "RYDE"]})
+    sinks = [sink(lf.unique().sort("council_name"), str(tmp_path / "councils.csv"), separator=",", lazy=True)]
+    rows = materialize(lf.filter(pl.col("council_name") == "RYDE"), sinks)
+    assert rows.height == 2
+    assert sinks == []
+    assert pl.read_csv(tmp_path / "councils.csv")["council_name"].to_list() == ["MOSMAN", "RYDE"]
@@ -0,0 +1,45 @@
+import polars as pl
+import pytest
+from click.testing import CliRunner
+
+import filter
+import unique_council_names
+
+@pytest.fixture
+def raw_file(tmp_path):
+    """Small stand-in for the raw Kaggle CSV."""
+    path = tmp_path / "nsw.csv"
+    pl.DataFrame({
+        "council_name": ["RYDE", "ALBURY", "MOSMAN", "RYDE", "DUBBO"],
+        "address": ["6 KULGOA AVE, RYDE", "1 DEAN ST, ALBURY", "2 MILITARY RD, MOSMAN", "8 KULGOA AVE, RYDE", "3 MACQUARIE ST, DUBBO"],
+        "post_code": [2112, 2640, 2088, 2112, 2830],
+        "purchase_price": [1000000, 400000, 3000000, 1100000, 350000],
+    }).write_csv(path)
+    return path
+
+def invoke(command, *args):
+    result = CliRunner().invoke(command.main, [str(arg) for arg in args])
+    assert result.exit_code == 0, result.output
+
+def test_filter_keeps_councils(raw_file, tmp_path):
+    """Test the default list keeps Greater Sydney sales, and --councils-file replaces it."""
+    invoke(filter, "--input", raw_file, "--output", tmp_path / "sydney.csv")
+    sydney = pl.read_csv(tmp_path / "sydney.csv", separator="\t")
+    assert sydney["address"].to_list() == ["6 KULGOA AVE, RYDE", "2 MILITARY RD, MOSMAN", "8 KULGOA AVE, RYDE"]
+    assert sydney["purchase_price"].to_list() == [1000000, 3000000, 1100000]
+
+    (tmp_path / "councils.txt").write_text("ALBURY\n\nDUBBO\n")
+    invoke(filter, "--input", raw_file, "--output", tmp_path / "regional.parquet", "--councils-file", tmp_path / "councils.txt")
+    assert pl.read_parquet(tmp_path / "regional.parquet")["council_name"].to_list() == ["ALBURY", "DUBBO"]
+
+def test_councils_output_matches_separate_commands(raw_file, tmp_path):
+    """Test the single-pass --councils-output writes what filter and unique_council_names write on their own."""
+    invoke(filter, "--input", raw_file, "--output", tmp_path / "both.csv", "--councils", "RYDE", "--councils-output", tmp_path / "both-councils.csv")
+    invoke(filter, "--input", raw_file, "--output", tmp_path / "alone.csv", "--councils", "RYDE")
+    invoke(unique_council_names, "--input", raw_file, "--output", tmp_path / "alone-councils.csv")
+
+    councils = pl.read_csv(tmp_path / "alone-councils.csv")
+    assert councils["council_name"].to_list() == ["ALBURY", "DUBBO", "MOSMAN", "RYDE"]
+    assert pl.read_csv(tmp_path / "both-councils.csv").equals(councils)
+    assert (tmp_path / "both.csv").read_text() == (tmp_path / "alone.csv").read_text()
+    assert pl.read_csv(tmp_path / "both.csv", separator="\t")["address"].to_list() == ["6 KULGOA AVE, RYDE", "8 KULGOA AVE, RYDE"]
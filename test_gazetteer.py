@@ -0,0 +1,71 @@
+import polars as pl
+import pytest
+from click.testing import CliRunner
+from batch_geocode_local import cli as geocode_cli
+from benchmark import MockNominatim
+from gazetteer import Gazetteer, cli, parse_keys
+
+def gazetteer_of(coordinates):
+    return Gazetteer.from_coordinates(pl.DataFrame(coordinates, schema=["address", "lat", "lon"], orient="row"))
+
+def test_parse_keys_canonicalizes_variants():
+    """Test spelling, spacing, punctuation and postcode variants of one address parse alike."""
+    parsed = parse_keys(pl.Series([
+        "154 BELLEVUE RD, BELLEVUE HILL 2023",
+        "154 Bellevue Road,  Bellevue  Hill 2023",
+        "154 BELLEVUE RD.,BELLEVUE HILL 2023.0",
+        "154 BELLEVUE RD,BELLEVUE HILL 02023",
+    ]))
+    assert parsed.select("number", "street", "suburb", "postcode").unique().rows() == [("154", "BELLEVUE RD", "BELLEVUE HILL", 2023)]
+    assert parsed["house"].to_list() == [154, 154, 154, 154]
+
+    odd = parse_keys(pl.Series(["12 - 14 SMITH ST, RYDE 2112", "7A HIGH STREET, MOSMAN 2088", "LOT 5 PACIFIC HWY 2077", "1 MAIN ST None"]))
+    assert odd["number"].to_list()[:2] == ["12-14", "7A"]
+    assert odd["street"].to_list()[:2] == ["SMITH ST", "HIGH ST"]
+    assert odd["house"].to_list()[:2] == [None, None]
+    assert odd["postcode"].to_list()[2:] == [None, None]
+
+def test_resolve_exact_and_interpolated():
+    """Test variants resolve to the known coordinates and gaps interpolate on the same side of the street only."""
+    gazetteer = gazetteer_of([
+        ("10 SMITH ST, RYDE 2112", -33.80, 151.10),
+        ("20 SMITH ST, RYDE 2112", -33.82, 151.12),
+        ("11 SMITH ST, RYDE 2112", -33.70, 151.00),
+        ("99 SMITH ST, RYDE 2112", -33.90, 151.30),
+    ])
+    addresses = ["10 SMITH STREET, RYDE 2112", "15 SMITH ST, RYDE 2112", "14 SMITH ST, RYDE 2112", "14 SMITH ST, MOSMAN 2088"]
+
+    exact = gazetteer.resolve(addresses)
+    assert exact.rows() == [("10 SMITH STREET, RYDE 2112", -33.80, 151.10, "exact")]
+
+    resolved = {row[0]: row[1:] for row in gazetteer.resolve(addresses, interpolate=True).iter_rows()}
+    assert resolved["14 SMITH ST, RYDE 2112"] == (pytest.approx(-33.808), pytest.approx(151.108), "interpolated")
+    # 11 and 99 are on the right side but too far apart; Mosman has no known numbers
+    assert set(resolved) == {"10 SMITH STREET, RYDE 2112", "14 SMITH ST, RYDE 2112"}
+    assert "15 SMITH ST, RYDE 2112" in {row[0] for row in gazetteer.resolve(addresses, interpolate=True, max_gap=100).iter_rows()}
+
+def test_geocode_resolves_variants_from_gazetteer(tmp_path):
+    """Test a second batch spelling the same addresses differently needs no Nominatim requests."""
+    first = pl.DataFrame({"address": [f"{n} BELLEVUE RD, BELLEVUE HILL" for n in range(1, 41)], "post_code": [2023] * 40})
+    second = pl.DataFrame({"address": [f"{n} Bellevue Road, Bellevue Hill" for n in range(1, 41)], "post_code": [2023] * 40})
+    first.write_parquet(tmp_path / "first.parquet")
+    second.write_parquet(tmp_path / "second.parquet")
+    cache_path = str(tmp_path / "cache.sqlite")
+    runner = CliRunner()
+    with MockNominatim(latency=0, not_found_rate=0) as server:
+        common = ["--nominatim-url", server.url, "--no-redis", "--cache-path", cache_path]
+        result = runner.invoke(geocode_cli, ["geocode", str(tmp_path / "first.parquet"), str(tmp_path / "first.tsv"), *common])
+        assert result.exit_code == 0, result.output
+        assert server.requests == 40
+
+        result = runner.invoke(cli, ["build", str(tmp_path / "gazetteer.parquet"), "--cache-path", cache_path])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(geocode_cli, ["geocode", str(tmp_path / "second.parquet"), str(tmp_path / "second.tsv"),
+                                             *common, "--gazetteer", str(tmp_path / "gazetteer.parquet")])
+        assert result.exit_code == 0, result.output
+        assert server.requests == 40
+
+    first_coords = pl.read_csv(tmp_path / "first.tsv", separator="\t").sort("address")
+    second_coords = pl.read_csv(tmp_path / "second.tsv", separator="\t").sort("address")
+    assert second_coords.height == 40
+    assert second_coords.select("lat", "lon").sort("lat").equals(first_coords.select("lat", "lon").sort("lat"))
@@ -0,0 +1,52 @@
+import pytest
+from geocode_cache import NOT_FOUND, CachedFailure, LRUCache, SQLiteCache, TieredCache, build_cache
+
+@pytest.fixture
+def sqlite_cache(tmp_path):
+    """Create a SQLite cache tier in a temporary directory."""
+    return SQLiteCache(str(tmp_path / "cache.sqlite"))
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test the in-memory tier stays within its size bound."""
+    cache = LRUCache(max_size=2)
+    cache.set_many([("A", (1.0, 2.0)), ("B", (3.0, 4.0))], 60)
+    # Touch A so that B becomes the least recently used entry
+    assert cache.get_many(["A"]) == {"A": (1.0, 2.0)}
+    cache.set_many([("C", (5.0, 6.0))], 60)
+    assert cache.get_many(["A", "B", "C"]) == {"A": (1.0, 2.0), "C": (5.0, 6.0)}
+
+def test_sqlite_cache_round_trip(sqlite_cache):
+    """Test coordinates written to SQLite can be read back in bulk."""
+    items = [(f"{i} BELLEVUE RD, BELLEVUE HILL 2023", (-33.0 - i, 151.0 + i)) for i in range(2000)]
+    sqlite_cache.set_many(items, 60)
+    hits = sqlite_cache.get_many([address for address, _ in items] + ["MISSING 2000"])
+    assert len(hits) == 2000
+    assert hits["5 BELLEVUE RD, BELLEVUE HILL 2023"] == (-38.0, 156.0)
+
+def test_sqlite_cache_ignores_expired_entries(sqlite_cache):
+    """Test expired entries are treated as misses and can be purged."""
+    sqlite_cache.set_many([("56 DUXFORD ST, PADDINGTON 2021", (-33.88, 151.23))], -1)
+    assert sqlite_cache.get_many(["56 DUXFORD ST, PADDINGTON 2021"]) == {}
+    assert sqlite_cache.purge_expired() == 1
+    assert sqlite_cache.count() == 0
+
+def test_tiered_cache_promotes_lower_tier_hits(sqlite_cache):
+    """Test hits from the persistent tier are copied into the memory tier."""
+    memory = LRUCache()
+    cache = TieredCache([memory, sqlite_cache])
+    sqlite_cache.set_many([("6 KULGOA AVE, RYDE 2112", (-33.81, 151.1))], 60)
+
+    assert cache.get_many(["6 KULGOA AVE, RYDE 2112"]) == {"6 KULGOA AVE, RYDE 2112": (-33.81, 151.1)}
+    assert memory.get_many(["6 KULGOA AVE, RYDE 2112"]) == {"6 KULGOA AVE, RYDE 2112": (-33.81, 151.1)}
+
+def test_tiered_cache_stores_failed_geocodes(sqlite_cache):
+    """Test failed geocodes round-trip as CachedFailure entries through every tier."""
+    failure = CachedFailure(NOT_FOUND, 1234.5)
+    TieredCache([LRUCache(), sqlite_cache]).set_many([("SP73961 2519", failure)], 60)
+    # A fresh memory tier forces the lookup through SQLite's JSON encoding
+    assert TieredCache([LRUCache(), sqlite_cache]).get_many(["SP73961 2519"]) == {"SP73961 2519": failure}
+
+def test_build_cache_without_redis(tmp_path):
+    """Test the cache works with only local tiers."""
+    cache = build_cache(lru_size=10, cache_path=str(tmp_path / "cache.sqlite"), redis_client=None)
+    assert cache.describe() == "memory -> sqlite"
@@ -0,0 +1,61 @@
+import datetime
+import math
+import random
+
+import polars as pl
+import pytest
+from click.testing import CliRunner
+from h3_cube import histogram_path, main
+from h3_index import add_h3_columns
+
+def make_sales(n, seed, start=datetime.date(2020, 1, 1)):
+    rng = random.Random(seed)
+    return pl.DataFrame({
+        "lat": [-33.8 + rng.uniform(-0.05, 0.05) for _ in range(n)],
+        "lon": [151.1 + rng.uniform(-0.05, 0.05) for _ in range(n)],
+        "contract_date": [(start + datetime.timedelta(days=rng.randrange(730))).isoformat() for _ in range(n)],
+        "purchase_price": [int(rng.lognormvariate(13.8, 0.4)) for _ in range(n)],
+    })
+
+def build(tmp_path, sales, cube, *args):
+    path = tmp_path / f"{cube}.sales.parquet"
+    sales.write_parquet(path)
+    result = CliRunner().invoke(main, [str(path), str(tmp_path / cube), *args])
+    assert result.exit_code == 0, result.output
+    return pl.read_parquet(tmp_path / cube)
+
+def test_cube_statistics_and_rollups(tmp_path):
+    """Test percentiles stay within half a price bucket of the exact ones and parents add up their children."""
+    sales = make_sales(3000, seed=1)
+    cube = build(tmp_path, sales, "cube.parquet", "--resolutions", "6,8")
+
+    assert set(cube["resolution"]) == {6, 8}
+    for res in (6, 8):
+        assert cube.filter(pl.col("resolution") == res)["sales"].sum() == 3000
+    # Nearest-rank percentiles of the raw prices of every cell and quarter
+    exact = (
+        add_h3_columns(sales, [6, 8])
+        .group_by(pl.col("h3_r6").alias("cell"), pl.col("contract_date").str.to_date().dt.truncate("1q").alias("quarter"))
+        .agg(pl.col("purchase_price").sort().alias("prices"))
+    )
+    checked = cube.filter(pl.col("resolution") == 6).join(exact, on=["cell", "quarter"])
+    assert checked.height == cube.filter(pl.col("resolution") == 6).height
+    for median, p90, prices in checked.select("median_price", "p90_price", "prices").iter_rows():
+        assert median == pytest.approx(prices[math.ceil(0.5 * len(prices)) - 1], rel=0.0051)
+        assert p90 == pytest.approx(prices[math.ceil(0.9 * len(prices)) - 1], rel=0.0051)
+    assert (cube["p10_price"] <= cube["median_price"]).all() and (cube["median_price"] <= cube["p90_price"]).all()
+    first_periods = cube.sort("quarter").group_by("resolution", "cell", maintain_order=True).first()
+    assert first_periods["price_index"].to_list() == pytest.approx([100.0] * first_periods.height)
+
+def test_update_matches_full_build(tmp_path):
+    """Test adding a second release to a cube gives the same cube as building from all sales at once."""
+    first, second = make_sales(1500, seed=2), make_sales(1500, seed=3, start=datetime.date(2021, 6, 1))
+    full = build(tmp_path, pl.concat([first, second]), "full.parquet", "--period", "month", "--resolutions", "7,9")
+    build(tmp_path, first, "cube.parquet", "--period", "month", "--resolutions", "7,9")
+    # The existing cube's period and resolutions win over the defaults
+    updated = build(tmp_path, second, "cube.parquet", "--update")
+
+    assert (tmp_path / histogram_path("cube.parquet")).exists()
+    assert updated.columns == full.columns
+    assert updated.select(pl.exclude("mean_price")).equals(full.select(pl.exclude("mean_price")))
+    assert updated["mean_price"].to_list() == pytest.approx(full["mean_price"].to_list())
@@ -0,0 +1,60 @@
+import random
+
+import h3
+import polars as pl
+import pytest
+import h3_index
+from h3_index import add_h3_columns, parse_resolutions
+
+@pytest.fixture(params=["polars-h3", "h3"])
+def backend(request, monkeypatch):
+    """Run a test with the polars-h3 plugin and with the plain h3 fallback."""
+    if request.param == "polars-h3":
+        if h3_index.polars_h3 is None:
+            pytest.skip("polars-h3 is not installed")
+    else:
+        monkeypatch.setattr(h3_index, "polars_h3", None)
+    return request.param
+
+def test_add_h3_columns_matches_h3(backend):
+    """Test every resolution equals h3's parent of the finest cell, for points all over the globe."""
+    rng = random.Random(10)
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)] + [(-33.7591, 151.0409)]
+    df = pl.DataFrame({"lat": [lat for lat, _ in points], "lon": [lon for _, lon in points]})
+    resolutions = list(range(16))
+
+    out = add_h3_columns(df.lazy(), resolutions, hex_strings=True).collect()
+
+    for res in resolutions:
+        assert out.schema[f"h3_r{res}"] == pl.UInt64
+        expected = [h3.cell_to_parent(h3.latlng_to_cell(lat, lon, 15), res) for lat, lon in points]
+        assert out[f"h3_r{res}_hex"].to_list() == expected
+        assert out[f"h3_r{res}"].to_list() == [h3.str_to_int(cell) for cell in expected]
+    assert out["h3_r10_hex"][-1] == "8abe0e24e09ffff"
+
+def test_add_h3_columns_keeps_missing_coordinates_null(backend):
+    """Test rows without coordinates get null cells instead of failing."""
+    df = pl.DataFrame({"lat": [-33.8, None, -33.8], "lon": [151.0, 151.0, None]}, schema={"lat": pl.Float64, "lon": pl.Float64})
+    out = add_h3_columns(df, [8, 10])
+    assert out["h3_r8"].null_count() == 2
+    assert out["h3_r10"].null_count() == 2
+
+def test_parse_resolutions():
+    """Test resolutions are deduplicated, sorted and range checked."""
+    assert parse_resolutions("10, 7,8,10") == [7, 8, 10]
+    with pytest.raises(ValueError):
+        parse_resolutions("16")
+    with pytest.raises(ValueError):
+        parse_resolutions("")
+
+def test_fallback_warns_once(monkeypatch, caplog):
+    """Test indexing without polars-h3 warns that it runs the slow h3 fallback, once."""
+    monkeypatch.setattr(h3_index, "polars_h3", None)
+    monkeypatch.setattr(h3_index, "_warned_fallback", False)
+    df = pl.DataFrame({"lat": [-33.8, -33.8], "lon": [151.0, 151.0]})
+    with caplog.at_level("WARNING", logger="h3_index"):
+        add_h3_columns(df, [8])
+        add_h3_columns(df, [9])
+    assert [record.message for record in caplog.records if "polars-h3" in record.message] == [
+        "polars-h3 is not installed, indexing with the much slower h3 fallback (uv sync --extra polars-h3)"
+    ]
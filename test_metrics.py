@@ -0,0 +1,95 @@
+import json
+import random
+import threading
+import time
+
+import pytest
+from metrics import Histogram, JSONSummarySink, PrometheusFileSink, Registry, StackSampler
+
+def test_histogram_quantiles_close_to_exact():
+    """Test bucket-interpolated quantiles stay close to the exact ones."""
+    rng = random.Random(14)
+    values = sorted(rng.lognormvariate(-4, 1) for _ in range(10000))
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * len(values))]
+        assert histogram.quantile(q) == pytest.approx(exact, rel=0.35)
+    assert histogram.count == 10000
+    assert histogram.sum == pytest.approx(sum(values))
+
+def test_histogram_quantile_stays_within_observed_range():
+    """Test a lone observation is reported as itself rather than a bucket bound."""
+    histogram = Histogram()
+    histogram.observe(0.0123)
+    assert histogram.quantile(0.5) == pytest.approx(0.0123)
+    assert histogram.quantile(0.99) == pytest.approx(0.0123)
+
+def test_timer_records_stage_even_on_error():
+    """Test timed blocks are recorded per stage, including ones that raise."""
+    registry = Registry()
+    with registry.timer("http"):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with registry.timer("parse"):
+            raise ValueError("bad json")
+    totals = registry.stage_totals()
+    assert set(totals) == {"http", "parse"}
+    assert totals["http"] >= 0.01
+
+def test_render_prometheus(tmp_path):
+    """Test counters and histograms are exported in the Prometheus text format."""
+    registry = Registry()
+    registry.inc("requests", status="ok")
+    registry.inc("requests", 2, status="ok")
+    registry.inc("requests", status='er"ror')
+    registry.observe("stage_seconds", 0.003, stage="http")
+    registry.observe("stage_seconds", 100.0, stage="http")
+
+    PrometheusFileSink(str(tmp_path / "metrics.prom")).close(registry)
+    lines = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert lines.count("# TYPE geocode_requests_total counter") == 1
+    assert 'geocode_requests_total{status="ok"} 3' in lines
+    assert 'geocode_requests_total{status="er\\"ror"} 1' in lines
+    assert 'geocode_stage_seconds_bucket{stage="http",le="0.0025"} 0' in lines
+    assert 'geocode_stage_seconds_bucket{stage="http",le="0.005"} 1' in lines
+    assert 'geocode_stage_seconds_bucket{stage="http",le="60.0"} 1' in lines
+    assert 'geocode_stage_seconds_bucket{stage="http",le="+Inf"} 2' in lines
+    assert 'geocode_stage_seconds_count{stage="http"} 2' in lines
+
+def test_json_summary_sink(tmp_path):
+    """Test the JSON summary lists counters and histogram percentiles."""
+    registry = Registry()
+    registry.inc("retries", 4)
+    registry.observe("stage_seconds", 0.5, stage="finalize")
+    JSONSummarySink(str(tmp_path / "metrics.json")).close(registry)
+
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary["counters"] == [{"name": "retries", "labels": {}, "value": 4}]
+    [histogram] = summary["histograms"]
+    assert histogram["labels"] == {"stage": "finalize"}
+    assert histogram["count"] == 1
+    assert histogram["p50"] == pytest.approx(0.5)
+
+def test_stack_sampler_sees_worker_threads(tmp_path):
+    """Test the sampling profiler records stacks of threads other than the caller."""
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_worker)
+    thread.start()
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    time.sleep(0.2)
+    sampler.stop()
+    stop.set()
+    thread.join()
+
+    sampler.save(str(tmp_path / "profile.folded"))
+    lines = (tmp_path / "profile.folded").read_text().splitlines()
+    assert any("busy_worker" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
@@ -0,0 +1,46 @@
+import polars as pl
+import pytest
+from pipeline_io import GEOCODED_SCHEMA, detect_format, read, run_sinks, scan, sink, write
+
+@pytest.fixture
+def geocoded():
+    """Create a small frame of geocoded addresses."""
+    return pl.DataFrame(
+        {"address": ["42 ST CLAIR ST, BONNELLS BAY 2264", "6 KULGOA AVE, RYDE 2112"], "lat": [-33.1, -33.81], "lon": [151.5, None]},
+        schema=GEOCODED_SCHEMA,
+    )
+
+def test_detect_format():
+    """Test the format is picked from the extension unless given explicitly."""
+    assert detect_format("out.parquet") == "parquet"
+    assert detect_format("out.ARROW") == "ipc"
+    assert detect_format("out.feather") == "ipc"
+    assert detect_format("out.tsv") == "csv"
+    assert detect_format("out.tsv", "parquet") == "parquet"
+    with pytest.raises(ValueError):
+        detect_format("out.csv", "xlsx")
+
+@pytest.mark.parametrize("name", ["out.csv", "out.parquet", "out.arrow"])
+def test_round_trip_keeps_schema(tmp_path, geocoded, name):
+    """Test every format reads back the same data and types."""
+    path = str(tmp_path / name)
+    write(geocoded, path, GEOCODED_SCHEMA)
+    assert read(path, GEOCODED_SCHEMA).equals(geocoded)
+
+def test_csv_is_read_with_fixed_schema(tmp_path):
+    """Test CSV columns get the stage's types even when the values look like something else."""
+    path = tmp_path / "geocoded.csv"
+    path.write_text("address\tlat\tlon\n12 2000\t-33\t151\n")
+    assert scan(str(path), GEOCODED_SCHEMA).collect_schema() == pl.Schema(GEOCODED_SCHEMA)
+
+def test_run_sinks_writes_every_output(tmp_path, geocoded):
+    """Test lazy sinks in different formats run together from one scan."""
+    source = str(tmp_path / "in.arrow")
+    write(geocoded, source)
+    lf = scan(source, GEOCODED_SCHEMA)
+    run_sinks([
+        sink(lf.filter(pl.col("lon").is_not_null()), str(tmp_path / "a.parquet"), lazy=True),
+        sink(lf.select("address"), str(tmp_path / "b.csv"), lazy=True),
+    ])
+    assert read(str(tmp_path / "a.parquet")).height == 1
+    assert read(str(tmp_path / "b.csv"))["address"].to_list() == geocoded["address"].to_list()
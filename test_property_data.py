@@ -0,0 +1,22 @@
+import polars as pl
+from property_data import join_coordinates
+
+def test_join_coordinates_reaches_every_row():
+    """Test every sale gets its building's coordinates, in input order, with nulls for misses."""
+    rows = pl.LazyFrame({
+        "address": ["14/154 BELLEVUE RD, BELLEVUE HILL", "6 KULGOA AVE, RYDE", "15/154 BELLEVUE RD, BELLEVUE HILL", "1 NOWHERE ST, RYDE", None],
+        "post_code": [2023, 2112, 2023, 2112, 2000],
+        "purchase_price": [1_200_000, 950_000, 1_350_000, 700_000, 1],
+    })
+    geocoded = pl.LazyFrame({
+        "address": ["6 KULGOA AVE, RYDE 2112", "154 BELLEVUE RD, BELLEVUE HILL 2023", "6 KULGOA AVE, RYDE 2112"],
+        "lat": [-33.81, -33.88, -33.81],
+        "lon": [151.10, 151.25, 151.10],
+    })
+
+    out = join_coordinates(rows, geocoded).collect(engine="streaming")
+
+    assert out.columns == ["address", "post_code", "purchase_price", "lat", "lon"]
+    assert out["purchase_price"].to_list() == [1_200_000, 950_000, 1_350_000, 700_000, 1]
+    assert out["lat"].to_list() == [-33.88, -33.81, -33.88, None, None]
+    assert out["lon"].to_list() == [151.25, 151.10, 151.25, None, None]
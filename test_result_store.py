@@ -0,0 +1,18 @@
+import polars as pl
+
+from result_store import ResultStore
+
+
+def test_result_store_tracks_status_by_id():
+    """Test results are kept by id, and selected and counted by status."""
+    store = ResultStore(pl.Series(["A", "B", "C", "D"]))
+    assert len(store) == 4
+    assert store.address(2) == "C"
+    assert [(start, batch) for start, batch in store.batches(3)] == [(0, ["A", "B", "C"]), (3, ["D"])]
+
+    store.set(0, "ok")
+    store.set(1, "not_found")
+    store.set(3, "error")
+    assert store.ids("pending") == [2]
+    assert store.select("not_found", "error").rows() == [(1, "B", "not_found"), (3, "D", "error")]
+    assert store.counts() == {"pending": 1, "ok": 1, "not_found": 1, "error": 1, "skipped": 0}
@@ -0,0 +1,46 @@
+import polars as pl
+from click.testing import CliRunner
+from benchmark import MockNominatim, make_corpus
+from pipeline_io import PROPERTY_SCHEMA
+from run_pipeline import main, partition_dir
+
+def make_sales(path, councils):
+    corpus = make_corpus(300, seed=17)
+    sales = corpus.with_columns(
+        council_name=pl.Series([councils[i % len(councils)] for i in range(corpus.height)]),
+        property_id=pl.int_range(pl.len(), dtype=pl.Int64),
+    )
+    sales = sales.with_columns([pl.lit(None, dtype=dtype).alias(name) for name, dtype in PROPERTY_SCHEMA.items() if name not in sales.columns])
+    sales.select(list(PROPERTY_SCHEMA)).write_csv(path)
+
+def test_partition_dir_matches_hive_encoding():
+    """Test shard directory names are percent-encoded and nulls use the Hive default partition."""
+    assert partition_dir("council_name", "CITY OF SYDNEY") == "council_name=CITY%20OF%20SYDNEY"
+    assert partition_dir("council_name", "A/B") == "council_name=A%2FB"
+    assert partition_dir("post_code", 2000) == "post_code=2000"
+    assert partition_dir("post_code", None) == "post_code=__HIVE_DEFAULT_PARTITION__"
+
+def test_main_writes_partitioned_dataset_and_skips_finished_shards(tmp_path):
+    """Test every kept sale lands in its council's partition with coordinates and H3 cells, and reruns skip done shards."""
+    input_file = tmp_path / "sales.csv"
+    make_sales(input_file, ["CITY OF SYDNEY", "RYDE", "NEWCASTLE"])
+    output_dir = tmp_path / "dataset"
+    runner = CliRunner()
+    with MockNominatim(latency=0) as server:
+        args = [str(output_dir), "--input", str(input_file), "--councils", "CITY OF SYDNEY,RYDE", "--processes", "1",
+                "--resolutions", "8,9", "--", "--nominatim-url", server.url, "--no-redis", "--cache-path", ""]
+        result = runner.invoke(main, args)
+        assert result.exit_code == 0, result.output
+        requests = server.requests
+
+        dataset = pl.read_parquet(output_dir, hive_partitioning=True)
+        assert sorted(p.name for p in output_dir.iterdir()) == ["council_name=CITY%20OF%20SYDNEY", "council_name=RYDE"]
+        assert dataset.height == 200
+        assert set(dataset["council_name"]) == {"CITY OF SYDNEY", "RYDE"}
+        assert {"lat", "lon", "h3_r8", "h3_r9"} <= set(dataset.columns)
+        assert dataset.filter(pl.col("lat").is_not_null())["h3_r9"].null_count() == 0
+        assert not (tmp_path / "dataset.work").exists()
+
+        result = runner.invoke(main, args)
+        assert result.exit_code == 0, result.output
+        assert server.requests == requests
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import polars as pl
+import pytest
+
+from batch_geocode_local import CacheWriteBuffer, main
+from benchmark import InMemoryRedis, MockNominatim, in_memory_redis
+from geocode_cache import RedisCache
+from single_flight import BUSY, CLAIMED, DONE, LocalLeases, SingleFlight
+
+ADDRESS = "6 KULGOA AVE, RYDE 2112"
+
+
+def test_leases_coordinate_runs_through_redis():
+    """Test a second run sees the claim, then the published result, of another run."""
+    redis_client = InMemoryRedis()
+    first = SingleFlight(redis_client, ttl=60, local=LocalLeases())
+    second = SingleFlight(redis_client, ttl=60, local=LocalLeases())
+
+    assert first.claim(ADDRESS) == (CLAIMED, None)
+    assert second.claim(ADDRESS) == (BUSY, None)
+    first.release(ADDRESS, (-33.8, 151.1, "free_text"))
+    # The lease is held until the result is in the Redis cache
+    assert second.claim(ADDRESS) == (BUSY, None)
+    RedisCache(redis_client).set_many([(ADDRESS, (-33.8, 151.1, "free_text"))], 60)
+    first.published([ADDRESS])
+    assert second.claim(ADDRESS) == (DONE, (-33.8, 151.1, "free_text"))
+
+    # Failures cached before a run started are not news to it
+    redis_client.setex("geocode:1 NOWHERE ST, RYDE 2112", 60, '{"status": "not_found", "failed_at": 0}')
+    assert second.claim("1 NOWHERE ST, RYDE 2112") == (CLAIMED, None)
+
+
+def test_published_keeps_leases_of_other_runs():
+    """Test a run whose lease expired does not drop the lease another run has since taken."""
+    redis_client = InMemoryRedis()
+    first = SingleFlight(redis_client, ttl=60, local=LocalLeases())
+    assert first.claim(ADDRESS) == (CLAIMED, None)
+    # The lease expired and another run claimed the address
+    redis_client.set(f"geocode-lease:{ADDRESS}", "other-run", px=60000)
+    first.published([ADDRESS])
+    assert redis_client.get(f"geocode-lease:{ADDRESS}") == "other-run"
+
+    redis_client.set(f"geocode-lease:{ADDRESS}", first.owner, px=60000)
+    first.published([ADDRESS])
+    assert redis_client.get(f"geocode-lease:{ADDRESS}") is None
+
+
+def test_stale_results_are_published_without_new_results():
+    """Test a buffered result's lease is dropped after max_age even when no other result follows it."""
+    redis_client = InMemoryRedis()
+    flight = SingleFlight(redis_client, ttl=60, local=LocalLeases())
+    buffer = CacheWriteBuffer(RedisCache(redis_client), 60, batch_size=1000, single_flight=flight, max_age=0.05)
+    assert flight.claim(ADDRESS) == (CLAIMED, None)
+    buffer.add(ADDRESS, (-33.8, 151.1, "free_text"), "ok")
+    deadline = time.monotonic() + 5
+    while redis_client.get(f"geocode-lease:{ADDRESS}") is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert redis_client.get(f"geocode-lease:{ADDRESS}") is None
+    assert redis_client.get(f"geocode:{ADDRESS}") is not None
+    buffer.close()
+
+
+def test_abandoned_lease_expires():
+    """Test a lease left behind by a crashed run only holds its address for ttl seconds."""
+    redis_client = InMemoryRedis()
+    assert SingleFlight(redis_client, ttl=0.05, local=LocalLeases()).claim(ADDRESS) == (CLAIMED, None)
+    later = SingleFlight(redis_client, ttl=0.05, local=LocalLeases())
+    assert later.claim(ADDRESS) == (BUSY, None)
+    time.sleep(0.1)
+    assert later.claim(ADDRESS) == (CLAIMED, None)
+
+
+def test_redis_errors_fall_back_to_local_leases():
+    """Test a claim that cannot reach Redis goes ahead with only the in-process lease."""
+    class BrokenRedis(InMemoryRedis):
+        def set(self, *args, **kwargs):
+            raise ConnectionError("Redis down")
+
+    flight = SingleFlight(BrokenRedis(), ttl=60, local=LocalLeases())
+    assert flight.claim(ADDRESS) == (CLAIMED, None)
+    assert flight.claim(ADDRESS) == (BUSY, None)
+
+
+class CountingRedis(InMemoryRedis):
+    """InMemoryRedis that counts cache entry writes."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def setex(self, key, seconds, value):
+        self.writes += 1
+        return super().setex(key, seconds, value)
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_concurrent_runs_query_each_address_once(tmp_path, engine):
+    """Test two overlapping runs sharing Redis cost as many requests, and cache writes, as the addresses they cover."""
+    for name, numbers in [("a", range(0, 40)), ("b", range(20, 60))]:
+        pl.DataFrame({"address": [f"{n} PITT ST, SYDNEY" for n in numbers], "post_code": [2000] * 40}).write_parquet(tmp_path / f"{name}.parquet")
+    redis_client = CountingRedis()
+    summaries = {}
+    with MockNominatim(latency=0.02, not_found_rate=0) as server, in_memory_redis(redis_client):
+        def run(name):
+            summaries[name] = main.main([str(tmp_path / f"{name}.parquet"), str(tmp_path / f"{name}.csv"), "--nominatim-url", server.url,
+                                         "--cache-path", "", "--lru-size", "0", "--concurrency", "4", "--no-adaptive", "--engine", engine], standalone_mode=False)
+        threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert server.requests == 60
+    # Each run caches the addresses it covers once, coalesced ones included
+    assert redis_client.writes == 80
+    assert summaries["a"]["geocoded"] == summaries["b"]["geocoded"] == 40
+    a = pl.read_csv(tmp_path / "a.csv", separator="\t")
+    b = pl.read_csv(tmp_path / "b.csv", separator="\t")
+    shared = a.join(b, on="address")
+    assert shared.height == 20
+    assert (shared["lat"] == shared["lat_right"]).all()
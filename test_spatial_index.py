@@ -0,0 +1,67 @@
+import random
+
+import h3
+import polars as pl
+import pytest
+from spatial_index import SpatialIndex, cli
+
+def random_points(n, seed, lat=-33.87, lon=151.1, spread=0.05):
+    rng = random.Random(seed)
+    return pl.DataFrame({"lat": [lat + rng.uniform(-spread, spread) for _ in range(n)],
+                         "lon": [lon + rng.uniform(-spread, spread) for _ in range(n)]})
+
+def brute_force(points, query):
+    return sorted((h3.great_circle_distance(query, point, unit="m"), row_id) for row_id, point in enumerate(points.iter_rows()))
+
+@pytest.mark.parametrize("radius", [50, 400, 3000, 30000])
+def test_radius_matches_brute_force(radius):
+    """Test radius queries find exactly the points a full scan finds, at fine and coarse resolutions."""
+    points = random_points(3000, seed=1)
+    queries = random_points(20, seed=2)
+    index = SpatialIndex.build(points)
+    result = index.radius(queries, radius)
+    for query_id, query in enumerate(queries.iter_rows()):
+        expected = [row_id for distance, row_id in brute_force(points, query) if distance <= radius]
+        found = result.filter(pl.col("query_id") == query_id)
+        assert sorted(found["row_id"]) == sorted(expected)
+        assert found["distance"].is_sorted()
+
+def test_radius_per_query_column_and_missing_coordinates():
+    """Test radii can come from a column and queries without coordinates return nothing."""
+    points = random_points(5000, seed=3)
+    queries = pl.DataFrame({"lat": [-33.87, None, -33.86], "lon": [151.1, 151.1, 151.09], "radius": [100.0, 100.0, 2000.0]})
+    result = SpatialIndex.build(points, resolution=10).radius(queries, "radius")
+    assert 1 not in result["query_id"].to_list()
+    for query_id, radius in ((0, 100), (2, 2000)):
+        expected = sum(d <= radius for d, _ in brute_force(points, queries.row(query_id)[:2]))
+        assert expected > 0
+        assert result.filter(pl.col("query_id") == query_id).height == expected
+
+def test_knn_matches_brute_force_and_save_load(tmp_path):
+    """Test k nearest neighbours equal a full scan, for queries near and far from the data, after a round trip to disk."""
+    points = random_points(2000, seed=4).with_columns(property_id=pl.int_range(1000, 3000))
+    queries = pl.concat([random_points(10, seed=5), pl.DataFrame({"lat": [-35.3], "lon": [149.1]})])
+    SpatialIndex.build(points, id_column="property_id").save(tmp_path / "index.parquet")
+    index = SpatialIndex.load(tmp_path / "index.parquet")
+    result = index.knn(queries, 5)
+    for query_id, query in enumerate(queries.iter_rows()):
+        expected = [row_id + 1000 for _, row_id in brute_force(points.select("lat", "lon"), query)[:5]]
+        assert result.filter(pl.col("query_id") == query_id)["row_id"].to_list() == expected
+
+    nearby = index.knn(queries, 5, max_distance=10000)
+    assert nearby.filter(pl.col("query_id") == 10).height == 0
+
+def test_cli_build_and_query(tmp_path):
+    """Test the CLI builds an index from a file and answers a file of queries."""
+    from click.testing import CliRunner
+    random_points(200, seed=6).write_parquet(tmp_path / "points.parquet")
+    random_points(3, seed=7).write_parquet(tmp_path / "queries.parquet")
+    runner = CliRunner()
+    result = runner.invoke(cli, ["build", str(tmp_path / "points.parquet"), str(tmp_path / "index.parquet")])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(cli, ["query", str(tmp_path / "index.parquet"), str(tmp_path / "queries.parquet"),
+                                 str(tmp_path / "matches.parquet"), "--k", "4"])
+    assert result.exit_code == 0, result.output
+    matches = pl.read_parquet(tmp_path / "matches.parquet")
+    assert matches.columns == ["query_id", "row_id", "distance"]
+    assert matches.height == 12
@@ -2,15 +2,21 @@
 Extract unique council names from Sydney property data
 """
 
-import polars as pl
+import click
 
-# Read the CSV file
-df = pl.read_csv("large-files/nsw_property_data.csv")
+from pipeline_io import FORMATS, sink
+from property_data import DEFAULT_INPUT, scan_property_data, unique_councils
 
-# Get unique council names
-unique_councils = df.select("council_name").unique().sort("council_name")
+@click.command()
+@click.option('--input', 'input_file', default=DEFAULT_INPUT, type=click.Path(exists=True), help='Raw Kaggle NSW property data (CSV, Parquet or Arrow IPC)')
+@click.option('--input-separator', default=',', help='Input file separator')
+@click.option('--output', 'output_file', default='unique_council_names.csv', help='Where to save the council names')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Output format (default: from the file extension, else csv)')
+def main(input_file, input_separator, output_file, fmt):
+    """Extract unique council names, reading only the council_name column."""
+    # Projection pushdown means only council_name is parsed from the input
+    sink(unique_councils(scan_property_data(input_file, input_separator)), output_file, fmt=fmt, separator=",")
+    print(f"Extracted unique council names to {output_file}")
 
-# Save to a CSV file using polars
-unique_councils.write_csv("unique_council_names.csv")
-
-print(f"Extracted {len(unique_councils)} unique council names to unique_council_names.txt") 
\ No newline at end of file
+if __name__ == "__main__":
+    main()